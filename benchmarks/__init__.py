@@ -0,0 +1,30 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmarks for the YAMLTrak library, run against synthetic mercurial
+# repositories generated locally (see generate.py), so that no network access
+# is needed.  From the top of the source tree:
+#
+#   python -m benchmarks --issues 2000 --output results.json
+#
+# Each operation is timed in a fresh process, once cold and then repeatedly
+# warm, and the results, with latency percentiles and peak memory, are
+# written as JSON so that runs can be compared over time.  The comparison
+# with a stored baseline, failing on regressions, is in compare.py:
+#
+#   python -m benchmarks.compare --save     (before a change)
+#   python -m benchmarks.compare            (after it)
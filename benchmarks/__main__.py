@@ -0,0 +1,45 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import with_statement
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from yamltrak.argparse import ArgumentParser
+from benchmarks import generate, run
+
+
+def main():
+    parser = ArgumentParser(prog='python -m benchmarks',
+        description='Time the YAMLTrak library against a generated repository.')
+    generate.add_options(parser)
+    run.add_options(parser)
+    parser.add_argument('-o', '--output', default=None,
+        help='Write the results to this file, as JSON.')
+    args = parser.parse_args()
+
+    results = run.run(cache=args.cache, operations=args.operations, repeat=args.repeat,
+                      trials=args.trials, processes=args.processes, edits=args.edits,
+                      **generate.parameters(args))
+    run.report(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
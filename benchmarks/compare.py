@@ -0,0 +1,214 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# A regression gate comparing the benchmarks with stored baseline results.
+# Baselines are kept per generated repository, and are only meaningful on the
+# machine they were recorded on, so record one before making changes:
+#
+#   python -m benchmarks.compare --save
+#   (make changes)
+#   python -m benchmarks.compare
+#
+# An operation has slowed down when its warm samples are larger than the
+# baseline's according to a one sided Mann-Whitney U test, its median is worse
+# by more than the threshold and by more than the floor, and the median of
+# every trial is worse than that of every baseline trial.  Samples taken in
+# the same process aren't independent of each other, which the last check
+# makes up for.  So neither noise nor tiny but consistent differences fail
+# the gate.  Memory has grown when the median peak is up by more than its
+# threshold and by more than a megabyte.  The concurrent writers are compared
+# the same way on the time of each edit, lock waits included, and regress as
+# well when an edit was lost.  The exit status is 1 if anything regressed,
+# and 2 if there is no baseline.
+from __future__ import with_statement
+import sys
+from math import erfc, sqrt
+from os import path, makedirs
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from yamltrak.argparse import ArgumentParser
+from benchmarks import generate, run
+
+BASELINES = path.join(path.dirname(path.abspath(__file__)), 'baselines')
+
+
+def mann_whitney(before, after):
+    """\
+    Return the one sided p-value of the samples after being larger than the
+    samples before, from the normal approximation to the Mann-Whitney U test,
+    corrected for ties.
+    """
+    combined = sorted([(value, 0) for value in before] + [(value, 1) for value in after])
+    count = len(combined)
+    if not before or not after or count < 3:
+        return 1.0
+
+    # Tied values share the average of their ranks.
+    ranks = [0.0] * count
+    ties = 0.0
+    start = 0
+    while start < count:
+        end = start
+        while end + 1 < count and combined[end + 1][0] == combined[start][0]:
+            end += 1
+        for position in range(start, end + 1):
+            ranks[position] = (start + end) / 2.0 + 1
+        tied = end - start + 1
+        ties += tied ** 3 - tied
+        start = end + 1
+
+    first, second = len(before), len(after)
+    u = sum(rank for rank, (value, group) in zip(ranks, combined) if group) - second * (second + 1) / 2.0
+    variance = first * second / 12.0 * ((count + 1) - ties / (count * (count - 1)))
+    if variance <= 0:
+        return 1.0
+    # With a continuity correction.
+    z = (u - first * second / 2.0 - 0.5) / sqrt(variance)
+    return 0.5 * erfc(z / sqrt(2))
+
+
+def compare(baseline, results, alpha=0.01, threshold=0.10, memory=0.10, floor=0.0001):
+    """\
+    Compare the results with the baseline, returning a row for each
+    operation in both, with the 'status' of the operation: 'slower',
+    'memory', 'lost' (concurrent edits were lost), 'faster' or 'ok'.
+    Differences in the median of less than floor seconds are ignored.  The
+    writers have no memory figures, and against a baseline recorded before
+    their edits were timed one by one, they are only checked for lost edits.
+    """
+    rows = []
+    for name in sorted(set(baseline['operations']) & set(results['operations'])):
+        before, after = baseline['operations'][name], results['operations'][name]
+        row = {'operation': name, 'status': 'ok', 'memory_before': None, 'memory_after': None}
+        if name == 'writers':
+            if 'samples' not in before:
+                row.update(before=before['seconds'] / before['edits'],
+                           after=after['seconds'] / after['edits'], pvalue=None)
+                if after['lost']:
+                    row['status'] = 'lost'
+                rows.append(row)
+                continue
+        else:
+            row.update(memory_before=before['peak_kb'] / 1024.0,
+                       memory_after=after['peak_kb'] / 1024.0)
+
+        row.update(before=before['p50'], after=after['p50'],
+                   pvalue=mann_whitney(before['samples'], after['samples']))
+        significant = abs(row['after'] - row['before']) > floor
+        beforemedians = before.get('medians') or [before['p50']]
+        aftermedians = after.get('medians') or [after['p50']]
+        if (significant and row['pvalue'] < alpha and
+            row['after'] > row['before'] * (1 + threshold) and
+            min(aftermedians) > max(beforemedians)):
+            row['status'] = 'slower'
+        elif (row['memory_after'] is not None and
+              row['memory_after'] > row['memory_before'] * (1 + memory) and
+              row['memory_after'] - row['memory_before'] > 1):
+            row['status'] = 'memory'
+        elif (significant and mann_whitney(after['samples'], before['samples']) < alpha and
+              row['after'] < row['before'] / (1 + threshold) and
+              max(aftermedians) < min(beforemedians)):
+            row['status'] = 'faster'
+        if name == 'writers' and after['lost']:
+            row['status'] = 'lost'
+        rows.append(row)
+    return rows
+
+
+def regressed(rows):
+    return [row for row in rows if row['status'] in ('slower', 'memory', 'lost')]
+
+
+def report(rows, output=sys.stdout):
+    """Write a table of the comparison, for people."""
+    output.write('%-12s %10s %10s %8s %8s %9s %9s  %s\n' % (
+        'OPERATION', 'BEFORE MS', 'AFTER MS', 'CHANGE', 'P', 'MB BEFORE', 'MB AFTER', 'STATUS'))
+    for row in rows:
+        change = row['before'] and '%+.1f%%' % ((row['after'] / row['before'] - 1) * 100) or '-'
+        output.write('%-12s %10.2f %10.2f %8s %8s %9s %9s  %s\n' % (
+            row['operation'], row['before'] * 1000, row['after'] * 1000, change,
+            row['pvalue'] is not None and '%.4f' % row['pvalue'] or '-',
+            row['memory_before'] is not None and '%.1f' % row['memory_before'] or '-',
+            row['memory_after'] is not None and '%.1f' % row['memory_after'] or '-',
+            row['status'] in ('ok', 'faster') and row['status'] or row['status'].upper()))
+
+
+def main():
+    parser = ArgumentParser(prog='python -m benchmarks.compare',
+        description='Compare the YAMLTrak benchmarks with a stored baseline, '
+        'exiting with status 1 on a regression.')
+    generate.add_options(parser)
+    run.add_options(parser, trials=3)
+    parser.add_argument('-b', '--baseline', default=None,
+        help='The baseline results file.  Defaults to one for the repository '
+        'parameters in %s.' % BASELINES)
+    parser.add_argument('--save', default=False, action='store_true',
+        help='Record the results as the baseline instead of comparing.')
+    parser.add_argument('--alpha', type=float, default=0.01,
+        help='The significance level for a slowdown.  Defaults to 0.01.')
+    parser.add_argument('--threshold', type=float, default=0.10,
+        help='The relative slowdown of the median tolerated.  Defaults to 0.10.')
+    parser.add_argument('--memory', type=float, default=0.10,
+        help='The relative growth of the peak memory tolerated.  Defaults to 0.10.')
+    parser.add_argument('--floor', type=float, default=0.1,
+        help='Ignore changes in the median smaller than this many '
+        'milliseconds.  Defaults to 0.1.')
+    args = parser.parse_args()
+
+    parameters = generate.parameters(args)
+    baselinefile = args.baseline or path.join(BASELINES, generate.key(**parameters) + '.json')
+    baseline = None
+    if not args.save:
+        try:
+            with open(baselinefile) as stored:
+                baseline = json.load(stored)
+        except IOError:
+            sys.stderr.write('No baseline at %s, record one with --save\n' % baselinefile)
+            sys.exit(2)
+        if baseline['repository'] != dict(generate.DEFAULTS, **parameters):
+            sys.stderr.write('The baseline at %s was recorded for another repository\n' % baselinefile)
+            sys.exit(2)
+
+    operations = args.operations
+    if operations is None and baseline is not None:
+        operations = sorted(baseline['operations'])
+    results = run.run(cache=args.cache, operations=operations, repeat=args.repeat,
+                      trials=args.trials, processes=args.processes, edits=args.edits,
+                      **parameters)
+    if args.save:
+        if not path.isdir(path.dirname(path.abspath(baselinefile))):
+            makedirs(path.dirname(path.abspath(baselinefile)))
+        with open(baselinefile, 'w') as output:
+            json.dump(results, output, indent=1, sort_keys=True)
+        run.report(results)
+        sys.stdout.write('\nRecorded the baseline at %s\n' % baselinefile)
+        return
+
+    rows = compare(baseline, results, args.alpha, args.threshold, args.memory, args.floor / 1000)
+    report(rows)
+    failures = regressed(rows)
+    if failures:
+        sys.stdout.write('\n%d of %d operations regressed: %s\n' % (
+            len(failures), len(rows), ', '.join(row['operation'] for row in failures)))
+        sys.exit(1)
+    sys.stdout.write('\nNo regressions in %d operations\n' % len(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# Generation of synthetic repositories with an issue database.  Everything is
+# derived from a seed, so that the same parameters always give the same
+# repository, and repositories are kept in a cache folder keyed on their
+# parameters, since large ones take a while to build.
+from __future__ import with_statement
+import random
+import shutil
+from hashlib import sha1
+from os import path, makedirs
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import yaml
+from mercurial import hg, ui, commands as hgcommands
+from yamltrak import IssueDB, _index_issue
+
+# The defaults give a repository that builds in a few seconds.
+DEFAULTS = {
+    'issues': 500,          # Number of issues
+    'revisions': 3,         # Committed revisions of each issue
+    'batch': 50,            # Issues changed by each linked commit
+    'commits': 50,          # Unrelated commits touching only code
+    'files': 20,            # Code files in the repository
+    'description': 200,     # Characters in each description, which are indexed
+    'fields': 50,           # Extra fields in the skeleton
+    'groups': 5,            # Distinct groups, named sprint-N
+    'seed': 0}
+USER = 'YAMLTrak Benchmark <benchmark@localhost>'
+# Commits are dated a day apart, ending at this unix time.
+EPOCH = 1262304000
+PARAMETERS = 'benchmark.json'
+# Generating is mostly dumping YAML, which the C emitter does much faster.
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+WORDS = ('index issue estimate priority group status parse commit revision '
+         'filelog manifest changeset cache stream archive lock writer reader '
+         'skeleton migrate purge query cursor burndown related').split()
+
+
+def key(**parameters):
+    """Return the name of the cached repository for the given parameters."""
+    parameters = dict(DEFAULTS, **parameters)
+    return '-'.join('%s%s' % (name, parameters[name]) for name in sorted(DEFAULTS))
+
+
+def _ui():
+    quiet = ui.ui()
+    quiet.setconfig('ui', 'quiet', 'true')
+    quiet.setconfig('ui', 'username', USER)
+    return quiet
+
+
+def _issue(rand, parameters, number):
+    words = []
+    while len(' '.join(words)) < parameters['description']:
+        words.append(rand.choice(WORDS))
+    return {
+        'title': 'Issue %d: %s' % (number, ' '.join(rand.sample(WORDS, 4))),
+        'description': ' '.join(words)[:parameters['description']],
+        'estimate': '%d %s' % (rand.randint(1, 8), rand.choice(['hours', 'days', 'weeks'])),
+        'status': rand.random() < 0.3 and 'closed' or 'open',
+        'group': 'sprint-%d' % rand.randrange(parameters['groups']),
+        'priority': rand.choice(['high', 'normal', 'low']),
+        'comment': ''}
+
+
+def _write(filename, data):
+    with open(filename, 'w') as output:
+        yaml.dump(data, output, Dumper=SafeDumper, default_flow_style=False)
+
+
+def generate(root, **parameters):
+    """\
+    Build a repository at root with an issue database, and return it opened
+    as an IssueDB.  The parameters, with their defaults in DEFAULTS, set the
+    number of issues, how many times each is committed (each time in a batch
+    along with a code file, which relates them), the unrelated code commits
+    interleaved with those, and the size of the descriptions, which sets the
+    size of the index.
+    """
+    parameters = dict(DEFAULTS, **parameters)
+    rand = random.Random(parameters['seed'])
+    quiet = _ui()
+    repo = hg.repository(quiet, root, create=True)
+
+    code = [path.join('src', 'module%03d.py' % number) for number in range(parameters['files'])]
+    makedirs(path.join(root, 'src'))
+    for filename in code:
+        with open(path.join(root, filename), 'w') as output:
+            output.write('# %s\n' % filename)
+    hgcommands.add(quiet, repo, *[path.join(root, filename) for filename in code])
+
+    # Each unrelated commit follows one of the linked commits, chosen at random.
+    batches = parameters['revisions'] * -(-parameters['issues'] // parameters['batch'])
+    unrelated = [0] * (batches + 1)
+    for count in range(parameters['commits']):
+        unrelated[rand.randrange(batches + 1)] += 1
+    dates = iter(range(EPOCH - (batches + parameters['commits'] + 2) * 86400, EPOCH + 1, 86400))
+
+    def commit(message):
+        repo.commit(text=message, user=USER, date='%d 0' % dates.next())
+
+    def touch(filename, message):
+        with open(path.join(root, filename), 'a') as output:
+            output.write('# %s\n' % message)
+
+    commit('Add the code')
+    for count in range(unrelated.pop()):
+        touch(rand.choice(code), 'Unrelated change')
+        commit('Unrelated change')
+
+    issuedb = IssueDB(root, dbinit=True)
+    skeleton = dict(issuedb.skeleton)
+    for number in range(parameters['fields']):
+        skeleton['field%02d' % number] = 'An extra field for benchmarking'
+    _write(issuedb._skeletonfile, skeleton)
+    with open(issuedb._indexfile) as indexfile:
+        index = yaml.safe_load(indexfile)
+
+    folder = path.join(root, issuedb.dbfolder)
+    ids = [sha1('%s-%d' % (parameters['seed'], number)).hexdigest()
+           for number in range(parameters['issues'])]
+    issues = dict((id, _issue(rand, parameters, number)) for number, id in enumerate(ids))
+    for revision in range(parameters['revisions']):
+        order = ids[:]
+        rand.shuffle(order)
+        for start in range(0, len(order), parameters['batch']):
+            batch = order[start:start + parameters['batch']]
+            for id in batch:
+                issue = issues[id]
+                if revision:
+                    issue['comment'] = 'Revision %d' % revision
+                    if rand.random() < 0.2:
+                        issue['status'] = issue['status'] == 'open' and 'closed' or 'open'
+                _write(path.join(folder, id), issue)
+                index[id] = _index_issue(index['skeleton'], issue)
+            if not revision:
+                hgcommands.add(quiet, repo, *[path.join(folder, id) for id in batch])
+            # The index is committed along with each batch, as burndown reads
+            # its history.
+            _write(issuedb._indexfile, index)
+            linked = rand.choice(code)
+            touch(linked, 'Work on %d issues' % len(batch))
+            commit('Work on %s' % linked)
+            for count in range(unrelated.pop()):
+                touch(rand.choice(code), 'Unrelated change')
+                commit('Unrelated change')
+
+    if not ids or not parameters['revisions']:
+        # The database still needs committing.
+        commit('Add the issue database')
+    with open(path.join(root, '.hg', PARAMETERS), 'w') as output:
+        json.dump(parameters, output)
+    return IssueDB(root)
+
+
+def cached(cache, **parameters):
+    """\
+    Return the path of a repository generated with the given parameters,
+    inside the cache folder, generating it only if it isn't there already.
+    """
+    root = path.join(cache, key(**parameters))
+    try:
+        with open(path.join(root, '.hg', PARAMETERS)) as stored:
+            if json.load(stored) == dict(DEFAULTS, **parameters):
+                return root
+    except (IOError, ValueError):
+        pass
+    # Whatever is there is stale, or was left half built.
+    if path.exists(root):
+        shutil.rmtree(root)
+    makedirs(root)
+    generate(root, **parameters)
+    return root
+
+
+def copy(root, destination):
+    """\
+    Copy the generated repository, for operations that change it, and return
+    the path of the copy.
+    """
+    shutil.copytree(root, destination, symlinks=True)
+    return destination
+
+
+def add_options(parser):
+    """Add a command line option for each of the generation parameters."""
+    for name in sorted(DEFAULTS):
+        parser.add_argument('--' + name, type=int, default=DEFAULTS[name],
+            help='Repository generation parameter, defaults to %d.' % DEFAULTS[name])
+    parser.add_argument('--cache', default=None,
+        help='Keep generated repositories in this folder.  Defaults to one in '
+        'the temporary folder.')
+
+
+def parameters(args):
+    """The generation parameters given on the command line."""
+    return dict((name, getattr(args, name)) for name in DEFAULTS)
@@ -0,0 +1,334 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# Timing of the library operations.  Every operation is measured in a process
+# of its own, so that the first call really is cold (nothing parsed or cached
+# yet, though the operating system will have the files in memory), and so
+# that the peak memory reported belongs to that operation alone.  Operations
+# that write are given their own copy of the repository.
+from __future__ import with_statement
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from os import path
+from time import time, strftime, gmtime
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from benchmarks import generate
+
+OPERATIONS = ['open', 'issues', 'issue', 'related', 'burndown', 'stats', 'new',
+              'edit', 'parse_list', 'parse_edit']
+WRITES = set(['new', 'edit', 'writers'])
+PERCENTILES = [50, 90, 99]
+# Warm samples of fast operations time enough calls to last about this long,
+# so that the timer's resolution doesn't swamp them.
+SAMPLE_TIME = 0.005
+SOURCE = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def _operation(name, root):
+    """\
+    Set up the named operation against the repository at root, and return a
+    function running it once.  Nothing is read through the library here, so
+    that the first call finds its caches empty.
+    """
+    from yamltrak import IssueDB, ISSUEID
+    if name == 'open':
+        return lambda: IssueDB(root)
+
+    issuedb = IssueDB(root)
+    ids = sorted(id for id in os.listdir(path.join(root, issuedb.dbfolder)) if ISSUEID.match(id))
+    if name in ('issue', 'edit') and not ids:
+        raise ValueError('The %s benchmark needs a repository with issues' % name)
+    if name == 'issues':
+        return lambda: issuedb.issues()
+    if name == 'issue':
+        return lambda: issuedb.issue(ids[0], detail=True)
+    if name == 'related':
+        return lambda: issuedb.related([path.join('src', 'module000.py')], detail=True)
+    if name == 'burndown':
+        return lambda: issuedb.burndown('sprint-0')
+    if name == 'stats':
+        return lambda: issuedb.stats(by=['group', 'priority'])
+    if name == 'new':
+        # New fills in the rest from the skeleton.
+        return lambda: issuedb.new({'title': 'A benchmark issue'})
+    if name == 'edit':
+        edits = iter(xrange(sys.maxint))
+        def edit():
+            count = edits.next()
+            return issuedb.edit(ids[count % len(ids)], {'comment': 'Benchmark %d' % count})
+        return edit
+    if name.startswith('parse_'):
+        from yamltrak.commands import build_parser
+        command = name[len('parse_'):]
+        return lambda: build_parser(issuedb, command).parse_args([command])
+    raise ValueError('No such operation: %s' % name)
+
+
+def _peak():
+    """The peak resident memory of this process so far, in kilobytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes there.
+        peak //= 1024
+    return peak
+
+
+def measure(name, root, repeat):
+    """\
+    Time the named operation once cold and then repeat times warm, in this
+    process.  Returns the cold time, the warm samples in seconds per call,
+    the number of calls timed for each sample, and the peak memory before
+    and after, in kilobytes.
+    """
+    operation = _operation(name, root)
+    base = _peak()
+    start = time()
+    operation()
+    cold = time() - start
+    start = time()
+    operation()
+    number = max(1, min(1000, int(SAMPLE_TIME / max(time() - start, 1e-6))))
+    if name in WRITES:
+        # Each call changes the repository, so we don't want too many.
+        number = 1
+    samples = []
+    for count in xrange(repeat):
+        start = time()
+        for call in xrange(number):
+            operation()
+        samples.append((time() - start) / number)
+    return {'cold': cold, 'samples': samples, 'number': number,
+            'base_kb': base, 'peak_kb': _peak()}
+
+
+def write(root, writer, edits, ids):
+    """\
+    Edit the given issues in turn, as one of several concurrent writers, and
+    return the final comment expected for each, the seconds each edit took,
+    and the lock waits.
+    """
+    from yamltrak import IssueDB
+    issuedb = IssueDB(root)
+    expected = {}
+    samples = []
+    for count in xrange(edits):
+        id = ids[count % len(ids)]
+        expected[id] = 'Writer %d edit %d' % (writer, count)
+        start = time()
+        issuedb.edit(id, {'comment': expected[id]})
+        samples.append(time() - start)
+    return {'expected': expected, 'samples': samples, 'lockstats': issuedb.lockstats}
+
+
+def _child():
+    """Run one measurement, as asked on the command line, printing JSON."""
+    request = json.loads(sys.argv[1])
+    # Mercurial wants byte strings for paths.
+    root = str(request['root'])
+    if request['name'] == 'writer':
+        result = write(root, request['writer'], request['edits'], map(str, request['ids']))
+    else:
+        result = measure(str(request['name']), root, request['repeat'])
+    sys.stdout.write(json.dumps(result))
+
+
+def _spawn(request):
+    """Start a child process running the given measurement."""
+    environ = dict(os.environ)
+    environ['PYTHONPATH'] = os.pathsep.join([SOURCE] + filter(None, [environ.get('PYTHONPATH')]))
+    environ.setdefault('HGUSER', generate.USER)
+    return subprocess.Popen([sys.executable, '-c', 'from benchmarks.run import _child; _child()',
+                             json.dumps(request)], stdout=subprocess.PIPE, env=environ)
+
+
+def _collect(child):
+    output = child.communicate()[0]
+    if child.returncode:
+        raise RuntimeError('Benchmark process failed with status %d' % child.returncode)
+    return json.loads(output)
+
+
+def percentile(samples, percent):
+    """The given percentile of the samples, interpolating between ranks."""
+    samples = sorted(samples)
+    if not samples:
+        return None
+    rank = (len(samples) - 1) * percent / 100.0
+    low = int(rank)
+    high = min(low + 1, len(samples) - 1)
+    return samples[low] + (samples[high] - samples[low]) * (rank - low)
+
+
+def summarize(trials):
+    """\
+    Combine the measurements of an operation from each trial, with the
+    statistics describing all of the warm samples.  The cold time and memory
+    are the medians across trials, and are kept for each trial as well.
+    """
+    samples = [sample for trial in trials for sample in trial['samples']]
+    mean = samples and sum(samples) / len(samples) or None
+    summary = {'samples': samples, 'trials': len(trials), 'number': trials[0]['number'],
+               'medians': [percentile(trial['samples'], 50) for trial in trials]}
+    for name in ('cold', 'base_kb', 'peak_kb'):
+        values = [trial[name] for trial in trials]
+        summary[name + 's'] = values
+        summary[name] = percentile(values, 50)
+    summary['mean'] = mean
+    summary['stdev'] = len(samples) > 1 and (
+        sum((sample - mean) ** 2 for sample in samples) / (len(samples) - 1)) ** 0.5 or 0.0
+    summary['ops'] = mean and 1 / mean or None
+    for percent in PERCENTILES:
+        summary['p%d' % percent] = percentile(samples, percent)
+    summary['peak_mb'] = summary['peak_kb'] / 1024.0
+    summary['growth_mb'] = (summary['peak_kb'] - summary['base_kb']) / 1024.0
+    return summary
+
+
+def writers(root, processes=8, edits=5):
+    """\
+    Run the given number of writer processes at once against the repository,
+    each editing its own issues, and check that no edit was lost.  Returns
+    the wall time, the edits made per second, the seconds each edit took
+    (lock waits included) as samples, the lock waits, and the number of
+    issues whose final edit is 'lost', from the index or the issue file.
+    """
+    from yamltrak import IssueDB
+    ids = sorted(IssueDB(root).issues())
+    shares = [ids[writer::processes][:max(1, edits // 4)] for writer in range(processes)]
+    start = time()
+    children = [_spawn({'name': 'writer', 'root': root, 'writer': writer,
+                        'edits': edits, 'ids': shares[writer]})
+                for writer in range(processes)]
+    results = [_collect(child) for child in children]
+    seconds = time() - start
+
+    issuedb = IssueDB(root)
+    index = issuedb.issues()
+    lost = 0
+    for result in results:
+        for id, comment in result['expected'].iteritems():
+            issue = issuedb.issue(id, detail=False)[0]['data']
+            if issue.get('comment') != comment or index.get(id, {}).get('comment', comment) != comment:
+                lost += 1
+    return {'seconds': seconds, 'edits': processes * edits,
+            'ops': processes * edits / seconds, 'lost': lost,
+            'samples': [sample for result in results for sample in result['samples']],
+            'waited': sum(result['lockstats']['waited'] for result in results),
+            'longest': max(result['lockstats']['longest'] for result in results)}
+
+
+def _combine_writers(trials):
+    """\
+    Combine the results of the concurrent writers from each trial, with the
+    edit samples of every trial and the median edit of each, like summarize.
+    """
+    seconds = percentile([trial['seconds'] for trial in trials], 50)
+    samples = [sample for trial in trials for sample in trial['samples']]
+    return {'trials': trials, 'seconds': seconds, 'edits': trials[0]['edits'],
+            'samples': samples, 'p50': percentile(samples, 50),
+            'medians': [percentile(trial['samples'], 50) for trial in trials],
+            'ops': trials[0]['edits'] / seconds,
+            'lost': sum(trial['lost'] for trial in trials),
+            'waited': sum(trial['waited'] for trial in trials),
+            'longest': max(trial['longest'] for trial in trials)}
+
+
+def run(cache=None, operations=None, repeat=20, trials=1, processes=8, edits=5, **parameters):
+    """\
+    Generate (or reuse from the cache folder) a repository with the given
+    parameters and run the benchmarks against it, returning the results.
+    Operations defaults to all of them, along with the concurrent writers:
+    the given number of processes making the given number of edits each.
+    Each operation is run in the given number of trials, each one a fresh
+    process, timing it repeat times once warm.
+    """
+    if cache is None:
+        cache = path.join(tempfile.gettempdir(), 'yamltrak-benchmarks')
+    if operations is None:
+        operations = OPERATIONS + ['writers']
+    started = time()
+    root = generate.cached(cache, **parameters)
+    results = {'meta': {'date': strftime('%Y-%m-%dT%H:%M:%SZ', gmtime()),
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'generate': time() - started},
+               'repository': dict(generate.DEFAULTS, **parameters),
+               'repeat': repeat,
+               'trials': trials,
+               'operations': {}}
+
+    scratch = tempfile.mkdtemp(prefix='yamltrak-benchmark-')
+    try:
+        for name in operations:
+            measured = []
+            for trial in range(trials):
+                target = root
+                if name in WRITES:
+                    target = generate.copy(root, path.join(scratch, '%s-%d' % (name, trial)))
+                if name == 'writers':
+                    measured.append(writers(target, processes, edits))
+                else:
+                    measured.append(_collect(_spawn({'name': name, 'root': target, 'repeat': repeat})))
+            if name == 'writers':
+                results['operations'][name] = _combine_writers(measured)
+            else:
+                results['operations'][name] = summarize(measured)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+
+def add_options(parser, trials=1):
+    """Add the command line options choosing what to run, and how often."""
+    parser.add_argument('--operations', default=None, type=lambda names: names.split(','),
+        help='Run only these comma separated benchmarks, out of %s.'
+        % ', '.join(OPERATIONS + ['writers']))
+    parser.add_argument('--repeat', type=int, default=20,
+        help='Time each operation this many times once warm.  Defaults to 20.')
+    parser.add_argument('--trials', type=int, default=trials,
+        help='Run each operation in this many fresh processes.  Defaults to %d.' % trials)
+    parser.add_argument('--processes', type=int, default=8,
+        help='The number of concurrent writers.  Defaults to 8.')
+    parser.add_argument('--edits', type=int, default=5,
+        help='The number of edits made by each writer.  Defaults to 5.')
+
+
+def report(results, output=sys.stdout):
+    """Write a table of the results, for people."""
+    output.write('%-12s %10s %10s %10s %10s %10s %10s\n' % (
+        'OPERATION', 'COLD MS', 'P50 MS', 'P90 MS', 'P99 MS', 'OPS/S', 'PEAK MB'))
+    for name in sorted(results['operations']):
+        result = results['operations'][name]
+        if name == 'writers':
+            continue
+        output.write('%-12s %10.2f %10.2f %10.2f %10.2f %10.1f %10.1f\n' % (
+            name, result['cold'] * 1000, result['p50'] * 1000, result['p90'] * 1000,
+            result['p99'] * 1000, result['ops'], result['peak_mb']))
+    writers = results['operations'].get('writers')
+    if writers:
+        output.write('\nwriters: %d edits in %.2fs (%.1f/s), median edit %.2fms, %d lost, '
+                     'longest lock wait %.3fs\n' % (
+            writers['edits'], writers['seconds'], writers['ops'], writers['p50'] * 1000,
+            writers['lost'], writers['longest']))
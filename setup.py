@@ -51,7 +51,9 @@ setup(name='YAMLTrak',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: GNU Library or Lesser General Public License (LGPL)',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 2.5',
+        'Programming Language :: Python :: 2',
+        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 2 :: Only',
         'Topic :: Software Development :: Bug Tracking',
       ], # Get strings from http://pypi.python.org/pypi?%3Aaction=list_classifiers
       keywords='',
@@ -62,6 +64,8 @@ setup(name='YAMLTrak',
       packages=['yamltrak'],
       include_package_data=True,
       zip_safe=True,
+      # OrderedDict, math.erfc and the futures backport all need 2.7.
+      python_requires='>=2.7, <3',
       install_requires=[
           # -*- Extra requirements: -*-
           "PyYaml==3.08",
@@ -69,5 +73,9 @@ setup(name='YAMLTrak',
           "Mercurial>=1.2",
           "termcolor==0.1.1",
       ],
+      extras_require={
+          # AsyncIssueDB needs concurrent.futures, which Python 2 lacks.
+          'async': ["futures"],
+      },
       scripts=['scripts/yt'],
       )
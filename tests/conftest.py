@@ -0,0 +1,45 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+from mercurial import hg, ui
+from yamltrak import IssueDB
+
+USER = 'YAMLTrak Tests <tests@localhost>'
+
+
+def make_repository(root, issues=0):
+    """\
+    Create a mercurial repository at root with an issue database holding the
+    given number of open issues, all committed, and return their ids.
+    """
+    repo = hg.repository(ui.ui(), root, create=True)
+    issuedb = IssueDB(root, dbinit=True)
+    repo.commit(text='Add the issue database', user=USER)
+    ids = [issuedb.new({'title': 'Issue %d' % number}) for number in range(issues)]
+    repo.commit(text='Add the issues', user=USER)
+    return ids
+
+
+@pytest.fixture
+def repository(tmpdir, monkeypatch):
+    """A function creating a repository in a temporary folder, returning its path and issue ids."""
+    # Child processes commit as well, so they need a user too.
+    monkeypatch.setenv('HGUSER', USER)
+    def create(issues=0):
+        root = str(tmpdir.join('repo'))
+        return root, make_repository(root, issues)
+    return create
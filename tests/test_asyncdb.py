@@ -0,0 +1,114 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+futures = pytest.importorskip('concurrent.futures')
+from yamltrak.asyncdb import AsyncIssueDB
+
+
+class ManualExecutor(object):
+    """An executor that only runs what was submitted when asked to."""
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, function, *args, **kwargs):
+        future = futures.Future()
+        self.submitted.append((future, function, args, kwargs))
+        return future
+
+    def run(self):
+        while self.submitted:
+            future, function, args, kwargs = self.submitted.pop(0)
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception, e:
+                future.set_exception(e)
+
+
+def test_shared_reads_run_once(repository):
+    root, ids = repository(2)
+    executor = ManualExecutor()
+    asyncdb = AsyncIssueDB(root, executor=executor)
+    first, second = asyncdb.issues(), asyncdb.issues()
+    assert first is not second
+    assert len(executor.submitted) == 1
+    executor.run()
+    assert sorted(first.result()) == sorted(second.result()) == sorted(ids)
+
+
+def test_cancelling_one_caller_spares_the_others(repository):
+    root, ids = repository(2)
+    executor = ManualExecutor()
+    # With one slot taken by the first call, the shared one has to wait.
+    asyncdb = AsyncIssueDB(root, executor=executor, limit=1)
+    blocking = asyncdb.issue(ids[0])
+    first, second = asyncdb.issues(), asyncdb.issues()
+    assert first.cancel()
+    executor.run()
+    executor.run()
+    assert blocking.result()
+    assert first.cancelled()
+    assert sorted(second.result()) == sorted(ids)
+
+
+def test_cancelled_calls_are_skipped(repository):
+    root, ids = repository(2)
+    executor = ManualExecutor()
+    asyncdb = AsyncIssueDB(root, executor=executor, limit=1)
+    blocking = asyncdb.issue(ids[0])
+    first, second = asyncdb.issues(), asyncdb.issues()
+    first.cancel()
+    second.cancel()
+    executor.run()
+    assert len(executor.submitted) == 0
+    assert blocking.result()
+    # The slot was handed back, so later calls still run.
+    later = asyncdb.issues()
+    executor.run()
+    assert sorted(later.result()) == sorted(ids)
+
+
+def test_shared_reads_get_copies(repository):
+    root, ids = repository(2)
+    executor = ManualExecutor()
+    asyncdb = AsyncIssueDB(root, executor=executor)
+    first, second = asyncdb.issues(), asyncdb.issues()
+    # Sorted results come back in an OrderedDict, which marshal can't copy.
+    third, fourth = asyncdb.issues(sort=['id']), asyncdb.issues(sort=['id'])
+    executor.run()
+    assert first.result() == second.result()
+    assert first.result() is not second.result()
+    first.result()[ids[0]]['title'] = 'Changed'
+    assert second.result()[ids[0]]['title'] != 'Changed'
+    assert third.result() == fourth.result()
+    assert list(fourth.result()) == sorted(ids)
+    third.result()[ids[0]]['title'] = 'Changed'
+    assert fourth.result()[ids[0]]['title'] != 'Changed'
+
+
+def test_limit_is_shared_by_root(repository):
+    root, ids = repository(2)
+    executor = ManualExecutor()
+    first = AsyncIssueDB(root, executor=executor, limit=1)
+    second = AsyncIssueDB(root, executor=executor, limit=1)
+    blocking = first.issue(ids[0])
+    waiting = second.issue(ids[1])
+    # The second database has to wait for the slot the first one holds.
+    assert len(executor.submitted) == 1
+    executor.run()
+    assert blocking.result()
+    assert waiting.result()
@@ -0,0 +1,70 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+from mercurial import hg, ui, util
+from yamltrak import IssueDB
+from conftest import USER
+
+# The commit dates, as unix timestamps, of the database and the two issues.
+CREATED, FIRST, SECOND = 1000000000, 1100000000, 1200000000
+
+
+@pytest.fixture
+def history(tmpdir, monkeypatch):
+    """\
+    A repository with an issue committed at FIRST and another at SECOND,
+    returning the database, the changeset adding the first issue, and the ids.
+    """
+    monkeypatch.setenv('HGUSER', USER)
+    root = str(tmpdir.join('repo'))
+    repo = hg.repository(ui.ui(), root, create=True)
+    issuedb = IssueDB(root, dbinit=True)
+    repo.commit(text='Add the issue database', user=USER, date='%d 0' % CREATED)
+    first = issuedb.new({'title': 'First'})
+    firstnode = repo.commit(text='Add the first issue', user=USER, date='%d 0' % FIRST)
+    second = issuedb.new({'title': 'Second'})
+    repo.commit(text='Add the second issue', user=USER, date='%d 0' % SECOND)
+    return issuedb, repo[firstnode], first, second
+
+
+def test_at_revision(history):
+    issuedb, firstctx, first, second = history
+    assert sorted(issuedb.issues(at=str(firstctx.rev()))) == [first]
+    assert sorted(issuedb.issues(at=firstctx.hex())) == [first]
+    assert sorted(issuedb.issues(at='tip')) == sorted([first, second])
+    assert issuedb.issues(at='0') == {}
+
+
+def test_at_date_string(history):
+    issuedb, firstctx, first, second = history
+    assert sorted(issuedb.issues(at='2005-01-01')) == [first]
+    assert sorted(issuedb.issues(at='2010-01-01')) == sorted([first, second])
+    assert issuedb.issues(at='2000-01-01') == {}
+
+
+@pytest.mark.parametrize('kind', [float, int, long])
+def test_at_timestamp(history, kind):
+    issuedb, firstctx, first, second = history
+    assert sorted(issuedb.issues(at=kind(FIRST))) == [first]
+    assert sorted(issuedb.issues(at=kind(SECOND))) == sorted([first, second])
+    assert issuedb.issues(at=kind(CREATED - 1)) == {}
+
+
+def test_at_invalid(history):
+    issuedb, firstctx, first, second = history
+    with pytest.raises(util.Abort):
+        issuedb.issues(at='not a revision or a date')
@@ -0,0 +1,190 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import yaml
+from mercurial import hg, ui
+from yamltrak import IssueDB
+
+
+def _files(root):
+    """The contents of every file in the database folder, and the repository status."""
+    folder = os.path.join(root, 'issues')
+    contents = {}
+    for name in os.listdir(folder):
+        with open(os.path.join(folder, name)) as issuefile:
+            contents[name] = issuefile.read()
+    return contents, hg.repository(ui.ui(), root).status()[:4]
+
+
+def _index(root, name='issues.yaml'):
+    with open(os.path.join(root, 'issues', name)) as indexfile:
+        return yaml.safe_load(indexfile)
+
+
+def _commit(root, message):
+    hg.repository(ui.ui(), root).commit(text=message)
+
+
+def _check_stats(issuedb):
+    """The totals kept up to date along the way match freshly computed ones."""
+    fresh = IssueDB(issuedb.root)
+    for by, status in [(['group'], 'open'), (['priority'], 'closed'), (['status'], '')]:
+        assert sorted(issuedb.stats(by, status)) == sorted(fresh.stats(by, status))
+
+
+def test_archive_round_trip(repository):
+    root, ids = repository(4)
+    issuedb = IssueDB(root)
+    # Prime the totals, so that they are kept up to date from here on.
+    _check_stats(issuedb)
+    closed = sorted(ids[:2])
+    for id in closed:
+        issuedb.close(id)
+    _commit(root, 'Close two issues')
+
+    assert issuedb.archive(days=0, dryrun=True) == closed
+    assert issuedb.archive(days=0) == closed
+    index, archive = _index(root), _index(root, 'archive.yaml')
+    assert not set(closed) & set(index)
+    assert set(closed) <= set(archive)
+    assert sorted(issuedb.issues(status='closed')) == closed
+    assert sorted(issuedb.issues()) == sorted(ids[2:])
+    _check_stats(issuedb)
+
+    # Reopening an archived issue moves it back to the index.
+    issuedb.edit(closed[0], {'status': 'open'})
+    assert closed[0] in _index(root)
+    assert sorted(issuedb.issues()) == sorted(ids[2:] + closed[:1])
+    assert sorted(issuedb.issues(status='closed')) == closed[1:]
+    _check_stats(issuedb)
+
+
+def test_archive_dry_run_changes_nothing(repository):
+    root, ids = repository(2)
+    issuedb = IssueDB(root)
+    issuedb.close(ids[0])
+    _commit(root, 'Close an issue')
+    before = _files(root)
+    assert issuedb.archive(days=0, dryrun=True) == [ids[0]]
+    assert _files(root) == before
+    # Recently changed issues stay put.
+    assert issuedb.archive(days=1) == []
+    assert _files(root) == before
+
+
+def test_update_where_is_idempotent(repository):
+    root, ids = repository(4)
+    issuedb = IssueDB(root)
+    _check_stats(issuedb)
+    low = sorted(ids[:2])
+    for id in low:
+        issuedb.edit(id, {'group': 'later'})
+
+    assert issuedb.update_where({'group': 'later'}, {'priority': 'low'}) == low
+    assert all(_index(root)[id]['priority'] == 'low' for id in low)
+    _check_stats(issuedb)
+    # Nothing changes the second time, so nothing is written.
+    before = _files(root)
+    assert issuedb.update_where({'group': 'later'}, {'priority': 'low'}) == []
+    assert _files(root) == before
+
+    assert issuedb.close_where(lambda id, issue: issue.get('priority') == 'low') == low
+    assert sorted(issuedb.issues(status='closed')) == low
+    _check_stats(issuedb)
+
+
+def test_update_where_dry_run_changes_nothing(repository):
+    root, ids = repository(3)
+    issuedb = IssueDB(root)
+    before = _files(root)
+    assert issuedb.update_where({'status': 'open'}, {'priority': 'low'}, dryrun=True) == sorted(ids)
+    assert issuedb.close_where({'status': 'open'}, dryrun=True) == sorted(ids)
+    assert _files(root) == before
+
+
+def test_purge_by_prefix_and_where(repository):
+    root, ids = repository(4)
+    issuedb = IssueDB(root)
+    _check_stats(issuedb)
+    first = ids[0]
+    assert issuedb.purge(first[:10]) == [first]
+    assert first not in _index(root)
+    assert not os.path.exists(os.path.join(root, 'issues', first))
+    removed = _files(root)[1][2]
+    assert removed == ['issues/' + first]
+    _check_stats(issuedb)
+
+    grouped = sorted(ids[1:3])
+    for id in grouped:
+        issuedb.edit(id, {'group': 'spam'})
+    assert issuedb.purge(where={'group': 'spam'}) == grouped
+    assert sorted(id for id in _index(root) if id != 'skeleton') == [ids[3]]
+    assert sorted(issuedb.issues()) == [ids[3]]
+    _check_stats(issuedb)
+    # Purging what is already gone does nothing.
+    assert issuedb.purge(where={'group': 'spam'}) == []
+
+
+def test_purge_dry_run_changes_nothing(repository):
+    root, ids = repository(3)
+    issuedb = IssueDB(root)
+    before = _files(root)
+    assert issuedb.purge([id[:10] for id in ids[:2]], dryrun=True) == sorted(ids[:2])
+    assert issuedb.purge(where={'status': 'open'}, dryrun=True) == sorted(ids)
+    assert _files(root) == before
+
+
+def test_migrate(repository):
+    root, ids = repository(3)
+    issuedb = IssueDB(root)
+    _check_stats(issuedb)
+    for id in ids:
+        issuedb.edit(id, {'priority': id == ids[0] and 'normal' or 'high'})
+    report = issuedb.migrate(add={'severity': 'minor'}, rename={'group': 'team'},
+                             drop=['description'], transform={'priority': {'high': 'urgent'}},
+                             index={'severity': 'How bad it is'}, processes=1)
+    assert report['migrated'] == sorted(ids)
+    assert report['unreadable'] == {}
+
+    for id in ids:
+        issue = issuedb.issue(id, detail=False)[0]['data']
+        assert issue['severity'] == 'minor'
+        assert 'group' not in issue and issue['team'] == 'unfiled'
+        assert 'description' not in issue
+        assert issue['priority'] == (id == ids[0] and 'normal' or 'urgent')
+    skeleton = IssueDB(root).skeleton
+    assert 'severity' in skeleton and 'team' in skeleton
+    assert 'group' not in skeleton and 'description' not in skeleton
+
+    index = _index(root)
+    assert index['skeleton']['severity'] == 'How bad it is'
+    assert all(index[id]['severity'] == 'minor' and index[id]['team'] == 'unfiled'
+               for id in ids)
+    assert IssueDB(root).fsck(processes=1)['stale'] == {}
+    _check_stats(issuedb)
+
+
+def test_migrate_dry_run_changes_nothing(repository):
+    root, ids = repository(3)
+    issuedb = IssueDB(root)
+    before = _files(root)
+    report = issuedb.migrate(add={'severity': 'minor'}, drop=['description'],
+                             index={'severity': 'How bad it is'}, dryrun=True, processes=1)
+    assert report['migrated'] == sorted(ids)
+    assert _files(root) == before
+    # Nothing needs migrating when nothing changes.
+    assert issuedb.migrate(transform={'priority': {'nonexistent': 'low'}}, processes=1)['migrated'] == []
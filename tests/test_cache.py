@@ -0,0 +1,57 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import os
+from yamltrak import _ParsedFileCache, _atomic_write
+
+
+def test_same_size_rewrite_keeping_the_times(tmpdir):
+    filename = str(tmpdir.join('issue'))
+    _atomic_write(filename, 'priority: high\n')
+    info = os.stat(filename)
+    cache = _ParsedFileCache()
+    assert cache.load(filename) == {'priority': 'high'}
+
+    # The same size, the same modification time, and the same inode.
+    with open(filename, 'w') as issuefile:
+        issuefile.write('priority: norm\n')
+    os.utime(filename, (info.st_atime, info.st_mtime))
+    assert os.stat(filename).st_ino == info.st_ino
+    assert cache.load(filename) == {'priority': 'norm'}
+
+
+def test_callers_get_copies(tmpdir):
+    filename = str(tmpdir.join('issue'))
+    _atomic_write(filename, 'priority: high\n')
+    cache = _ParsedFileCache()
+    first = cache.load(filename)
+    first['priority'] = 'low'
+    assert cache.load(filename) == {'priority': 'high'}
+    assert len(cache._entries) == 1
+
+
+def test_least_recently_used_goes_first(tmpdir):
+    filenames = [str(tmpdir.join(name)) for name in 'abc']
+    for filename in filenames:
+        _atomic_write(filename, 'priority: high\n')
+    # Room for two of the files.
+    cache = _ParsedFileCache(maxsize=2 * len('priority: high\n'))
+    first, second, third = filenames
+    cache.load(first)
+    cache.load(second)
+    cache.load(first)
+    cache.load(third)
+    assert list(cache._entries) == [first, third]
@@ -0,0 +1,88 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+from os import path
+from mercurial import hg, ui, commands as hgcommands
+from yamltrak import IssueDB
+
+
+def _quiet():
+    quiet = ui.ui()
+    quiet.setconfig('ui', 'quiet', 'true')
+    return quiet
+
+
+def _clone(root, update=True):
+    destination = root + '-clone'
+    hg.clone(_quiet(), {}, root, destination, update=update)
+    return destination
+
+
+def _commit_edit(root, id, changes):
+    IssueDB(root).edit(id, changes)
+    repo = hg.repository(_quiet(), root)
+    hgcommands.commit(repo.ui, repo, message='Edit %s' % id)
+
+
+def test_uncommitted_edits(repository):
+    root, ids = repository(3)
+    issuedb = IssueDB(root)
+    changes = issuedb.changes_since()
+    assert changes['reset']
+    assert sorted(changes['added']) == sorted(ids)
+
+    issuedb.edit(ids[0], {'priority': 'low'})
+    changes = issuedb.changes_since(changes['token'])
+    assert changes['modified'].keys() == [ids[0]]
+    assert changes['modified'][ids[0]]['priority'] == 'low'
+    assert not changes['added'] and not changes['purged']
+    assert not issuedb.changes_since(changes['token'])['modified']
+
+
+def test_pull_and_update(repository):
+    root, ids = repository(3)
+    clone = _clone(root)
+    issuedb = IssueDB(clone)
+    token = issuedb.changes_since()['token']
+
+    _commit_edit(root, ids[0], {'priority': 'low'})
+    repo = hg.repository(_quiet(), clone)
+    hgcommands.pull(repo.ui, repo, root, update=True)
+    changes = issuedb.changes_since(token)
+    assert changes['modified'].keys() == [ids[0]]
+    assert changes['modified'][ids[0]]['priority'] == 'low'
+
+    # Going back to the older revision changes the file back.
+    hgcommands.update(repo.ui, repo, rev='-2')
+    changes = issuedb.changes_since(changes['token'])
+    assert changes['modified'].keys() == [ids[0]]
+    assert changes['modified'][ids[0]]['priority'] != 'low'
+
+
+def test_store(repository):
+    root, ids = repository(3)
+    bare = _clone(root, update=False)
+    assert not path.exists(path.join(bare, 'issues'))
+    token = IssueDB(bare, rev='tip').changes_since()['token']
+
+    _commit_edit(root, ids[0], {'priority': 'low'})
+    repo = hg.repository(_quiet(), bare)
+    hgcommands.pull(repo.ui, repo, root)
+    issuedb = IssueDB(bare, rev='tip')
+    changes = issuedb.changes_since(token)
+    assert changes['modified'].keys() == [ids[0]]
+    assert changes['modified'][ids[0]]['priority'] == 'low'
+    assert not issuedb.changes_since(changes['token'])['modified']
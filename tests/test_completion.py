@@ -0,0 +1,55 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+from yamltrak import IssueDB, options
+from yamltrak.commands import build_parser
+from yamltrak.completion import complete
+
+
+@pytest.fixture
+def root(repository):
+    root, ids = repository(2)
+    IssueDB(root).edit(ids[0], {'group': 'sprint 1', 'priority': 'high'})
+    return root
+
+
+def test_flags_match_the_parser(root, capsys):
+    issuedb = IssueDB(root)
+    for name, help, declared in options.COMMANDS:
+        with pytest.raises(SystemExit):
+            build_parser(issuedb, name).parse_args([name, '--help'])
+        # This argparse prints the help on stderr.
+        usage = ''.join(capsys.readouterr())
+        flags = complete('yt %s --' % name, root)
+        assert flags
+        for flag in flags:
+            assert flag + ' ' in usage or flag + '\n' in usage
+
+
+def test_values_are_per_command(root):
+    assert complete('yt list -s ', root) == ['open']
+    assert 'high' in complete('yt edit -p h', root)
+    # The serve command's -p is the port.
+    assert complete('yt serve -p ', root) == []
+    assert complete('yt close -c ', root) == []
+    assert complete('yt show --format j', None) == ['json', 'jsonl']
+
+
+def test_values_are_escaped(root):
+    assert complete('yt edit --group s', root) == ['sprint\\ 1']
+    assert complete('yt edit --group sprint\\ ', root) == ['sprint\\ 1']
+    assert complete("yt edit --group 'sprint ", root) == ['sprint\\ 1']
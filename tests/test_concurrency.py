@@ -0,0 +1,112 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import multiprocessing
+import threading
+from yamltrak import IssueDB
+
+PROCESSES = 8
+ISSUES = 32
+EDITS = 3
+# Threads sharing one thread safe IssueDB.
+WRITERS = 4
+READERS = 6
+
+
+def _edit(issuedb, writer, ids):
+    """\
+    Edit each of the given issues in turn, as one of several writers.  The
+    description is indexed, so both the issue files and the index change.
+    """
+    for edit in range(EDITS):
+        for id in ids:
+            issuedb.edit(id, {'description': 'Writer %d edit %d' % (writer, edit)})
+
+
+def _write(root, writer, ids):
+    """Run as one of several writer processes."""
+    _edit(IssueDB(root), writer, ids)
+
+
+def _expected(shares):
+    """The description each issue should end up with."""
+    expected = {}
+    for writer, share in enumerate(shares):
+        for id in share:
+            expected[id] = 'Writer %d edit %d' % (writer, EDITS - 1)
+    return expected
+
+
+def _check_final(issuedb, expected):
+    """Check that the issue files and the index both hold the last edits."""
+    index = issuedb.issues()
+    for id, description in expected.iteritems():
+        assert issuedb.issue(id, detail=False)[0]['data']['description'] == description
+        assert index[id]['description'] == description
+    report = issuedb.fsck()
+    assert not any(report.values()), report
+
+
+def test_parallel_writers(repository):
+    root, ids = repository(ISSUES)
+    shares = [ids[writer::PROCESSES] for writer in range(PROCESSES)]
+    writers = [multiprocessing.Process(target=_write, args=(root, writer, shares[writer]))
+               for writer in range(PROCESSES)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(120)
+        assert writer.exitcode == 0
+    _check_final(IssueDB(root), _expected(shares))
+
+
+def test_threadsafe_readers_and_writers(repository):
+    root, ids = repository(16)
+    issuedb = IssueDB(root, threadsafe=True)
+    shares = [ids[writer::WRITERS] for writer in range(WRITERS)]
+    errors = []
+    done = threading.Event()
+
+    def write(writer):
+        try:
+            _edit(issuedb, writer, shares[writer])
+        except Exception, e:
+            errors.append(e)
+
+    def read():
+        try:
+            while not done.isSet():
+                index = issuedb.issues()
+                assert set(ids) <= set(index)
+                issuedb.issue(ids[0], detail=False)
+        except Exception, e:
+            errors.append(e)
+
+    writers = [threading.Thread(target=write, args=(writer,)) for writer in range(WRITERS)]
+    readers = [threading.Thread(target=read) for reader in range(READERS)]
+    for thread in writers + readers:
+        thread.start()
+    for thread in writers:
+        thread.join(120)
+    done.set()
+    for thread in readers:
+        thread.join(120)
+    assert not errors, errors
+    expected = _expected(shares)
+    _check_final(issuedb, expected)
+    # And as seen by a fresh instance, from the files alone.
+    _check_final(IssueDB(root), expected)
+
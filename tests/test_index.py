@@ -0,0 +1,78 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import pytest
+import yaml
+from yamltrak import IssueDB, _atomic_write
+
+# A single process works serially, while two get ten issues in ten batches.
+PROCESSES = [1, 2]
+
+
+def _index(root):
+    return os.path.join(root, 'issues', 'issues.yaml')
+
+
+def _entries(root):
+    with open(_index(root)) as indexfile:
+        index = yaml.safe_load(indexfile)
+    index.pop('skeleton')
+    return index
+
+
+@pytest.mark.parametrize('processes', PROCESSES)
+def test_reindex_rebuilds_a_deleted_index(repository, processes):
+    root, ids = repository(10)
+    expected = _entries(root)
+    # An issue database is only recognised by its index, so open it first.
+    issuedb = IssueDB(root)
+    os.remove(_index(root))
+    report = issuedb.reindex(processes=processes)
+    assert sorted(report['missing']) == sorted(ids)
+    assert _entries(root) == expected
+    assert IssueDB(root).fsck(processes=processes) == {
+        'missing': [], 'orphaned': [], 'stale': {}, 'unreadable': {}}
+
+
+@pytest.mark.parametrize('processes', PROCESSES)
+def test_reindex_rebuilds_a_corrupted_index(repository, processes):
+    root, ids = repository(10)
+    expected = _entries(root)
+    _atomic_write(_index(root), 'skeleton: [not: closed\n')
+    IssueDB(root).reindex(processes=processes)
+    assert _entries(root) == expected
+
+
+@pytest.mark.parametrize('processes', PROCESSES)
+def test_fsck_reports_without_writing(repository, processes):
+    root, ids = repository(10)
+    issuedb = IssueDB(root)
+    missing, stale = ids[:2]
+    index = yaml.safe_load(open(_index(root)))
+    del index[missing]
+    index[stale]['title'] = 'Not the title'
+    orphaned = '0' * 40
+    index[orphaned] = dict(index[ids[2]])
+    text = yaml.safe_dump(index, default_flow_style=False)
+    _atomic_write(_index(root), text)
+
+    report = issuedb.fsck(processes=processes)
+    assert report['missing'] == [missing]
+    assert report['orphaned'] == [orphaned]
+    assert list(report['stale']) == [stale]
+    assert report['unreadable'] == {}
+    assert open(_index(root)).read() == text
@@ -0,0 +1,108 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import pytest
+import yaml
+from yamltrak import IssueDB, DERIVED, sort_cursor, _atomic_write
+
+# The estimate and priority of each issue, by title.
+ISSUES = {
+    'quick': ('30 minutes', 'high'),
+    'short': ('2 hours', 'low'),
+    'long': ('3 days', 'normal'),
+    'unplanned': ('Sometime', 'high'),
+    'never': (None, 'normal'),
+}
+
+
+@pytest.fixture(params=[2, 1])
+def issuedb(request, repository):
+    """\
+    A database of the ISSUES, returning the database and the ids by title.
+    With version 1, the index has no derived columns to sort by.
+    """
+    root, ids = repository()
+    issuedb = IssueDB(root)
+    titles = {}
+    for title, (estimate, priority) in sorted(ISSUES.items()):
+        titles[title] = issuedb.new({'title': title})
+        issue = {'priority': priority}
+        if estimate is not None:
+            issue['estimate'] = estimate
+        issuedb.edit(titles[title], issue)
+    if request.param == 1:
+        filename = os.path.join(root, 'issues', 'issues.yaml')
+        index = yaml.safe_load(open(filename))
+        index['skeleton']['_version'] = 1
+        for entry in index.values():
+            for column in DERIVED:
+                entry.pop(column, None)
+        _atomic_write(filename, yaml.safe_dump(index, default_flow_style=False))
+    return issuedb, titles
+
+
+def titles(issues):
+    return [issue['title'] for issue in issues.values()]
+
+
+def test_unplanned_estimates_come_last_both_ways(issuedb):
+    issuedb, ids = issuedb
+    ascending = titles(issuedb.issues(sort=['estimate']))
+    assert ascending[:3] == ['quick', 'short', 'long']
+    assert sorted(ascending[3:]) == ['never', 'unplanned']
+    descending = titles(issuedb.issues(sort=['-estimate']))
+    assert descending[:3] == ['long', 'short', 'quick']
+    assert sorted(descending[3:]) == ['never', 'unplanned']
+
+
+def test_sort_by_several_keys(issuedb):
+    issuedb, ids = issuedb
+    assert titles(issuedb.issues(sort=['priority', 'estimate'])) == [
+        'quick', 'unplanned', 'long', 'never', 'short']
+    assert titles(issuedb.issues(sort=['-priority', '-title'])) == [
+        'short', 'never', 'long', 'unplanned', 'quick']
+    assert list(issuedb.issues(sort=['id'])) == sorted(ids.values())
+
+
+@pytest.mark.parametrize('sort', [['estimate'], ['-estimate'], ['priority', '-estimate'], ['-title']])
+def test_paging_with_limit_and_after(issuedb, sort):
+    issuedb, ids = issuedb
+    everything = issuedb.issues(sort=sort)
+    assert len(everything) == len(ISSUES)
+    assert titles(issuedb.issues(sort=sort, limit=2)) == titles(everything)[:2]
+    assert titles(issuedb.issues(sort=sort, limit=2, offset=1)) == titles(everything)[1:3]
+
+    seen = []
+    after = None
+    while True:
+        page = issuedb.issues(sort=sort, limit=2, after=after)
+        if not page:
+            break
+        seen.extend(page)
+        id, issue = page.items()[-1]
+        after = sort_cursor(id, issue, sort)
+    assert seen == list(everything)
+
+
+def test_bad_cursor(issuedb):
+    issuedb, ids = issuedb
+    with pytest.raises(ValueError):
+        issuedb.issues(sort=['estimate'], after='not-a-cursor')
+    # A cursor for another order doesn't fit this one.
+    id, issue = issuedb.issues(sort=['title'], limit=1).items()[0]
+    with pytest.raises(ValueError):
+        issuedb.issues(sort=['estimate'], after=sort_cursor(id, issue, ['title']))
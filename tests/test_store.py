@@ -0,0 +1,52 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+from mercurial import hg, ui, commands as hgcommands
+from yamltrak import IssueDB, ReadOnlyIssueDB
+
+
+def test_tip_follows_new_commits(repository):
+    root, ids = repository(2)
+    stored = IssueDB(root, rev='tip')
+    assert stored.issue(ids[0], detail=False)[0]['data']['priority'] != 'low'
+
+    IssueDB(root).edit(ids[0], {'priority': 'low'})
+    # Uncommitted changes aren't in the store.
+    assert stored.issue(ids[0], detail=False)[0]['data']['priority'] != 'low'
+    assert stored.issues()[ids[0]]['priority'] != 'low'
+
+    repo = hg.repository(ui.ui(), root)
+    hgcommands.commit(repo.ui, repo, message='Lower the priority')
+    assert stored.issue(ids[0], detail=False)[0]['data']['priority'] == 'low'
+    assert stored.issues()[ids[0]]['priority'] == 'low'
+
+
+def test_read_only(repository):
+    root, ids = repository(1)
+    with pytest.raises(ReadOnlyIssueDB):
+        IssueDB(root, rev='tip').edit(ids[0], {'priority': 'low'})
+
+
+def test_issue_revisions_leave_the_index_cached(repository):
+    root, ids = repository(70)
+    stored = IssueDB(root, rev='tip')
+    stored.issues()
+    index = list(stored._indexrevisions)
+    for id in ids:
+        stored.issue(id, detail=False)
+    assert list(stored._indexrevisions) == index
+    assert len(stored._filerevisions) == 64
@@ -0,0 +1,62 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import yaml
+import yamltrak
+from yamltrak import IssueDB, _atomic_write, _load_index, _stream_index
+
+
+def _wanted(index, status):
+    return dict((id, entry) for id, entry in index.iteritems()
+                if id == 'skeleton' or status in entry.get('status', '').lower())
+
+
+def test_streaming_matches_a_full_load(repository, monkeypatch):
+    root, ids = repository(6)
+    issuedb = IssueDB(root)
+    for id in ids[:2]:
+        issuedb.close(id)
+    filename = os.path.join(root, 'issues', 'issues.yaml')
+    full = yaml.safe_load(open(filename))
+
+    for status in ['open', 'closed', '']:
+        assert _stream_index(filename, status) == _wanted(full, status)
+
+    # Every index is too big to cache now, so listings are streamed.
+    monkeypatch.setattr(yamltrak._yamlcache, 'maxsize', 1)
+    assert _load_index(filename, 'open') == _wanted(full, 'open')
+    assert sorted(issuedb.issues()) == sorted(ids[2:])
+    assert sorted(issuedb.issues(status='closed')) == sorted(ids[:2])
+
+
+def test_aliases_fall_back_to_a_full_load(tmpdir, monkeypatch):
+    filename = str(tmpdir.join('issues.yaml'))
+    text = '\n'.join([
+        'skeleton: {status: "open, closed"}',
+        'a: &closed {status: closed, title: First}',
+        'b: {status: open, title: Second, duplicate: *closed}',
+        'c: {status: open, title: &title Third, again: *title}',
+        ''])
+    _atomic_write(filename, text)
+    full = yaml.safe_load(text)
+    # The open entry refers to a closed one, which streaming skips.
+    assert _stream_index(filename, 'open') is None
+    assert _stream_index(filename, 'closed') == _wanted(full, 'closed')
+
+    monkeypatch.setattr(yamltrak._yamlcache, 'maxsize', 1)
+    assert _load_index(filename, 'open') == full
+    assert _load_index(filename, 'closed') == _wanted(full, 'closed')
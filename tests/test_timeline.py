@@ -0,0 +1,74 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+from mercurial import hg, ui
+from yamltrak import IssueDB
+from conftest import USER
+
+# The commit dates, as unix timestamps, of adding two issues and editing one.
+FIRST, SECOND, EDITED = 1100000000, 1200000000, 1300000000
+
+
+@pytest.fixture
+def history(tmpdir, monkeypatch):
+    """\
+    A repository where an issue is added at FIRST, another at SECOND, and the
+    first is edited at EDITED, returning the path, the node of the SECOND
+    commit and the two ids.
+    """
+    monkeypatch.setenv('HGUSER', USER)
+    root = str(tmpdir.join('repo'))
+    repo = hg.repository(ui.ui(), root, create=True)
+    issuedb = IssueDB(root, dbinit=True)
+    repo.commit(text='Add the issue database', user=USER, date='1000000000 0')
+    first = issuedb.new({'title': 'First'})
+    repo.commit(text='Add the first issue', user=USER, date='%d 0' % FIRST)
+    second = issuedb.new({'title': 'Second'})
+    secondnode = repo.commit(text='Add the second issue', user=USER, date='%d 0' % SECOND)
+    issuedb.edit(first, {'priority': 'low'})
+    repo.commit(text='Lower the priority', user=USER, date='%d 0' % EDITED)
+    return root, secondnode, first, second
+
+
+def events(issuedb, **kwargs):
+    return [(event['id'], event['date']) for event in issuedb.timeline(**kwargs)]
+
+
+def test_newest_first(history):
+    root, secondnode, first, second = history
+    timeline = list(IssueDB(root).timeline())
+    assert [event['id'] for event in timeline] == [first, second, first]
+    assert timeline[0]['diff']
+
+
+def test_since_until_and_limit(history):
+    root, secondnode, first, second = history
+    issuedb = IssueDB(root)
+    assert [id for id, date in events(issuedb, since=SECOND)] == [first, second]
+    assert [id for id, date in events(issuedb, until=SECOND)] == [second, first]
+    assert [id for id, date in events(issuedb, since=SECOND, until=SECOND)] == [second]
+    assert [id for id, date in events(issuedb, since=FIRST, until=EDITED, limit=2)] == [first, second]
+    assert events(issuedb, since=EDITED + 1) == []
+    # Dates can be given in any format mercurial takes.
+    assert [id for id, date in events(issuedb, since='%d 0' % EDITED)] == [first]
+
+
+def test_store_walks_the_revision_read(history):
+    root, secondnode, first, second = history
+    stored = IssueDB(root, rev=hg.repository(ui.ui(), root)[secondnode].hex())
+    assert [id for id, date in events(stored)] == [second, first]
+    assert [id for id, date in events(stored, since=SECOND, limit=5)] == [second]
@@ -0,0 +1,67 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+from time import time
+import pytest
+import yamltrak.watch
+from yamltrak import IssueDB
+from yamltrak.watch import InotifyWatcher, PollingWatcher
+
+
+@pytest.fixture(params=['polling', 'inotify'])
+def watched(request, repository, monkeypatch):
+    """A database of two issues, watched with the given kind of watcher."""
+    root, ids = repository(2)
+    if request.param == 'polling':
+        monkeypatch.setattr(yamltrak.watch, 'watcher',
+                            lambda folders, files, interval: PollingWatcher(folders, files, interval))
+    else:
+        try:
+            InotifyWatcher([root]).close()
+        except OSError:
+            pytest.skip('inotify is not available')
+        monkeypatch.setattr(yamltrak.watch, 'watcher',
+                            lambda folders, files, interval: InotifyWatcher(folders))
+    return IssueDB(root), ids
+
+
+def test_watch(watched):
+    issuedb, ids = watched
+    results = issuedb.watch(interval=0.02, timeout=0.5)
+    first = results.next()
+    assert sorted(first) == sorted(ids)
+
+    # A change the index shows gives a new result.
+    issuedb.edit(ids[0], {'priority': 'low'})
+    second = results.next()
+    assert second[ids[0]]['priority'] == 'low'
+
+    # A change to a field outside the index gives nothing new, so the watch
+    # ends once the timeout passes without a visible change.
+    issuedb.edit(ids[1], {'comment': 'Only a comment'})
+    started = time()
+    with pytest.raises(StopIteration):
+        results.next()
+    assert time() - started >= 0.5
+
+
+def test_watch_timeout(watched):
+    issuedb, ids = watched
+    results = issuedb.watch(interval=0.02, timeout=0.1)
+    assert sorted(results.next()) == sorted(ids)
+    started = time()
+    assert list(results) == []
+    assert 0.1 <= time() - started < 5
@@ -0,0 +1,136 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+from cStringIO import StringIO
+from gzip import GzipFile
+from os import path
+from urlparse import urlsplit
+from wsgiref.util import setup_testing_defaults
+from wsgiref.validate import validator
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import pytest
+from yamltrak.wsgi import YAMLTrakApp
+
+
+@pytest.fixture
+def served(repository):
+    """An application serving a repository of five issues, with their ids."""
+    root, ids = repository(5)
+    return YAMLTrakApp([root], pagesize=2, minimum_gzip=0), path.basename(root), sorted(ids)
+
+
+def get(app, url, **headers):
+    """Make a GET request, returning the status, the headers and the body."""
+    # Links come back from JSON as unicode, and WSGI wants byte strings.
+    scheme, host, path_info, query, fragment = urlsplit(str(url))
+    environ = {'SCRIPT_NAME': '', 'PATH_INFO': path_info, 'QUERY_STRING': query}
+    environ.update(('HTTP_' + name.upper(), value) for name, value in headers.items())
+    setup_testing_defaults(environ)
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'], response['headers'] = int(status.split()[0]), dict(headers)
+    result = validator(app)(environ, start_response)
+    try:
+        body = ''.join(result)
+    finally:
+        result.close()
+    return response['status'], response['headers'], body
+
+
+def test_paging_follows_the_next_cursor(served):
+    app, name, ids = served
+    seen = []
+    url = '/%s/issues' % name
+    while url:
+        status, headers, body = get(app, url)
+        assert status == 200
+        page = json.loads(body)
+        assert page['total'] == 5
+        assert len(page['issues']) <= 2
+        seen.extend(issue['id'] for issue in page['issues'])
+        url = page['next']
+    assert seen == ids
+
+
+def test_etag_round_trip(served):
+    app, name, ids = served
+    status, headers, body = get(app, '/%s/issues/%s' % (name, ids[0]))
+    assert status == 200
+    assert json.loads(body)['id'] == ids[0]
+
+    status, unchanged, body = get(app, '/%s/issues/%s' % (name, ids[0]),
+                                  if_none_match=headers['ETag'])
+    assert status == 304
+    assert body == ''
+    assert unchanged['ETag'] == headers['ETag']
+
+    # Other requests don't share the tag.
+    status, other, body = get(app, '/%s/issues/%s' % (name, ids[1]),
+                              if_none_match=headers['ETag'])
+    assert status == 200
+    assert other['ETag'] != headers['ETag']
+
+
+def test_gzip_is_negotiated(served):
+    app, name, ids = served
+    status, plain, body = get(app, '/%s/issues' % name)
+    assert 'Content-Encoding' not in plain
+
+    status, headers, compressed = get(app, '/%s/issues' % name, accept_encoding='gzip, deflate')
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['ETag'] != plain['ETag']
+    assert GzipFile(fileobj=StringIO(compressed)).read() == body
+
+
+@pytest.mark.parametrize('accept,expected', [
+    ('gzip;q=0', None),
+    ('gzip;q=0, deflate', None),
+    ('*, gzip;q=0', None),
+    ('identity', None),
+    ('identity, x-gzip', 'x-gzip'),
+    ('gzip;q=0.5, identity', 'gzip'),
+    ('deflate, *;q=0.1', 'gzip'),
+])
+def test_gzip_qualities(served, accept, expected):
+    app, name, ids = served
+    status, headers, body = get(app, '/%s/issues' % name, accept_encoding=accept)
+    assert status == 200
+    assert headers.get('Content-Encoding') == expected
+    if expected is None:
+        assert json.loads(body)['issues']
+
+
+def test_cache_keeps_recently_used_responses(served):
+    app, name, ids = served
+    app.cachesize = 2
+    first, second, third = [json.loads(get(app, '/%s/issues/%s' % (name, id))[2]) for id in ids[:3]]
+    cached = lambda: [json.loads(body) for body, encoding in app._cache.values()]
+    assert cached() == [second, third]
+    # Using the second response again makes the third the one to go next.
+    get(app, '/%s/issues/%s' % (name, ids[1]))
+    get(app, '/%s/issues/%s' % (name, ids[0]))
+    assert cached() == [second, first]
+
+
+def test_bad_cursor(served):
+    app, name, ids = served
+    status, headers, body = get(app, '/%s/issues?after=not-a-cursor' % name)
+    assert status == 400
+    assert 'error' in json.loads(body)
@@ -20,12 +20,30 @@
 # and the index is just that.  All code will make sure to use the same version
 # stored in the issue file when updating the index.
 from __future__ import with_statement
+from contextlib import contextmanager
+from copy import deepcopy
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from functools import partial, wraps
+from heapq import nsmallest
+from hashlib import sha1
+import errno
+import marshal
+import re
+import sys
+import threading
 import yaml
-from mercurial import hg, commands as hgcommands, ui, util
-from mercurial.error import RepoError
-from os import path, makedirs
-from time import time
+from mercurial import hg, commands as hgcommands, ui, util, match as matchmod
+from mercurial.error import RepoError, LockHeld
+from os import path, makedirs, listdir, fdopen, rename, remove, stat, fstat, chmod
+from os.path import commonprefix
+from tempfile import mkstemp
+from time import time, sleep
 import exceptions
+# The C loader, when PyYAML was built with it, parses many times faster.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+from multiprocessing import Pool, cpu_count
 NEW_ISSUE_TAG='YAMLTrak-new-issue'
 SKELETON = {
     'title': 'A title for the issue',
@@ -45,7 +63,21 @@ INDEX = {'skeleton': {
     'estimate': 'A time estimate for completion',
     'status': 'open, closed',
     'group': 'unfiled',
-    'priority': 'high, normal, low'}}
+    'priority': 'high, normal, low',
+    '_version': 2}}
+# Index skeletons carrying this version have the columns in DERIVED stored
+# alongside the fields of each entry that has been written since: the estimate
+# in minutes, its scale and the rank of the priority.  Readers derive them from
+# the fields for any other index, or any entry without them.
+INDEX_VERSION = 2
+DERIVED = ('_minutes', '_scale', '_rank')
+# Issue files are named after the changeset that created them, either the full
+# 40 digit hex node, or the 12 digit short form used by older versions.
+ISSUEID = re.compile(r'^[0-9a-f]{12}(?:[0-9a-f]{28})?$')
+# Like mercurial's short hashes, any unique prefix of an id can stand in for it.
+ISSUEPREFIX = re.compile(r'^[0-9a-f]{1,40}$')
+# Normalized priorities, most urgent first, which is the order they sort in.
+PRIORITIES = ['high', 'normal', 'low']
 
 def issues(repositories=[], dbfolder='issues', status='open'):
     """Return the list of issues with the given statuses in dictionary form"""
@@ -77,9 +109,11 @@ def issuediff(revx, revy):
         if x == len(revxkeys):
             # Exhausted source keys, the rest are added properties
             added[revykeys[y]] = revy[revykeys[y]]
+            y += 1
         elif y == len(revykeys):
             # Exhausted dest keys, the rest are removed properties
             removed[revxkeys[x]] = revx[revxkeys[x]]
+            x += 1
         elif revxkeys[x] < revykeys[y]:
             # This particular key exists in the source, and not the dest
             removed[revxkeys[x]] = revx[revxkeys[x]]
@@ -141,6 +175,609 @@ def _hex_node(node_binary):
     """Convert a binary node string into a 40-digit hex string"""
     return ''.join('%0.2x' % ord(letter) for letter in node_binary)
 
+def _atomic_write(filename, data):
+    """\
+    Write data to the given file by way of a temporary file in the same folder
+    that is renamed into place.  Readers will always see either the old or the
+    new contents, never a partially written file.
+    """
+    folder, name = path.split(filename)
+    try:
+        mode = stat(filename).st_mode & 0777
+    except OSError:
+        mode = 0644
+    handle, tmpname = mkstemp(prefix='.%s-' % name, dir=folder)
+    try:
+        with fdopen(handle, 'w') as tmpfile:
+            tmpfile.write(data)
+        chmod(tmpname, mode)
+        if sys.platform == 'win32' and path.exists(filename):
+            # Windows won't rename over an existing file.
+            remove(filename)
+        rename(tmpname, filename)
+    except:
+        try:
+            remove(tmpname)
+        except OSError:
+            pass
+        raise
+
+def _digest(data):
+    """A short fingerprint of the contents of an issue file."""
+    return sha1(data).hexdigest()[:16]
+
+def _timestamp(when):
+    """\
+    Turn a date given as a number (a unix timestamp) or as a string in any
+    format mercurial accepts into a unix timestamp.
+    """
+    if isinstance(when, (int, long, float)):
+        return when
+    return util.parsedate(when)[0]
+
+def _identity(info):
+    """\
+    The parts of a file's stat result that change whenever it is rewritten,
+    whether in place or by renaming another file over it.
+    """
+    return (info.st_size, info.st_mtime, info.st_ctime, info.st_ino)
+
+def _freeze(data):
+    """\
+    Return a private copy of the given data, along with whether it was
+    marshalled, for _thaw to make further copies from.  Marshal makes for a
+    quick copy of plain data.  Dates and other types it can't handle fall
+    back to a deep copy.
+    """
+    try:
+        return marshal.dumps(data), True
+    except ValueError:
+        return deepcopy(data), False
+
+def _thaw(stored, marshalled):
+    """Return a fresh copy of data stored by _freeze."""
+    if marshalled:
+        return marshal.loads(stored)
+    return deepcopy(stored)
+
+_missing = object()
+
+def _lru_get(cache, key, lock, default=None):
+    """\
+    Return the value cached under key in the given OrderedDict, moving it to
+    the end as the most recently used, or default if there's none.
+    """
+    with lock:
+        value = cache.pop(key, _missing)
+        if value is _missing:
+            return default
+        cache[key] = value
+        return value
+
+def _lru_set(cache, key, value, maxsize, lock):
+    """\
+    Cache value under key in the given OrderedDict, dropping the least
+    recently used values to keep at most maxsize.
+    """
+    with lock:
+        cache.pop(key, None)
+        while len(cache) >= maxsize:
+            cache.popitem(last=False)
+        cache[key] = value
+
+class _ParsedFileCache(object):
+    """\
+    A process wide cache of parsed YAML files, shared by every IssueDB.  An
+    entry is only used while the size, modification and change times, and
+    inode of its file are unchanged.  Files changed within the last 'racy'
+    seconds could have been rewritten with the same size within one tick of a
+    coarse filesystem clock, into an inode just freed by a rename, so those
+    are compared with a digest of their contents as well.  Entries are
+    dropped, least recently used first, once the files cached add up to more
+    than maxsize bytes.  Callers always get their own copy of the data, so
+    they are free to modify it.
+    """
+    def __init__(self, maxsize=32 * 1024 * 1024, racy=2.0):
+        self.maxsize = maxsize
+        self.racy = racy
+        # Kept in order of use, the least recently used first.
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def load(self, filename):
+        """\
+        Return the parsed contents of the given file, raising IOError like
+        open does when it can't be read.
+        """
+        with open(filename) as yamlfile:
+            # We look at the file we actually opened, so that a file renamed
+            # into place in the meantime can't get cached under the wrong key.
+            info = fstat(yamlfile.fileno())
+            key = _identity(info)
+            text = digest = None
+            if time() - max(info.st_mtime, info.st_ctime) < self.racy:
+                text = yamlfile.read()
+                digest = sha1(text).digest()
+            with self._lock:
+                entry = self._entries.get(filename)
+                hit = (entry is not None and entry[0] == key and
+                       (digest is None or entry[3] == digest))
+                if hit:
+                    self._entries[filename] = self._entries.pop(filename)
+            if hit:
+                return _thaw(entry[1], entry[2])
+            if text is None:
+                text = yamlfile.read()
+                digest = sha1(text).digest()
+            data = yaml.load(text, Loader=SafeLoader)
+
+        stored, marshalled = _freeze(data)
+
+        if key[0] <= self.maxsize:
+            with self._lock:
+                previous = self._entries.pop(filename, None)
+                if previous is not None:
+                    self._size -= previous[0][0]
+                self._entries[filename] = (key, stored, marshalled, digest)
+                self._size += key[0]
+                while self._size > self.maxsize:
+                    self._size -= self._entries.popitem(last=False)[1][0][0]
+        return data
+
+    def clear(self):
+        """Forget every cached file."""
+        with self._lock:
+            self._entries = OrderedDict()
+            self._size = 0
+
+_yamlcache = _ParsedFileCache()
+
+class _EventLoader(yaml.composer.Composer, yaml.constructor.SafeConstructor, yaml.resolver.Resolver):
+    """\
+    A loader fed with the parse events of a single node at a time, rather
+    than a stream, so that the entries of a document can be built one by one.
+    Anchors are remembered from one node to the next.
+    """
+    def __init__(self):
+        yaml.composer.Composer.__init__(self)
+        yaml.constructor.SafeConstructor.__init__(self)
+        yaml.resolver.Resolver.__init__(self)
+        self._events = deque()
+
+    def check_event(self, *choices):
+        if not self._events:
+            return False
+        return not choices or isinstance(self._events[0], choices)
+
+    def peek_event(self):
+        return self._events[0]
+
+    def get_event(self):
+        return self._events.popleft()
+
+    def construct(self, events):
+        """Return the data for the node described by the given events."""
+        self._events.extend(events)
+        return self.construct_document(self.compose_node(None, None))
+
+def _node_events(events):
+    """Take the events making up the next node from the given iterator."""
+    first = events.next()
+    node = [first]
+    if isinstance(first, yaml.CollectionStartEvent):
+        depth = 1
+        while depth:
+            event = events.next()
+            node.append(event)
+            if isinstance(event, yaml.CollectionStartEvent):
+                depth += 1
+            elif isinstance(event, yaml.CollectionEndEvent):
+                depth -= 1
+    return node
+
+def _entry_status(node):
+    """\
+    Return the status of the index entry described by the given events, ''
+    if it has none, or None if it can't be told without building the entry.
+    """
+    if not isinstance(node[0], yaml.MappingStartEvent):
+        return None
+    children = iter(node[1:-1])
+    while True:
+        try:
+            key = _node_events(children)
+        except StopIteration:
+            return ''
+        value = _node_events(children)
+        if isinstance(key[0], yaml.ScalarEvent) and key[0].value == 'status':
+            if isinstance(value[0], yaml.ScalarEvent):
+                return value[0].value
+            return None
+
+def _stream_index(filename, status):
+    """\
+    Return the skeleton of the given index along with the entries having the
+    given status, working from the parse events so that other entries are
+    skipped without ever being built.  Memory use is bounded by the result,
+    not the index.  Returns None for anything but a plain mapping of entries
+    (an alias to a skipped entry, say), which needs a full load instead.
+    """
+    loader = _EventLoader()
+    index = {}
+    with open(filename) as indexfile:
+        events = yaml.parse(indexfile, Loader=SafeLoader)
+        try:
+            event = events.next()
+            while isinstance(event, (yaml.StreamStartEvent, yaml.DocumentStartEvent)):
+                event = events.next()
+            if not isinstance(event, yaml.MappingStartEvent):
+                return None
+            while True:
+                key = _node_events(events)
+                if isinstance(key[0], yaml.MappingEndEvent):
+                    return index
+                if not isinstance(key[0], yaml.ScalarEvent):
+                    return None
+                node = _node_events(events)
+                if key[0].value != 'skeleton':
+                    entrystatus = _entry_status(node)
+                    if entrystatus is not None and status not in entrystatus.lower():
+                        continue
+                index[loader.construct(key)] = loader.construct(node)
+        except (StopIteration, yaml.composer.ComposerError):
+            return None
+
+def _index_issue(skeleton, issue):
+    """\
+    Filter the full issue data down to the fields in the index skeleton,
+    adding the derived columns if the skeleton is of the current version.
+    """
+    indexissue = {}
+    for field in skeleton:
+        if field in issue:
+            indexissue[field] = issue[field]
+    if skeleton.get('_version') == INDEX_VERSION:
+        indexissue.update(zip(DERIVED, _derived(issue)))
+    return indexissue
+
+def _trusted(index):
+    """Whether the derived columns stored in the given index can be used."""
+    skeleton = index.get('skeleton')
+    return isinstance(skeleton, dict) and skeleton.get('_version') == INDEX_VERSION
+
+def _archive_wanted(index, status):
+    """\
+    Whether issues with the given status may have been moved from the given
+    index to its archive.  The index skeleton lists the statuses found in the
+    archive, so that it only needs reading when it can make a difference.
+    """
+    skeleton = index.get('skeleton')
+    archived = isinstance(skeleton, dict) and skeleton.get('_archived') or []
+    for archivedstatus in archived:
+        if status in archivedstatus:
+            return True
+    return False
+
+def _set_archived(index, archive):
+    """Record the statuses found in the archive in the skeleton of the index."""
+    statuses = sorted(set(str(issue.get('status', '')).lower() for id, issue in archive.iteritems()
+                          if id != 'skeleton' and isinstance(issue, dict)))
+    if statuses:
+        index['skeleton']['_archived'] = statuses
+    else:
+        index['skeleton'].pop('_archived', None)
+
+def _load_index(filename, status):
+    """\
+    Return the parsed index file, which is streamed when it's too big to be
+    cached, keeping only the entries with the given status.  Neither the
+    streamed entries nor the full parse an index too big to stream falls
+    back to are cached, so each call pays for the whole parse again.  Keep
+    yamltrak._yamlcache.maxsize above the size of the index to avoid that.
+    """
+    if stat(filename).st_size > _yamlcache.maxsize:
+        # Too big to be cached, so rather than build every entry only to throw
+        # most away, we only build those we want.
+        index = _stream_index(filename, status)
+        if index is not None:
+            return index
+    return _yamlcache.load(filename)
+
+def _estimate_minutes(estimate):
+    """\
+    Return the number of minutes in an estimate like '3 hours', or None if it
+    can't be understood.  We don't currently handle amounts larger than weeks.
+    """
+    try:
+        timeamount, timescale = estimate.split()[:2]
+        timescale = timescale.lower().rstrip('s')
+        if timescale == 'minute':
+            return int(timeamount)
+        elif timescale == 'hour':
+            return 60 * int(timeamount)
+        elif timescale == 'day':
+            return 24 * 60 * int(timeamount)
+        elif timescale == 'week':
+            return 7 * 24 * 60 * int(timeamount)
+    except (ValueError, IndexError, AttributeError):
+        pass
+    return None
+
+def _scale(estimate):
+    """Return the rough scale of an estimate: short, medium, long or unplanned."""
+    # A proper version of this would figure out the actual time value.
+    # We'll take a shortcut and look at the word.
+    try:
+        timescale = estimate.split()[1].rstrip('s')
+        if timescale.lower() == 'hour' or timescale.lower() == 'minute':
+            return 'short'
+        elif timescale.lower() == 'day':
+            return 'medium'
+        else:
+            return 'long'
+    except (IndexError, AttributeError):
+        return 'unplanned'
+
+def _priority(priority):
+    """Return the normalized form of a priority, one of PRIORITIES."""
+    try:
+        priority = priority.lower()
+        if 'high' in priority:
+            return 'high'
+        elif 'normal' in priority:
+            return 'normal'
+        elif 'low' in priority:
+            return 'low'
+    except AttributeError:
+        pass
+    # Don't want any slipping through the cracks.
+    return 'high'
+
+def _derived(issue, trusted=False):
+    """\
+    Return the estimate in minutes (or None), the scale of the estimate and
+    the rank of the priority of an index entry, raw or normalized.  The
+    stored columns are used when they can be trusted.
+    """
+    if trusted and '_scale' in issue:
+        return issue.get('_minutes'), issue['_scale'], issue.get('_rank', 0)
+    estimate = issue.get('estimate')
+    if isinstance(estimate, dict):
+        estimate = estimate.get('text')
+    return (_estimate_minutes(estimate), _scale(estimate),
+            PRIORITIES.index(_priority(issue.get('priority'))))
+
+def _normalize_issue(issue, trusted=False):
+    """\
+    Replace the estimate of an index entry with its scale and text, and its
+    priority with one of PRIORITIES, as returned by IssueDB.issues.  The
+    entry is modified in place.
+    """
+    minutes, scale, rank = _derived(issue, trusted)
+    for column in DERIVED:
+        issue.pop(column, None)
+    issue['estimate'] = {'scale':scale, 'text':issue.get('estimate') is None and '' or issue['estimate']}
+    issue['priority'] = PRIORITIES[rank]
+    return issue
+
+class _Descending(object):
+    """A sort value wrapped to sort in reverse order."""
+    __slots__ = ['value']
+    def __init__(self, value):
+        self.value = value
+    def __cmp__(self, other):
+        return cmp(other.value, self.value)
+
+def _sort_values(sort, id, issue, trusted=False):
+    """\
+    Return the values the issue sorts by for the given sort keys, followed by
+    the id, which breaks any ties.  Priorities sort by rank, and estimates by
+    whether they are unplanned and then their length in minutes, so that
+    unplanned issues come last in either direction.  Both raw and normalized
+    index entries are understood.
+    """
+    values = []
+    for key in sort:
+        field = key.lstrip('-')
+        if field == 'id':
+            value = id
+        elif field == 'priority':
+            value = _derived(issue, trusted)[2]
+        elif field == 'estimate':
+            minutes = _derived(issue, trusted)[0]
+            value = [minutes is None, minutes or 0]
+        else:
+            value = issue.get(field)
+        values.append(value)
+    values.append(id)
+    return values
+
+def _sort_key(sort, values):
+    """\
+    Turn the values from _sort_values into a key honouring descending keys.
+    Only the minutes of an estimate are reversed, never whether it's planned.
+    """
+    key = []
+    for field, value in zip(sort, values):
+        if field.lstrip('-') == 'estimate':
+            unplanned, value = value
+            key.append(unplanned)
+        key.append(field.startswith('-') and _Descending(value) or value)
+    key.append(values[-1])
+    return tuple(key)
+
+def sort_cursor(id, issue, sort=['id']):
+    """\
+    Return an opaque cursor marking the position of the given issue in a
+    listing with the given sort keys.  Passing it as 'after' to
+    IssueDB.issues continues the listing from there, even if issues have been
+    added or removed in the meantime.
+    """
+    return urlsafe_b64encode(yaml.safe_dump([list(sort), _sort_values(sort, id, issue)]))
+
+def _select(issues, sort, limit=None, offset=0, after=None, trusted=False):
+    """\
+    Return the (id, issue) pairs of the given dictionary in sort order,
+    starting after the given cursor and skipping offset issues, and at most
+    limit of them.  With a limit, only the issues needed are ever sorted.
+    """
+    items = issues.iteritems()
+    if after is not None:
+        try:
+            cursorsort, values = yaml.safe_load(urlsafe_b64decode(str(after)))
+            if cursorsort != list(sort) or len(values) != len(sort) + 1:
+                raise ValueError
+            start = _sort_key(sort, values)
+        except Exception:
+            raise ValueError('Invalid cursor for this sort order: %s' % after)
+        items = [(id, issue) for id, issue in items
+                 if _sort_key(sort, _sort_values(sort, id, issue, trusted)) > start]
+
+    key = lambda item: _sort_key(sort, _sort_values(sort, item[0], item[1], trusted))
+    if limit is None:
+        return sorted(items, key=key)[offset:]
+    return nsmallest(offset + limit, items, key=key)[offset:]
+
+def _predicate(predicate):
+    """\
+    Return a function of an issue id and its index entry for the given
+    predicate, which is either such a function already or a dictionary of
+    fields and the values they must equal.
+    """
+    if not isinstance(predicate, dict):
+        return predicate
+    return lambda id, issue: all(str(issue.get(field, '')) == str(value)
+                                 for field, value in predicate.iteritems())
+
+def _tally(totals, by, status, issue, sign=1, trusted=False):
+    """\
+    Add the index entry to the summary totals (or take it away, with a sign
+    of -1) if it has the given status.  Totals map a tuple of the values of
+    the 'by' fields to a count of issues and their summed estimate in
+    minutes.  Estimates and priorities are grouped as IssueDB.issues
+    normalizes them.
+    """
+    if not isinstance(issue, dict) or status not in str(issue.get('status', '')).lower():
+        return
+    normalized = _normalize_issue(dict(issue), trusted)
+    key = []
+    for field in by:
+        value = normalized.get(field)
+        if field == 'estimate':
+            value = value['scale']
+        elif isinstance(value, (list, dict)):
+            value = repr(value)
+        key.append(value)
+    key = tuple(key)
+
+    total = totals.setdefault(key, [0, 0])
+    total[0] += sign
+    total[1] += sign * (_derived(issue, trusted)[0] or 0)
+    if not total[0]:
+        del totals[key]
+
+def _load_issues(filenames):
+    """\
+    Parse a batch of issue files, returning a list of (id, data, error)
+    tuples.  This lives at module level so that it can be handed to a process
+    pool.
+    """
+    results = []
+    for filename in filenames:
+        issueid = path.basename(filename)
+        try:
+            with open(filename) as issuefile:
+                results.append((issueid, yaml.safe_load(issuefile.read()), None))
+        except (IOError, yaml.YAMLError), error:
+            results.append((issueid, None, str(error)))
+    return results
+
+def _migrate_value(transform, value):
+    """\
+    Transform a field value, with either a function or a dictionary mapping
+    old values to new ones.  Values the dictionary doesn't list are kept.
+    """
+    if callable(transform):
+        return transform(value)
+    for key in (value, str(value)):
+        try:
+            if key in transform:
+                return transform[key]
+        except TypeError:
+            # Unhashable values can't have been listed.
+            pass
+    return value
+
+def _migrate_fields(migration, fields, defaults=True, values=True):
+    """\
+    Return a copy of the given issue or skeleton with the migration applied:
+    fields are renamed, then dropped, then added with their default (unless
+    defaults is False), and last their values are transformed (unless values
+    is False, as skeletons hold help text rather than values).
+    """
+    fields = dict(fields)
+    for old, new in migration.get('rename', {}).iteritems():
+        if old in fields:
+            fields[new] = fields.pop(old)
+    for field in migration.get('drop', ()):
+        fields.pop(field, None)
+    if defaults:
+        for field, default in migration.get('add', {}).iteritems():
+            fields.setdefault(field, default)
+    for field, transform in values and migration.get('transform', {}).iteritems() or ():
+        if field in fields:
+            fields[field] = _migrate_value(transform, fields[field])
+    return fields
+
+def _migrate_issues(migration, dryrun, filenames):
+    """\
+    Apply the migration to a batch of issue files, rewriting those that
+    change unless dryrun is set.  Returns a list of (id, data, error, changed)
+    tuples.  Like _load_issues, this lives at module level so that it can be
+    handed to a process pool.
+    """
+    results = []
+    for filename, (issueid, issue, error) in zip(filenames, _load_issues(filenames)):
+        changed = False
+        if error is None and isinstance(issue, dict):
+            migrated = _migrate_fields(migration, issue)
+            changed = migrated != issue
+            if changed and not dryrun:
+                try:
+                    _atomic_write(filename, yaml.safe_dump(migrated, default_flow_style=False))
+                except (IOError, OSError), writeerror:
+                    results.append((issueid, issue, str(writeerror), False))
+                    continue
+            issue = migrated
+        results.append((issueid, issue, error, changed))
+    return results
+
+def _parallel_map(function, items, processes=None, batchsize=500):
+    """\
+    Call function on batches of the given items, spreading the batches across
+    a process pool, and return the concatenated results.  Small jobs, or a
+    request for a single process, are run serially since starting a pool
+    costs more than it saves.
+    """
+    if processes is None:
+        processes = cpu_count()
+    batchsize = max(1, min(batchsize, len(items) // (processes * 4) or 1))
+    batches = [items[start:start + batchsize]
+               for start in xrange(0, len(items), batchsize)]
+
+    if processes <= 1 or len(batches) < 2:
+        results = map(function, batches)
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map(function, batches)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [result for batch in results for result in batch]
+
 def new(repository, issue, dbfolder='issues', status='open'):
     """Add a new issue to the database"""
     try:
@@ -188,10 +825,10 @@ def purge(repository, issueid, dbfolder='issues', status=['open']):
         # No issue database
         return None
 
-    return issuedb.purge(id)
+    return issuedb.purge(issueid)
 
 def _group_estimate(issues, groupvalue, groupfield='group', groupdefault='unfiled', statuses=['open']):
-    hours = 0
+    trusted = _trusted(issues)
     minutes = 0
     for issueid, issue in issues.iteritems():
 
@@ -206,28 +843,8 @@ def _group_estimate(issues, groupvalue, groupfield='group', groupdefault='unfile
         if not valid_status:
             continue
 
-        estimate = issue.get('estimate', '')
-        try:
-            timeamount, timescale = estimate.split()[:2]
-            timescale = timescale.lower().rstrip('s')
-            if timescale == 'minute':
-                minutes += int(timeamount)
-            elif timescale == 'hour':
-                hours += int(timeamount)
-            elif timescale == 'day':
-                hours += 24 * int(timeamount)
-            elif timescale == 'week':
-                hours += 7 * 24 * int(timeamount)
-            else:
-                # We don't currently handle amounts larger than weeks.
-                continue
-        except ValueError:
-            continue
-        except IndexError:
-            continue
-        except AttributeError:
-            continue
-    return hours + (minutes // 60)
+        minutes += _derived(issue, trusted)[0] or 0
+    return minutes // 60
 
 def burndown(repository, groupvalue, dbfolder='issues'):
     try:
@@ -261,6 +878,110 @@ class NoIssueDB(Exception):
     def __str__(self):
         return 'No issue database found in: %s' % self.repository
 
+class ReadOnlyIssueDB(Exception):
+    """\
+    Exception raised when trying to change an issue database that is being
+    read from the repository store.
+    """
+    def __init__(self, repository):
+        self.repository = repository
+    def __str__(self):
+        return 'The issue database is read only in: %s' % self.repository
+
+class _ReadWriteLock(object):
+    """\
+    A reentrant reader/writer lock.  Any number of threads may read at once,
+    while a writer waits for the readers to finish and has the lock to itself.
+    Waiting writers hold off new readers so that they can't be starved, though
+    a thread that already reads or writes may always nest further reads.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writes = 0
+        self._waiting = 0
+
+    @contextmanager
+    def reading(self):
+        me = threading.currentThread()
+        with self._condition:
+            if self._writer is not me and me not in self._readers:
+                while self._writer is not None or self._waiting:
+                    self._condition.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers[me] -= 1
+                if not self._readers[me]:
+                    del self._readers[me]
+                    self._condition.notifyAll()
+
+    @contextmanager
+    def writing(self):
+        me = threading.currentThread()
+        with self._condition:
+            if self._writer is not me:
+                self._waiting += 1
+                try:
+                    while self._writer is not None or [reader for reader in self._readers if reader is not me]:
+                        self._condition.wait()
+                finally:
+                    self._waiting -= 1
+                self._writer = me
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writes -= 1
+                if not self._writes:
+                    self._writer = None
+                    self._condition.notifyAll()
+
+class _NoLock(object):
+    """Stands in for the reader/writer lock when thread safety is off."""
+    @contextmanager
+    def reading(self):
+        yield
+
+    @contextmanager
+    def writing(self):
+        yield
+
+def _reader(method):
+    """Decorate an IssueDB method that only reads from the database."""
+    @wraps(method)
+    def read(self, *args, **kwargs):
+        with self._rwlock.reading():
+            return method(self, *args, **kwargs)
+    return read
+
+class AmbiguousIssueId(Exception):
+    """\
+    Exception raised when an issue id prefix matches more than one issue.
+    """
+    def __init__(self, prefix, matches):
+        self.prefix = prefix
+        self.matches = matches
+    def __str__(self):
+        return 'Issue id %s is ambiguous, it could be: %s' % (
+            self.prefix, ', '.join(self.matches))
+
+class LockTimeout(Exception):
+    """\
+    Exception raised when the repository write lock couldn't be acquired in
+    the time allowed.
+    """
+    def __init__(self, repository, waited):
+        self.repository = repository
+        self.waited = waited
+    def __str__(self):
+        return 'Timed out after %.1f seconds waiting for the lock on: %s' % (
+            self.waited, self.repository)
+
 
 class IssueDB(object):
     """\
@@ -268,30 +989,79 @@ class IssueDB(object):
     of accessing the YAMLTrak API than constantly passing in all of the
     parameters. In addition, it caches some of the work performed so that
     multiple operations run faster.
+
+    By default, an IssueDB must only be used from one thread at a time.
+    Passing threadsafe=True allows one instance to be shared between threads:
+    reads run concurrently under a reader/writer lock while writes are
+    serialized, each thread gets its own mercurial ui and repository objects
+    (which aren't safe to share), and the skeleton caches are shared.
+
+    Passing a revision as rev reads the database as committed at that
+    changeset (which can be a moving target like 'tip') straight from the
+    repository store, through the manifest and filelogs, without a working
+    copy or dirstate.  This serves bare repositories, as found on servers.
+    Such an IssueDB is read only, and writing raises ReadOnlyIssueDB.
     """
-    def __init__(self, folder, dbfolder='issues', indexfile='issues.yaml', dbinit=False):
+    def __init__(self, folder, dbfolder='issues', indexfile='issues.yaml', dbinit=False, threadsafe=False, rev=None, archivefile='archive.yaml'):
         self.dbfolder = dbfolder
+        self.rev = rev
         self.__indexfile = indexfile
+        self.__archivefile = archivefile
         self.__skeletonfile = 'skeleton'
         self.__skeleton_newfile = 'skeleton_new'
 
         # If we ever do a lookup on the skeleton, we'll cache it for speed.
         self._skeleton = None
         self._skeleton_new = None
-        self.ui = ui.ui()
 
-        self.repo = self.__find_repo(folder)
-        self.root = self.repo.root
+        # Parsed revisions of the index and the archive, and separately of
+        # any other file read from the store, by file node.  Walking the
+        # history of many issues then can't push the index out.  Like the
+        # manifest snapshots below, they are kept in order of use, and the
+        # least recently used go first.
+        self._indexrevisions = OrderedDict()
+        self._filerevisions = OrderedDict()
+
+        # The database files in each manifest read from, by manifest node.
+        self._snapshots = OrderedDict()
+        self._cachelock = threading.Lock()
+
+        # The sorted issue ids from the index, along with the index file
+        # identity they were read from.
+        self._ids = None
+
+        # Summary totals, by the fields and status they were asked for, along
+        # with the index file identity they describe.
+        self._stats = {}
+
+        # Time spent waiting on the write lock, for anyone tuning contention.
+        self.lockstats = {'acquired': 0, 'waited': 0.0, 'longest': 0.0}
+
+        if threadsafe:
+            self._rwlock = _ReadWriteLock()
+            self._local = threading.local()
+        else:
+            self._rwlock = _NoLock()
+            self._local = self
+        self._local._ui = ui.ui()
+        self._local._repo = self.__find_repo(folder)
+        self.root = self._local._repo.root
 
         # We've got a valid repository, let's look for an issue database.
-        if not path.exists(self._indexfile) or not path.exists(self._skeletonfile):
+        if rev is not None:
+            dbinit = False
+            try:
+                self._snapshot()
+            except (RepoError, LookupError, util.Abort):
+                raise NoIssueDB(self.root)
+        if not self._exists(self.__indexfile) or not self._exists(self.__skeletonfile):
             if dbinit and self._dbinit():
                 return
             raise NoIssueDB(self.root)
         # Look for the old name
-        if not path.exists(self._skeleton_newfile):
+        if not self._exists(self.__skeleton_newfile):
             self.__skeleton_newfile = 'newticket'
-        if not path.exists(self._skeleton_newfile):
+        if not self._exists(self.__skeleton_newfile):
             if dbinit:
                 # If we don't do this here, we initialize with the wrong name.
                 self.__skeleton_newfile = 'skeleton_new'
@@ -299,6 +1069,20 @@ class IssueDB(object):
                     return
             raise NoIssueDB(self.root)
 
+    @property
+    def ui(self):
+        """The mercurial ui object, one per thread in thread safe mode."""
+        if not hasattr(self._local, '_ui'):
+            self._local._ui = ui.ui()
+        return self._local._ui
+
+    @property
+    def repo(self):
+        """The mercurial repository object, one per thread in thread safe mode."""
+        if not hasattr(self._local, '_repo'):
+            self._local._repo = hg.repository(self.ui, self.root)
+        return self._local._repo
+
     def __find_repo(self, folder):
         checkrepo = folder
         while checkrepo:
@@ -312,6 +1096,161 @@ class IssueDB(object):
                 raise NoRepository(folder)
             checkrepo = root
 
+    def _store_identity(self):
+        """\
+        Return the identities of the changelog and the bookmarks, which change
+        whenever a commit, push, strip or bookmark move could change what a
+        revision refers to.
+        """
+        identities = []
+        for filename in (self.repo.sjoin('00changelog.i'), self.repo.join('bookmarks')):
+            try:
+                identities.append(_identity(stat(filename)))
+            except OSError:
+                identities.append(None)
+        return identities
+
+    def _refresh(self):
+        """\
+        Refresh mercurial's view of the repository, if the changelog or
+        bookmarks changed since this thread last looked, so that committed
+        history read straight from the repository includes new commits.
+        """
+        identity = self._store_identity()
+        if getattr(self._local, '_history', None) != identity:
+            self.repo.invalidate()
+            self._local._history = identity
+
+    def _snapshot(self):
+        """\
+        Return the changeset being read from the store, along with a
+        dictionary mapping the name of each file in the database folder to
+        its file node.  The folder's files are only listed once for each
+        manifest.  Mercurial's view of the repository is only refreshed, and
+        the revision looked up again, when the changelog or bookmarks change,
+        so new commits (or pushes) to a moving revision like tip are seen
+        without paying for it on every call.
+        """
+        identity = self._store_identity()
+        current = getattr(self._local, '_current', None)
+        if current is not None and current[0] == identity:
+            return current[1], current[2]
+
+        self.repo.invalidate()
+        changectx = self.repo[self.rev]
+        manifestnode = changectx.changeset()[0]
+        snapshot = _lru_get(self._snapshots, manifestnode, self._cachelock)
+        if snapshot is None:
+            prefix = self.dbfolder + '/'
+            manifest = changectx.manifest()
+            files = dict((filename[len(prefix):], manifest[filename])
+                         for filename in manifest if filename.startswith(prefix))
+            snapshot = (changectx, files)
+            _lru_set(self._snapshots, manifestnode, snapshot, 8, self._cachelock)
+        # Each thread has its own repository, and so its own changesets.
+        self._local._current = (identity, changectx, snapshot[1])
+        return changectx, snapshot[1]
+
+    def _exists(self, name):
+        """Whether the named file exists in the database."""
+        if self.rev is not None:
+            return name in self._snapshot()[1]
+        return path.exists(path.join(self.root, self.dbfolder, name))
+
+    def _stored(self, name):
+        """\
+        Return the parsed contents of the named database file at the changeset
+        being read from the store, raising IOError if it isn't there.  The
+        result is shared, and must not be modified.
+        """
+        files = self._snapshot()[1]
+        if name not in files:
+            raise IOError(errno.ENOENT, 'No such file at revision %s' % self.rev, name)
+        filename = path.join(self.dbfolder, name)
+        return self._index_revision(self.repo.filectx(filename, fileid=files[name]))
+
+    def _read_index(self):
+        """\
+        Return the parsed index, from the working copy or the store, raising
+        IOError if it can't be read.  The result must not be modified.
+        """
+        if self.rev is not None:
+            return self._stored(self.__indexfile)
+        return _yamlcache.load(self._indexfile)
+
+    def _read_archive(self):
+        """\
+        Return the parsed archive of closed issues, from the working copy or
+        the store, or an empty dictionary if there is none.  The result must
+        not be modified.
+        """
+        try:
+            if self.rev is not None:
+                return self._stored(self.__archivefile) or {}
+            return _yamlcache.load(self._archivefile) or {}
+        except (IOError, yaml.YAMLError):
+            return {}
+
+    def _archived(self, ids):
+        """\
+        Return the set of the given issue ids that are in the archive.  Rather
+        than parse the whole archive, we look for each id as a top level key in
+        its text.
+        """
+        if not ids:
+            return set()
+        try:
+            with open(self._archivefile) as archivefile:
+                text = archivefile.read()
+        except IOError:
+            return set()
+        return set(id for id in ids
+                   if re.search(r"^'?%s'?:" % re.escape(id), text, re.M) is not None)
+
+    def _changectx(self):
+        """The changeset whose history the database is read from."""
+        if self.rev is not None:
+            return self._snapshot()[0]
+        return self.repo['tip']
+
+    @contextmanager
+    def _writelock(self):
+        """\
+        Hold the mercurial working directory lock while writing to the
+        database.  This serializes writers across processes (and with hg
+        itself), while readers rely on files being replaced atomically and so
+        never have to wait.  Rather than mercurial's one second sleeps, we poll
+        with a short backoff so that contended writers aren't held up longer
+        than necessary.  Databases read from the store can't be written.
+        """
+        if self.rev is not None:
+            raise ReadOnlyIssueDB(self.root)
+        timeout = float(self.ui.config('ui', 'timeout', '600'))
+        start = time()
+        delay = 0.005
+        with self._rwlock.writing():
+            while True:
+                try:
+                    lock = self.repo.wlock(False)
+                    break
+                except LockHeld:
+                    waited = time() - start
+                    if timeout >= 0 and waited > timeout:
+                        raise LockTimeout(self.root, waited)
+                    sleep(delay)
+                    delay = min(delay * 2, 0.25)
+            waited = time() - start
+            self.lockstats['acquired'] += 1
+            self.lockstats['waited'] += waited
+            self.lockstats['longest'] = max(self.lockstats['longest'], waited)
+            if waited > 0.001:
+                self.ui.debug('yamltrak: waited %.3f seconds for the lock on %s\n'
+                              % (waited, self.root))
+            try:
+                yield
+            finally:
+                lock.release()
+
     def _dbinit(self):
         """\
         Internal method for initializing the database.  It's not much use on
@@ -322,15 +1261,13 @@ class IssueDB(object):
             makedirs(path.join(self.root, self.dbfolder))
         except OSError:
             pass
-        with open(self._skeletonfile, 'w') as skeletonfile:
-            skeletonfile.write(yaml.dump(SKELETON, default_flow_style=False))
-        with open(self._skeleton_newfile, 'w') as skeletonfile:
-            skeletonfile.write(yaml.dump(SKELETON_NEW, default_flow_style=False))
-        with open(self._indexfile, 'w') as skeletonfile:
-            skeletonfile.write(yaml.dump(INDEX, default_flow_style=False))
-        hgcommands.add(self.ui, self.repo, self._skeletonfile)
-        hgcommands.add(self.ui, self.repo, self._skeleton_newfile)
-        hgcommands.add(self.ui, self.repo, self._indexfile)
+        with self._writelock():
+            _atomic_write(self._skeletonfile, yaml.dump(SKELETON, default_flow_style=False))
+            _atomic_write(self._skeleton_newfile, yaml.dump(SKELETON_NEW, default_flow_style=False))
+            _atomic_write(self._indexfile, yaml.dump(INDEX, default_flow_style=False))
+            hgcommands.add(self.ui, self.repo, self._skeletonfile)
+            hgcommands.add(self.ui, self.repo, self._skeleton_newfile)
+            hgcommands.add(self.ui, self.repo, self._indexfile)
         return True
 
     @property
@@ -338,6 +1275,11 @@ class IssueDB(object):
         """Helper that returns the full path of the issues index file."""
         return path.join(self.root, self.dbfolder, self.__indexfile)
 
+    @property
+    def _archivefile(self):
+        """Helper that returns the full path of the archived issues index file."""
+        return path.join(self.root, self.dbfolder, self.__archivefile)
+
     @property
     def _skeletonfile(self):
         """Helper that returns the full path of the issues skeleton file."""
@@ -348,13 +1290,16 @@ class IssueDB(object):
         """Helper that returns the full path of the issues new skeleton file."""
         return path.join(self.root, self.dbfolder, self.__skeleton_newfile)
 
+    @_reader
     def related(self, filenames=None, ids=None, detail=False, status='open'):
         """\
         Find the list of issue ids, among the ones that are provided, that are
         linked by changeset the the filenames provided.  If no filenames are
         provided, than this will choose the list of modified and uncommitted
         files.  If no ids are provided, this will pull the current list of
-        issues with the status provided, which defaults to 'open'.
+        issues with the status provided, which defaults to 'open'.  When
+        reading from the store there is nothing uncommitted, so filenames
+        must be given.
         """
         # Use revision to walk backwards intelligently.
         # Change this to only accept one repository and to return a history
@@ -362,8 +1307,11 @@ class IssueDB(object):
 
         # Lookup into the status lists returned by repo.status()
         # ['modified', 'added', 'removed', 'deleted', 'unknown', 'ignored', 'clean']
-        statuses = self.repo.status()
-        modified, added = statuses[:2]
+        if self.rev is None:
+            statuses = self.repo.status()
+            modified, added = statuses[:2]
+        else:
+            modified, added = [], []
         uncommitted = modified + added
 
         # If there were no filenames listed, we'll look un the set of edited,
@@ -392,7 +1340,7 @@ class IssueDB(object):
                 continue
 
             try:
-                filectxt = self.repo['tip'][path.join(self.dbfolder, id)]
+                filectxt = self._changectx()[path.join(self.dbfolder, id)]
             except LookupError:
                 # This issue hasn't been committed yet
                 continue
@@ -421,55 +1369,415 @@ class IssueDB(object):
 
         return issues
 
-    def issues(self, status='open'):
+    def _index_identity(self):
         """\
-        Return a list of issues in the database with the given status.
+        Return the size, modification and change times, and inode of the index
+        file, which change whenever it is written, or None if it is missing.  When reading
+        from the store, the file node of the index stands in for them.
         """
-        issuedb = {}
+        if self.rev is not None:
+            return self._snapshot()[1].get(self.__indexfile)
         try:
-            with open(self._indexfile) as indexfile:
-                issuedb = dict(issue for issue in yaml.load(indexfile.read()).iteritems() if issue[0] != 'skeleton' and status in issue[1].get('status', '').lower())
-        except IOError:
+            info = stat(self._indexfile)
+        except OSError:
+            return None
+        return _identity(info)
+
+    def _issueids(self):
+        """\
+        Return the sorted list of issue ids in the index.  The list is kept
+        until the index file changes.
+        """
+        key = self._index_identity()
+        if key is None:
+            return []
+        cached = self._ids
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        try:
+            index = self._read_index() or {}
+        except (IOError, yaml.YAMLError):
+            return []
+        ids = set(str(id) for id in index if id != 'skeleton')
+        if (index.get('skeleton') or {}).get('_archived'):
+            ids.update(str(id) for id in self._read_archive() if id != 'skeleton')
+        ids = sorted(ids)
+        # Only publish the finished list, other threads may be looking.
+        self._ids = (key, ids)
+        return ids
+
+    def resolve(self, id):
+        """\
+        Return the full issue id for the given unique prefix of one.  Full
+        ids, and anything that isn't a prefix of an issue id, are returned
+        unchanged.  AmbiguousIssueId is raised if the prefix matches more than
+        one issue.
+        """
+        if not id or not ISSUEPREFIX.match(id):
+            return id
+        if ISSUEID.match(id) and self._exists(id):
+            return id
+
+        ids = self._issueids()
+        matches = []
+        for candidate in ids[bisect_left(ids, id):]:
+            if not candidate.startswith(id):
+                break
+            matches.append(candidate)
+
+        if id in matches or not matches:
+            return id
+        if len(matches) > 1:
+            raise AmbiguousIssueId(id, matches)
+        return matches[0]
+
+    def shortest_prefixes(self, minimum=4):
+        """\
+        Return a dictionary mapping each issue id to its shortest unique
+        prefix, at least minimum digits long.
+        """
+        ids = self._issueids()
+        prefixes = {}
+        for position, id in enumerate(ids):
+            length = minimum
+            for neighbour in ids[max(position - 1, 0):position] + ids[position + 1:position + 2]:
+                length = max(length, len(commonprefix([id, neighbour])) + 1)
+            prefixes[id] = id[:length]
+        return prefixes
+
+    def _refresh(self):
+        """Drop mercurial's cached view of the repository and working copy."""
+        self.repo.invalidate()
+        if self.rev is None:
+            self.repo.dirstate.invalidate()
+
+    def _uncommitted_issues(self):
+        """\
+        Return a dictionary mapping each issue with uncommitted changes to a
+        fingerprint of its file, or None if the file is gone.  Only the
+        database folder is scanned.
+        """
+        match = matchmod.match(self.root, self.root, ['path:' + self.dbfolder])
+        modified, added, removed, deleted = self.repo.status(match=match)[:4]
+        uncommitted = {}
+        for filename in modified + added + removed + deleted:
+            folder, id = path.split(filename)
+            if folder != self.dbfolder or not ISSUEID.match(id):
+                continue
+            try:
+                with open(path.join(self.root, filename)) as issuefile:
+                    uncommitted[id] = _digest(issuefile.read())
+            except IOError:
+                uncommitted[id] = None
+        return uncommitted
+
+    @_reader
+    def changes_since(self, token=None):
+        """\
+        Return the issues that have changed since the given token, which is
+        one returned by an earlier call.  The result has the issue data for
+        ids 'added' and 'modified', the list of ids 'purged', and the 'token'
+        to pass next time.  Work is proportional to the issue files that
+        differ between the working directory parent at the token and now (so
+        commits, pulls followed by an update, and updates back to older
+        revisions are all seen) and to the uncommitted issue files, rather than
+        to the size of the database.  When reading from the store, the
+        revision being read stands in for the working directory parent.
+        Without a token, or with one that no longer matches the repository
+        (after a strip, say), every issue is returned as added, and 'reset' is
+        set to True.
+        """
+        self._refresh()
+        if self.rev is None:
+            current = self.repo['.']
+            uncommitted = self._uncommitted_issues()
+        else:
+            current = self._snapshot()[0]
+            uncommitted = {}
+        newtoken = urlsafe_b64encode(yaml.safe_dump(
+            {'node': current.hex(), 'uncommitted': uncommitted}))
+
+        def read(id):
+            """The current contents of the issue file, or None if it's gone."""
+            if self.rev is not None:
+                filename = path.join(self.dbfolder, id)
+                return filename in current and current[filename].data() or None
+            try:
+                with open(path.join(self.root, self.dbfolder, id)) as issuefile:
+                    return issuefile.read()
+            except IOError:
+                return None
+
+        then = None
+        if token:
+            try:
+                old = yaml.safe_load(urlsafe_b64decode(str(token)))
+                then = self.repo[old['node']]
+                olduncommitted = old['uncommitted']
+            except Exception:
+                then = None
+
+        if then is None:
+            if self.rev is None:
+                folder = path.join(self.root, self.dbfolder)
+                issues = _parallel_map(_load_issues, [path.join(folder, id) for id in self._issuefiles()])
+            else:
+                issues = []
+                for id in sorted(self._snapshot()[1]):
+                    if ISSUEID.match(id):
+                        try:
+                            issues.append((id, yaml.safe_load(read(id)), None))
+                        except yaml.YAMLError, error:
+                            issues.append((id, None, str(error)))
+            return {'added': dict((id, issue) for id, issue, error in issues if error is None),
+                    'modified': {}, 'purged': [], 'token': newtoken, 'reset': True}
+
+        # Any issue whose committed file differs between the two parents, or
+        # that is uncommitted on either side, is a candidate.
+        candidates = set(uncommitted) | set(olduncommitted)
+        match = matchmod.match(self.root, self.root, ['path:' + self.dbfolder])
+        for filenames in self.repo.status(then.node(), current.node(), match=match)[:3]:
+            for filename in filenames:
+                folder, id = path.split(filename)
+                if folder == self.dbfolder and ISSUEID.match(id):
+                    candidates.add(id)
+
+        changes = {'added': {}, 'modified': {}, 'purged': [], 'token': newtoken, 'reset': False}
+        for id in sorted(candidates):
+            if id in olduncommitted:
+                before = olduncommitted[id]
+            elif path.join(self.dbfolder, id) in then:
+                before = _digest(then[path.join(self.dbfolder, id)].data())
+            else:
+                before = None
+            data = read(id)
+            after = data is not None and _digest(data) or None
+
+            if before == after:
+                continue
+            if after is None:
+                changes['purged'].append(id)
+                continue
+            try:
+                issue = yaml.safe_load(data)
+            except yaml.YAMLError:
+                continue
+            changes[before is None and 'added' or 'modified'][id] = issue
+        return changes
+
+    @_reader
+    def state(self):
+        """\
+        Return a cheap description of the current state of the database: the
+        hex node of tip, and the identity of the index file (see
+        _index_identity).  Any commit, or any write to the database, changes it.
+        Mercurial's cached view of the repository is refreshed first, so that
+        long running processes see commits made by others.
+        """
+        self._refresh()
+        return _hex_node(self.repo.changelog.tip()), self._index_identity()
+
+    @_reader
+    def stats(self, by=['group'], status='open'):
+        """\
+        Return summary totals for the issues with the given status, grouped by
+        the values of the given index fields.  Each row is a dictionary of
+        those field values, along with the 'count' of issues and their summed
+        'estimate' in 'minutes' and whole 'hours'.  Estimates are grouped by
+        their scale, and priorities as issues() normalizes them.  Totals are
+        computed in a single pass over the index, and kept up to date as this
+        object edits the index.
+        """
+        by = tuple(by)
+        key = self._index_identity()
+        cached = self._stats.get((by, status))
+        if cached is None or cached[0] != key:
+            totals = {}
+            try:
+                index = self._read_index() or {}
+            except IOError:
+                return []
+            trusted = _trusted(index)
+            for id, issue in index.iteritems():
+                if id != 'skeleton':
+                    _tally(totals, by, status, issue, 1, trusted)
+            if _archive_wanted(index, status):
+                for id, issue in self._read_archive().iteritems():
+                    if id != 'skeleton' and id not in index:
+                        _tally(totals, by, status, issue, 1, trusted)
+            # Only publish finished totals, other threads may be looking.
+            cached = (key, totals)
+            self._stats[(by, status)] = cached
+
+        rows = []
+        for values, (count, minutes) in sorted(cached[1].iteritems()):
+            row = dict(zip(by, values))
+            row.update({'count': count, 'minutes': minutes, 'hours': minutes // 60})
+            rows.append(row)
+        return rows
+
+    @_reader
+    def issues(self, status='open', at=None, sort=None, limit=None, offset=0, after=None):
+        """\
+        Return a list of issues in the database with the given status.  If at
+        is given, the issues are taken from the index as it was committed at
+        that point, which can be anything mercurial accepts as a revision (a
+        revision number, a node, a tag...) or a date.  A number is taken as a
+        unix timestamp, so revision numbers have to be given as strings.
+
+        If any of sort, limit, offset or after is given, the issues come back
+        ordered, in an OrderedDict.  Sort is a list of index fields (or 'id'),
+        each prefixed with '-' to sort it in descending order, and defaults to
+        the id.  Priorities sort by rank and estimates by length.  After is a
+        cursor from sort_cursor, for paging that is stable against issues
+        being added or removed; offset and limit then select the page.
+
+        The archive of old closed issues is only read when the status asked
+        for can match some of them.
+        """
+        index = self._index_for(self.__indexfile, status, at)
+        if not index:
             # Not all listed repositories have an issue tracking database
-            return issuedb
+            return {}
+        # Parsed revisions are shared, so we work on copies of the entries.
+        issuedb = dict((id, dict(issue)) for id, issue in index.iteritems() if id != 'skeleton' and status in issue.get('status', '').lower())
+        if _archive_wanted(index, status):
+            archive = self._index_for(self.__archivefile, status, at) or {}
+            issuedb.update((id, dict(issue)) for id, issue in archive.iteritems()
+                           if id != 'skeleton' and id not in index and status in str(issue.get('status', '')).lower())
+        trusted = _trusted(index)
+        if sort is not None or limit is not None or offset or after is not None:
+            issuedb = OrderedDict(_select(issuedb, sort or ['id'], limit, offset, after, trusted))
         for issue in issuedb.itervalues():
-            # A proper version of this would figure out the actual time value.
-            # We'll take a shortcut and look at the word.
-            try:
-                timescale = issue['estimate'].split()[1].rstrip('s')
-                if timescale.lower() == 'hour' or timescale.lower() == 'minute':
-                    scale = 'short'
-                elif timescale.lower() == 'day':
-                    scale = 'medium'
-                else:
-                    scale = 'long'
-            except IndexError:
-                scale = 'unplanned'
-            except AttributeError:
-                scale = 'unplanned'
+            _normalize_issue(issue, trusted)
+        return issuedb
+
+    def watch(self, status='open', interval=1.0, timeout=None, **kwargs):
+        """\
+        Yield the issues with the given status, as issues() returns them given
+        the other keyword arguments, and again each time the result changes.
+        The database folder and the repository are watched with inotify where
+        available, so that waiting costs nothing, and polled every interval
+        seconds otherwise.  The index is only read again once the state of the
+        database has changed.  Stops once nothing has changed for timeout
+        seconds, if given.
+        """
+        from yamltrak.watch import watcher
+        hgfolder = path.join(self.root, '.hg')
+        folders = [path.join(hgfolder, 'store'), hgfolder]
+        if self.rev is None:
+            folders.insert(0, path.join(self.root, self.dbfolder))
+        # The changelog is appended to in place, which polling needs to know.
+        # Mercurial has modification times in whole seconds, so polling also
+        # needs the index and the archive, which get a new inode each time
+        # they're replaced, to see changes made within a second.
+        files = [path.join(hgfolder, 'store', '00changelog.i'), path.join(hgfolder, '00changelog.i')]
+        files = [filename for filename in files if path.exists(filename)]
+        if self.rev is None:
+            files.extend([self._indexfile, self._archivefile])
+        changes = watcher([folder for folder in folders if path.isdir(folder)], files, interval)
+        try:
+            state = shown = None
+            while True:
+                newstate = self.state()
+                if newstate != state:
+                    state = newstate
+                    issues = self.issues(status=status, **kwargs)
+                    if issues != shown:
+                        shown = issues
+                        yield issues
+                if not changes.wait(timeout):
+                    if timeout is not None:
+                        return
+                    continue
+                # Let a burst of writes, like a commit, settle before looking.
+                while changes.wait(0.05):
+                    pass
+        finally:
+            changes.close()
+
+    def _index_for(self, name, status, at=None):
+        """\
+        Return the parsed contents of the named index file, as of the given
+        revision or date if at is given, or else from the store or the working
+        copy.  Files too big to cache may only keep entries with the given
+        status.  Returns None if there's no such file, and the result must not
+        be modified.
+        """
+        if at is not None:
+            return self._index_at(at, name)
+        try:
+            if self.rev is not None:
+                return self._stored(name)
+            return _load_index(path.join(self.root, self.dbfolder, name), status)
+        except (IOError, OSError):
+            return None
+
+    def _index_revision(self, filectxt):
+        """\
+        Return the parsed index stored in the given file context, or None if
+        it can't be parsed.  A revision's contents never change, so parsed
+        revisions are cached by file node.  The result is shared, and must not
+        be modified.
+        """
+        node = filectxt.filenode()
+        if path.basename(filectxt.path()) in (self.__indexfile, self.__archivefile):
+            cache = self._indexrevisions
+        else:
+            cache = self._filerevisions
+        # Unparseable revisions are cached as well, so look for a missing key
+        # rather than None.
+        index = _lru_get(cache, node, self._cachelock, _missing)
+        if index is not _missing:
+            return index
+        try:
+            index = yaml.safe_load(filectxt.data())
+        except yaml.YAMLError:
+            # We have to protect from invalid issue data in the repository
+            index = None
+        _lru_set(cache, node, index, 64, self._cachelock)
+        return index
+
+    def _index_at(self, at, name=None):
+        """\
+        Return the parsed index (or the named file alongside it) as of the
+        given revision or date, or None if it didn't exist yet.  Dates are
+        resolved by a binary search over the index filelog, on the dates of
+        the linked changesets.
+        """
+        self._refresh()
+        indexpath = path.join(self.dbfolder, self.__indexfile)
+        changectx = None
+        if not isinstance(at, (int, long, float)):
             try:
-                priority = issue['priority'].lower()
-                if 'high' in priority:
-                    priority = 'high'
-                elif 'normal' in priority:
-                    priority = 'normal'
-                elif 'low' in priority:
-                    priority = 'low'
+                changectx = self.repo[at]
+            except (RepoError, LookupError):
+                # Not a revision, so it has to be a date.  An invalid date
+                # raises util.Abort.
+                changectx = None
+        if changectx is None:
+            at = _timestamp(at)
+
+        if changectx is None:
+            filelog = self.repo.file(indexpath)
+            low, high = 0, len(filelog)
+            while low < high:
+                middle = (low + high) // 2
+                if self.repo[filelog.linkrev(middle)].date()[0] <= at:
+                    low = middle + 1
                 else:
-                    # Don't want any slipping through the cracks.
-                    priority = 'high'
-
-            except KeyError:
-                priority = 'high'
-            except IndexError:
-                priority = 'high'
-            except AttributeError:
-                priority = 'high'
-
-            issue['estimate'] = {'scale':scale, 'text':issue.get('estimate') is None and '' or issue['estimate']}
-            issue['priority'] = priority
-        return issuedb
+                    high = middle
+            if not low:
+                return None
+            changectx = self.repo[filelog.linkrev(low - 1)]
 
+        try:
+            return self._index_revision(changectx[path.join(self.dbfolder, name or self.__indexfile)])
+        except LookupError:
+            # The file hadn't been committed at this revision
+            return None
+
+    @_reader
     def issue(self, id, detail=True):
         """\
         Return detailed information about the issue requested.  If detail is
@@ -477,18 +1785,22 @@ class IssueDB(object):
         associating files, the committing user, changeset node, and date.
         """
 
+        id = self.resolve(id)
+
         # Use revision to walk backwards intelligently.
         # Change this to only accept one repository and to return a history
         issue = None
         try:
-            with open(path.join(self.root, self.dbfolder, id)) as issuefile:
-                issue = [{'data':yaml.safe_load(issuefile.read())}]
+            if self.rev is not None:
+                issue = [{'data': deepcopy(self._stored(id))}]
+            else:
+                issue = [{'data': _yamlcache.load(path.join(self.root, self.dbfolder, id))}]
 
             if not detail:
                 return issue
 
             try:
-                filectxt = self.repo['tip'][path.join(self.dbfolder, id)]
+                filectxt = self._changectx()[path.join(self.dbfolder, id)]
             except LookupError:
                 # This issue hasn't been committed yet
                 return issue
@@ -529,6 +1841,72 @@ class IssueDB(object):
 
         return issue
 
+    def timeline(self, since=None, until=None, limit=None):
+        """\
+        Yield the committed changes to issues across the whole repository,
+        newest first, in a single pass over the changelog.  Each event looks
+        like an entry of the issue history, with the issue 'id', the 'data'
+        it was changed to, the committing 'user', the 'date', the changeset
+        'node', the linked 'files', and the 'diff' from the previous version.
+        Only changesets dated between since and until are included, and the
+        walk stops as soon as limit events have been produced.  When reading
+        from the store, only the revision read from and its ancestors are
+        walked.
+
+        Committed history never changes, so unlike the other readers this
+        doesn't hold the read lock while the caller consumes events.
+        """
+        if self.rev is not None:
+            revset, args = ['reverse(::%d)'], [self._snapshot()[0].rev()]
+        else:
+            self._refresh()
+            revset, args = ['reverse(all())'], []
+        # Commit dates don't have to grow with revision numbers, so the date
+        # range can't end the walk.  Mercurial's date() predicate filters
+        # while it walks, on whole seconds, and the exact bounds are checked
+        # below.
+        if since is not None:
+            since = _timestamp(since)
+            revset.append('date(%s)')
+            args.append('>%d 0' % since)
+        if until is not None:
+            until = _timestamp(until)
+            revset.append('date(%s)')
+            args.append('<%d 0' % (until + 1))
+
+        count = 0
+        for rev in self.repo.revs(' and '.join(revset), *args):
+            if limit is not None and count >= limit:
+                return
+            changectx = self.repo[rev]
+            date = changectx.date()
+            if since is not None and date[0] < since or until is not None and date[0] > until:
+                continue
+
+            for filename in changectx.files():
+                folder, id = path.split(filename)
+                if folder != self.dbfolder or not ISSUEID.match(id):
+                    continue
+
+                try:
+                    newrev = filename in changectx and yaml.safe_load(changectx[filename].data()) or {}
+                    parentctx = changectx.parents()[0]
+                    oldrev = filename in parentctx and yaml.safe_load(parentctx[filename].data()) or {}
+                except yaml.YAMLError:
+                    # We have to protect from invalid issue data in the repository
+                    continue
+
+                yield {'id': id,
+                       'data': newrev,
+                       'user': changectx.user(),
+                       'date': util.datestr(date),
+                       'files': changectx.files(),
+                       'node': _hex_node(changectx.node()),
+                       'diff': issuediff(oldrev, newrev)}
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
     @property
     def skeleton(self):
         """\
@@ -537,9 +1915,10 @@ class IssueDB(object):
         """
         if self._skeleton:
             return self._skeleton
-        self._skeleton = self.issue(self.__skeletonfile, detail=False)
-        if self._skeleton:
-            self._skeleton = self._skeleton[0]['data']
+        # Only publish the finished value, other threads may be looking.
+        skeleton = self.issue(self.__skeletonfile, detail=False)
+        if skeleton:
+            self._skeleton = skeleton[0]['data']
         return self._skeleton
 
     @property
@@ -550,9 +1929,9 @@ class IssueDB(object):
         """
         if self._skeleton_new:
             return self._skeleton_new
-        self._skeleton_new = self.issue(self.__skeleton_newfile, detail=False)
-        if self._skeleton_new:
-            self._skeleton_new = self._skeleton_new[0]['data']
+        skeleton_new = self.issue(self.__skeleton_newfile, detail=False)
+        if skeleton_new:
+            self._skeleton_new = skeleton_new[0]['data']
         return self._skeleton_new
 
     def new(self, issue, status='open'):
@@ -570,20 +1949,21 @@ class IssueDB(object):
         if 'comment' not in newissue:
             newissue['comment'] = 'Opening issue'
 
-        # This can fail in an empty repository.  Handle this
-        hgcommands.tag(self.ui, self.repo, NEW_ISSUE_TAG, force=True, message='ISSUEPREP: %s' % newissue.get('title', 'No issue title'))
-        context = self.repo['tip']
-        issueid = _hex_node(context.node())
-        try:
-            with open(path.join(self.root, self.dbfolder, issueid), 'w') as issuefile:
-                issuefile.write(yaml.safe_dump(newissue, default_flow_style=False))
-            hgcommands.add(self.ui, self.repo, path.join(self.root, self.dbfolder, issueid))
-        except IOError:
-            return false
+        with self._writelock():
+            # This can fail in an empty repository.  Handle this
+            hgcommands.tag(self.ui, self.repo, NEW_ISSUE_TAG, force=True, message='ISSUEPREP: %s' % newissue.get('title', 'No issue title'))
+            context = self.repo['tip']
+            issueid = _hex_node(context.node())
+            try:
+                _atomic_write(path.join(self.root, self.dbfolder, issueid),
+                              yaml.safe_dump(newissue, default_flow_style=False))
+                hgcommands.add(self.ui, self.repo, path.join(self.root, self.dbfolder, issueid))
+            except (IOError, OSError):
+                return False
 
-        # Poor man's code reuse.  Since I haven't yet factored out the index
-        # updating, I'll just call edit without any values.
-        return self.edit(id=issueid, issue={}) and issueid
+            # Poor man's code reuse.  Since I haven't yet factored out the index
+            # updating, I'll just call edit without any values.
+            return self.edit(id=issueid, issue={}) and issueid
 
     def edit(self, id=None, issue=None):
         """\
@@ -593,25 +1973,91 @@ class IssueDB(object):
         """
         if issue is None or not id:
             return
+        id = self.resolve(id)
+
+        # The lock covers reading the original issue as well, so that a
+        # concurrent edit can't slip in between our read and our write.
+        with self._writelock():
+            # We use the skeleton to filter any edits. We also leave any values
+            # from the original issue intact.
+            oldissue = self.issue(id=id, detail=False)[0]['data']
+            saveissue = self._merge(oldissue, issue)
 
-        # We use the skeleton to filter any edits. We also leave any values
-        # from the original issue intact.
-        oldissue = self.issue(id=id, detail=False)[0]['data']
+            try:
+                _atomic_write(path.join(self.root, self.dbfolder, id),
+                              yaml.safe_dump(saveissue, default_flow_style=False))
+            except (IOError, OSError):
+                return False
+
+            return self._update_index(id, saveissue)
+
+    def _merge(self, oldissue, issue):
+        """\
+        Return the issue to save for the given changes to oldissue, with every
+        field in the skeleton and nothing else.
+        """
         saveissue = {}
         for field, default in self.skeleton.iteritems():
             saveissue[field] = issue.get(field, oldissue.get(field, default))
             if saveissue[field] is None:
                 # I don't like null values in the database.
                 saveissue[field] = ''
+        return saveissue
 
-        try:
-            with open(path.join(self.root, self.dbfolder, id), 'w') as issuefile:
-                issuefile.write(yaml.safe_dump(saveissue, default_flow_style=False))
-        except IOError:
-            return false
+    def update_where(self, predicate, changes, dryrun=False):
+        """\
+        Apply the given changes to every issue in the index that matches the
+        predicate, which is either a function taking an issue id and its index
+        entry, or a dictionary of fields and the values they must equal.  Only
+        the issue files that actually change are rewritten, and the index is
+        written once.  Archived issues aren't considered.  Returns the sorted
+        ids of the issues changed, or that would be with dryrun set.
+        """
+        predicate = _predicate(predicate)
+        with self._writelock():
+            try:
+                index = _yamlcache.load(self._indexfile)
+            except IOError:
+                return False
 
-        return self._update_index(id, saveissue)
+            updates = {}
+            for id, entry in sorted(index.iteritems()):
+                if id == 'skeleton' or not isinstance(entry, dict) or not predicate(id, entry):
+                    continue
+                try:
+                    oldissue = _yamlcache.load(path.join(self.root, self.dbfolder, id))
+                except (IOError, yaml.YAMLError):
+                    continue
+                saveissue = self._merge(oldissue, changes)
+                if saveissue != self._merge(oldissue, {}):
+                    updates[id] = saveissue
+            if dryrun:
+                return sorted(updates)
 
+            written = {}
+            try:
+                for id, saveissue in sorted(updates.iteritems()):
+                    _atomic_write(path.join(self.root, self.dbfolder, id),
+                                  yaml.safe_dump(saveissue, default_flow_style=False))
+                    written[id] = saveissue
+            except (IOError, OSError):
+                # The index must still describe the files we did write.
+                self._update_index_many(written)
+                return False
+
+            if not self._update_index_many(written):
+                return False
+        return sorted(written)
+
+    def close_where(self, predicate, comment=None, dryrun=False):
+        """\
+        Close every issue matching the predicate, as update_where does.  This
+        is just a convenience method.
+        """
+        changes = {'status': 'closed'}
+        if comment is not None:
+            changes['comment'] = comment
+        return self.update_where(predicate, changes, dryrun)
 
     def _update_index(self, id, issue):
         """\
@@ -620,49 +2066,320 @@ class IssueDB(object):
         not just changed values, to ensure that we have a fully up to date
         index if the skeleton changes.
         """
-        try:
-            with open(self._indexfile, 'r') as indexfile:
-                index = yaml.load(indexfile.read())
-        except IOError:
-            return false
+        return self._update_index_many({id: issue})
+
+    def _update_index_many(self, issues):
+        """\
+        Update the index as _update_index does, for a dictionary mapping ids
+        to their full issue data, or to None to remove them, writing the index
+        only once.
+        """
+        with self._writelock():
+            oldkey = self._index_identity()
+            try:
+                index = _yamlcache.load(self._indexfile)
+            except IOError:
+                return False
+
+            # Archived issues that change come back to the index.
+            archived = self._archived([id for id in issues if id not in index])
+            archive = None
+            if archived:
+                archive = _yamlcache.load(self._archivefile)
+
+            changes = []
+            for id, issue in issues.iteritems():
+                old = index.get(id)
+                if id in archived:
+                    old = archive.pop(id, None)
+                if issue is  None:
+                    index.pop(id, None)
+                else:
+                    # We only write out the properties listed in the skeleton to the index.
+                    index[id] = _index_issue(index['skeleton'], issue)
+                changes.append((old, index.get(id)))
+            if archive is not None:
+                _set_archived(index, archive)
+
+            # The index is written first, so that a failure in between leaves
+            # the issue in both, where the index wins, rather than in neither.
+            _atomic_write(self._indexfile, yaml.safe_dump(index, default_flow_style=False))
+            if archive is not None:
+                _atomic_write(self._archivefile, yaml.safe_dump(archive, default_flow_style=False))
+            self._update_stats(oldkey, changes, _trusted(index))
 
-        if issue is  None:
-            del(index[id])
+        return True
+
+    def _update_stats(self, oldkey, changes, trusted=False):
+        """\
+        Carry the summary totals describing the index as it was over to the
+        index just written, where each pair of entries in changes has the old
+        entry replaced by the new.  Totals for any other version of the index
+        are dropped.
+        """
+        newkey = self._index_identity()
+        stats = {}
+        for (by, status), (key, totals) in self._stats.items():
+            if key != oldkey:
+                continue
+            totals = dict((values, list(total)) for values, total in totals.iteritems())
+            for old, new in changes:
+                _tally(totals, by, status, old, -1, trusted)
+                _tally(totals, by, status, new, 1, trusted)
+            stats[(by, status)] = (newkey, totals)
+        self._stats = stats
+
+    def _issuefiles(self):
+        """Return the sorted list of issue ids with a file in the database."""
+        return sorted(name for name in listdir(path.join(self.root, self.dbfolder))
+                      if ISSUEID.match(name))
+
+    def _check_index(self, processes=None, upgrade=False, migration=None, dryrun=False):
+        """\
+        Parse every issue file, across a process pool, and compare the result
+        with the index and the archive.  Returns the report of differences
+        along with the index and the archive that the issue files describe.
+        Issues that can't be parsed keep whatever entry they already have.
+        With upgrade set, the new index is of the current version, with
+        derived columns.  Given a migration, it is applied to each issue file
+        as it is parsed (see migrate), and the ids of those that changed are
+        reported as 'migrated'.
+        """
+        try:
+            index = _yamlcache.load(self._indexfile) or {}
+        except (IOError, yaml.YAMLError):
+            index = {}
+        skeleton = dict(index.get('skeleton') or INDEX['skeleton'])
+        skeleton.pop('_archived', None)
+        if upgrade:
+            skeleton = dict(skeleton, _version=INDEX_VERSION)
+        if migration is not None:
+            skeleton = _migrate_fields(migration, skeleton, defaults=False, values=False)
+            skeleton.update((field, help) for field, help in migration.get('index', {}).iteritems()
+                            if field not in skeleton)
+
+        # Archived issues are checked against their archive entry, and stay in
+        # the archive.  Anything in both belongs to the index.
+        archive = self._read_archive()
+        archived = set(id for id in archive if id != 'skeleton' and id not in index)
+        index = dict(index)
+        index.update((id, archive[id]) for id in archived)
+
+        folder = path.join(self.root, self.dbfolder)
+        filenames = [path.join(folder, id) for id in self._issuefiles()]
+
+        # Upgrading adds derived columns everywhere, which isn't worth a report.
+        compared = _trusted(index) and DERIVED or ()
+
+        report = {'missing': [], 'orphaned': [], 'stale': {}, 'unreadable': {}}
+        if migration is None:
+            results = _parallel_map(_load_issues, filenames, processes)
         else:
-            # We only write out the properties listed in the skeleton to the index.
-            indexissue = {}
-            for field in index['skeleton']:
-                if field in issue:
-                    indexissue[field] = issue[field]
-            index[id] = indexissue
+            results = _parallel_map(partial(_migrate_issues, migration, dryrun), filenames, processes)
+            report['migrated'] = sorted(result[0] for result in results if result[3])
+            results = [result[:3] for result in results]
+        newindex = {'skeleton': skeleton}
+        for id, issue, error in results:
+            if error is not None or not isinstance(issue, dict):
+                report['unreadable'][id] = error or 'Not a mapping of fields'
+                if id in index:
+                    newindex[id] = index[id]
+                continue
+            newindex[id] = _index_issue(skeleton, issue)
+            if id not in index:
+                report['missing'].append(id)
+                continue
+            entry = dict((field, value) for field, value in newindex[id].iteritems()
+                         if field not in DERIVED or field in compared)
+            diff = issuediff(index[id] or {}, entry)
+            if diff:
+                report['stale'][id] = diff
+
+        report['orphaned'] = sorted(id for id in index
+                                    if id != 'skeleton' and id not in newindex)
+        report['missing'].sort()
+
+        newarchive = {'skeleton': dict(skeleton)}
+        for id in archived & set(newindex):
+            newarchive[id] = newindex.pop(id)
+        _set_archived(newindex, newarchive)
+        return report, newindex, newarchive
+
+    @_reader
+    def fsck(self, processes=None):
+        """\
+        Compare the index with the issue files without writing anything.
+        Returns a dictionary listing the ids 'missing' from the index, the ids
+        'orphaned' in the index with no issue file, the 'stale' index entries
+        (mapped to an issuediff from the index to the issue file), and the
+        'unreadable' issue files (mapped to the parse error).
+        """
+        return self._check_index(processes)[0]
 
-        with open(self._indexfile, 'w') as indexfile:
-            indexfile.write(yaml.safe_dump(index, default_flow_style=False))
+    def reindex(self, processes=None):
+        """\
+        Rebuild the index from the issue files, filtering each one through the
+        index skeleton, and replace the index file atomically.  Older indexes
+        are upgraded to the current version along the way.  Returns the same
+        report as fsck describing what was fixed.
+        """
+        with self._writelock():
+            report, index, archive = self._check_index(processes, upgrade=True)
+            if len(archive) > 1 or path.exists(self._archivefile):
+                _atomic_write(self._archivefile, yaml.safe_dump(archive, default_flow_style=False))
+            _atomic_write(self._indexfile, yaml.safe_dump(index, default_flow_style=False))
+        return report
+
+    def migrate(self, add=None, rename=None, drop=None, transform=None, index=None,
+                processes=None, dryrun=False):
+        """\
+        Apply a change of the skeleton to every issue file, the skeletons, the
+        index and the archive, rather than waiting for each issue to be edited.
+        Fields are renamed (given a dictionary of old to new names), dropped
+        (given a list), added (given a dictionary of fields to their default
+        values) and their values transformed (given a dictionary of fields to
+        either a function or a dictionary of old to new values), in that order.
+        Fields listed in index, a dictionary of fields to their help text, are
+        added to the index skeleton.  Issue files are migrated across a process
+        pool, so transform functions must then be picklable, and each is
+        replaced atomically.  Returns the sorted ids of the issues 'migrated',
+        or that would be with dryrun set, and the 'unreadable' issue files.
+        """
+        migration = {'add': add or {}, 'rename': rename or {}, 'drop': list(drop or ()),
+                     'transform': transform or {}, 'index': index or {}}
+        with self._writelock():
+            report, newindex, newarchive = self._check_index(processes, upgrade=True,
+                                                             migration=migration, dryrun=dryrun)
+            if dryrun:
+                return {'migrated': report['migrated'], 'unreadable': report['unreadable']}
+
+            # The skeletons gain their new fields with the default values,
+            # which double as their help text.
+            for filename, skeleton, defaults in ((self._skeletonfile, self.skeleton or {}, True),
+                                                 (self._skeleton_newfile, self.skeleton_new or {}, False)):
+                migrated = _migrate_fields(migration, skeleton, defaults, values=False)
+                if migrated != skeleton:
+                    _atomic_write(filename, yaml.safe_dump(migrated, default_flow_style=False))
+            self._skeleton = self._skeleton_new = None
+
+            if len(newarchive) > 1 or path.exists(self._archivefile):
+                _atomic_write(self._archivefile, yaml.safe_dump(newarchive, default_flow_style=False))
+            _atomic_write(self._indexfile, yaml.safe_dump(newindex, default_flow_style=False))
+        return {'migrated': report['migrated'], 'unreadable': report['unreadable']}
+
+    def archive(self, days=None, dryrun=False):
+        """\
+        Move the closed issues that haven't been changed for the given number
+        of days (by default the yamltrak.archivedays setting, or 90) out of
+        the index and into the archive, so that the index stays small as
+        history grows.  Issues changed since their last commit stay put.
+        Returns the sorted ids of the issues archived, or that would be with
+        dryrun set.  Archived issues that change again move back to the index.
+        """
+        if days is None:
+            days = float(self.ui.config('yamltrak', 'archivedays', '90'))
+        cutoff = time() - days * 24 * 60 * 60
+
+        with self._writelock():
+            index = _yamlcache.load(self._indexfile)
+            uncommitted = self._uncommitted_issues()
+            ids = []
+            for id, issue in index.iteritems():
+                if id == 'skeleton' or id in uncommitted:
+                    continue
+                if 'closed' not in str(issue.get('status', '')).lower():
+                    continue
+                filelog = self.repo.file(path.join(self.dbfolder, id))
+                if not len(filelog):
+                    # Never committed
+                    continue
+                if self.repo[filelog.linkrev(len(filelog) - 1)].date()[0] <= cutoff:
+                    ids.append(id)
+            ids.sort()
+            if dryrun or not ids:
+                return ids
 
-        return True
+            try:
+                archive = _yamlcache.load(self._archivefile) or {}
+                new = False
+            except IOError:
+                archive, new = {}, True
+            archive['skeleton'] = dict(index['skeleton'])
+            archive['skeleton'].pop('_archived', None)
+            for id in ids:
+                archive[id] = index.pop(id)
+            _set_archived(index, archive)
+
+            # The archive is written first, so that a failure in between leaves
+            # the issues in both, where the index wins, rather than in neither.
+            _atomic_write(self._archivefile, yaml.safe_dump(archive, default_flow_style=False))
+            if new:
+                hgcommands.add(self.ui, self.repo, self._archivefile)
+            _atomic_write(self._indexfile, yaml.safe_dump(index, default_flow_style=False))
+        return ids
 
     def close(self, id, comment=None):
         """\
         Set the status on the given issue to closed.  This is just a
         convenience method.
         """
+        id = self.resolve(id)
         if comment is not None:
             return self.edit(issue={'status':'closed','comment':comment}, id=id)
 
         return self.edit(issue={'status':'closed'}, id=id)
 
-    def purge(self, id):
+    def purge(self, ids=None, where=None, dryrun=False):
         """\
-        Purge an issue from the database.  This schedules the issue file for
-        removal from the repository, and removes any info from the index.
+        Purge issues from the database.  This schedules the issue files for
+        removal from the repository, and removes any info from the index and
+        the archive.  The issues are given either as an id or a list of ids,
+        which may be unique prefixes, or as a predicate on the index entries
+        like the one update_where takes.  All of the files are removed in one
+        go, and the index is written once.  Returns the sorted ids of the
+        issues purged, or that would be with dryrun set.
         """
-        if not id:
-            return
-
-        hgcommands.remove(self.ui, self.repo, path.join(self.root, self.dbfolder, id, force=True))
-
-        return self._update_index(id, None)
+        if isinstance(ids, basestring):
+            ids = [ids]
+        ids = [self.resolve(id) for id in ids or [] if id]
+        if not ids and where is None:
+            return []
 
+        with self._writelock():
+            try:
+                index = _yamlcache.load(self._indexfile)
+            except IOError:
+                return False
+
+            if where is not None:
+                where = _predicate(where)
+                ids.extend(id for id, entry in index.iteritems()
+                           if id != 'skeleton' and isinstance(entry, dict) and where(id, entry))
+
+            # Only purge what is actually there, in the index, the archive or
+            # as an issue file.
+            folder = path.join(self.root, self.dbfolder)
+            archived = self._archived([id for id in ids if id not in index])
+            purged = sorted(set(id for id in ids if ISSUEID.match(id) and
+                                (id in index or id in archived or path.exists(path.join(folder, id)))))
+            if dryrun or not purged:
+                return purged
+
+            filenames = [path.join(folder, id) for id in purged if path.exists(path.join(folder, id))]
+            if filenames:
+                hgcommands.remove(self.ui, self.repo, *filenames, force=True)
+                # Issues that were never committed are only forgotten.
+                for filename in filenames:
+                    try:
+                        remove(filename)
+                    except OSError:
+                        pass
+
+            if not self._update_index_many(dict((id, None) for id in purged)):
+                return False
+        return purged
+
+    @_reader
     def burndown(self, groupvalue, groupfield='group', groupdefault='unfiled'):
         """\
         Return issue completing status for the given grouping.  This will
@@ -672,8 +2389,7 @@ class IssueDB(object):
         checkpoints = []
 
         try:
-            with open(self._indexfile) as indexfile:
-                issues = yaml.load(indexfile.read())
+            issues = self._read_index()
         except IOError:
             # Not all listed repositories have an issue tracking database, nor
             # do they contain this particular issue.  This needs to be changed
@@ -687,7 +2403,7 @@ class IssueDB(object):
         checkpoints.append([time(), estimate])
 
         try:
-            filectxt = self.repo['tip'][path.join(self.dbfolder, 'issues.yaml')]
+            filectxt = self._changectx()[path.join(self.dbfolder, self.__indexfile)]
         except LookupError:
             # The index hasn't been committed yet
             return checkpoints
@@ -699,10 +2415,8 @@ class IssueDB(object):
         filectxt = filectxt.filectx(filerevid)
 
         while True:
-            try:
-                issues = yaml.safe_load(filectxt.data())
-            except yaml.loader.ScannerError:
-                # We have to protect from invalid issue data in the repository
+            issues = self._index_revision(filectxt)
+            if issues is None:
                 filerevid = filectxt.filerev() - 1
                 if filerevid < 0:
                     break
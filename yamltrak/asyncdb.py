@@ -0,0 +1,250 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# Parsing YAML and walking filelogs can take hundreds of milliseconds, which
+# is far too long to block an event loop for.  This module runs the IssueDB
+# API on an executor and hands back futures instead.
+#
+# Those are concurrent.futures futures, not awaitables: there is no asyncio on
+# Python 2.  Event loops that wait on them, like Tornado's coroutines, can
+# use them as they are.  Anything else can poll done(), or use
+# add_done_callback and hand the result over to its own thread, since the
+# callbacks run on the executor's threads.
+from __future__ import with_statement
+from collections import deque
+import threading
+try:
+    from concurrent.futures import Future, ThreadPoolExecutor
+except ImportError:
+    # Python 2 needs the 'futures' backport for this module.
+    Future = None
+from yamltrak import IssueDB, _freeze, _thaw
+
+# The slots of each repository root, shared by every AsyncIssueDB on it.
+_roots = {}
+_rootslock = threading.Lock()
+
+
+class _Job(object):
+    """\
+    A call waiting for, or running on, the executor, along with the futures
+    of every caller waiting on its result.
+    """
+    def __init__(self, owner, key, method, args, kwargs):
+        self.owner = owner
+        self.key = key
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.callers = []
+        self.started = False
+
+
+class _Slots(object):
+    """\
+    The calls running against a repository, and the calls of every
+    AsyncIssueDB on it waiting for one of its 'limit' slots.  The lock also
+    guards the state of those AsyncIssueDB objects.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.running = 0
+        self.pending = deque()
+
+
+def _slots(root, limit):
+    """Return the slots of the repository at root, making them with limit slots."""
+    with _rootslock:
+        slots = _roots.get(root)
+        if slots is None:
+            slots = _roots[root] = _Slots(limit)
+        return slots
+
+
+class AsyncIssueDB(object):
+    """\
+    A non-blocking facade over an IssueDB.  Every method mirrors the IssueDB
+    method of the same name, but runs it on an executor and returns a
+    concurrent.futures future for the result right away.  These futures
+    aren't awaitable, see the top of this module.
+
+    At most 'limit' calls run against the repository at once, the rest wait
+    their turn.  The limit is shared by every AsyncIssueDB opened on the same
+    repository root, and set by the first one.  Identical read calls that
+    overlap share a single run, but every caller gets its own copy of the
+    result, and its own future.  Cancelling that future only gives up on the
+    result for that caller.  A call is skipped if every caller waiting on it
+    cancels before it starts.  Keyword arguments not listed here are passed
+    on to IssueDB, which is always opened in thread safe mode.
+    """
+    def __init__(self, folder, executor=None, limit=4, **kwargs):
+        if Future is None:
+            raise ImportError('AsyncIssueDB requires concurrent.futures (the '
+                              '"futures" package on Python 2)')
+        self.issuedb = IssueDB(folder, threadsafe=True, **kwargs)
+        self.root = self.issuedb.root
+        self._ownexecutor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=limit)
+        self._executor = executor
+
+        self._slots = _slots(self.root, limit)
+        self._lock = self._slots.lock
+        self._inflight = {}
+
+    def _call(self, name, args, kwargs, share=False):
+        """\
+        Queue up a call to the named IssueDB method, joining an identical call
+        that is already in flight if share is set, and return a future for
+        this caller.
+        """
+        key = share and repr((name, args, sorted(kwargs.items()))) or None
+        caller = Future()
+        start = None
+        with self._lock:
+            job = key is not None and self._inflight.get(key) or None
+            if job is not None:
+                if job.started:
+                    caller.set_running_or_notify_cancel()
+                job.callers.append(caller)
+                return caller
+
+            job = _Job(self, key, getattr(self.issuedb, name), args, kwargs)
+            job.callers.append(caller)
+            if key is not None:
+                self._inflight[key] = job
+            if self._slots.running < self._slots.limit:
+                self._slots.running += 1
+                start = job
+            else:
+                self._slots.pending.append(job)
+
+        if start is not None:
+            self._start(start)
+        return caller
+
+    def _start(self, job):
+        """\
+        Hand the job to the executor of the AsyncIssueDB it came from,
+        skipping over jobs that every caller has cancelled.  The jobs waiting
+        for a slot can come from any AsyncIssueDB on the repository.
+        """
+        while job is not None:
+            owner = job.owner
+            with self._lock:
+                job.callers = [caller for caller in job.callers
+                               if caller.set_running_or_notify_cancel()]
+                job.started = True
+                wanted = bool(job.callers)
+            if wanted:
+                inner = owner._executor.submit(job.method, *job.args, **job.kwargs)
+                inner.add_done_callback(lambda inner, job=job: job.owner._finished(job, inner))
+                return
+            job = owner._next(job.key)
+
+    def _next(self, key):
+        """Release the slot held by the finished job, or pass it on."""
+        with self._lock:
+            if key is not None:
+                self._inflight.pop(key, None)
+            if self._slots.pending:
+                return self._slots.pending.popleft()
+            self._slots.running -= 1
+            return None
+
+    def _finished(self, job, inner):
+        # Once out of _inflight, nobody else can join the job.
+        following = self._next(job.key)
+        with self._lock:
+            callers = list(job.callers)
+        exception = inner.exception()
+        if exception is not None:
+            for caller in callers:
+                caller.set_exception(exception)
+        else:
+            # The first caller gets the result itself, the others copies.
+            result = inner.result()
+            if len(callers) > 1:
+                stored, marshalled = _freeze(result)
+            for number, caller in enumerate(callers):
+                if number:
+                    caller.set_result(_thaw(stored, marshalled))
+                else:
+                    caller.set_result(result)
+        self._start(following)
+
+    def shutdown(self, wait=True):
+        """Shut down the executor, if it was created by this object."""
+        if self._ownexecutor:
+            self._executor.shutdown(wait=wait)
+
+    def issues(self, *args, **kwargs):
+        """A future for IssueDB.issues"""
+        return self._call('issues', args, kwargs, share=True)
+
+    def issue(self, *args, **kwargs):
+        """A future for IssueDB.issue"""
+        return self._call('issue', args, kwargs, share=True)
+
+    def related(self, *args, **kwargs):
+        """A future for IssueDB.related"""
+        return self._call('related', args, kwargs, share=True)
+
+    def burndown(self, *args, **kwargs):
+        """A future for IssueDB.burndown"""
+        return self._call('burndown', args, kwargs, share=True)
+
+    def stats(self, *args, **kwargs):
+        """A future for IssueDB.stats"""
+        return self._call('stats', args, kwargs, share=True)
+
+    def fsck(self, *args, **kwargs):
+        """A future for IssueDB.fsck"""
+        return self._call('fsck', args, kwargs, share=True)
+
+    def new(self, *args, **kwargs):
+        """A future for IssueDB.new"""
+        return self._call('new', args, kwargs)
+
+    def edit(self, *args, **kwargs):
+        """A future for IssueDB.edit"""
+        return self._call('edit', args, kwargs)
+
+    def close(self, *args, **kwargs):
+        """A future for IssueDB.close"""
+        return self._call('close', args, kwargs)
+
+    def update_where(self, *args, **kwargs):
+        """A future for IssueDB.update_where"""
+        return self._call('update_where', args, kwargs)
+
+    def close_where(self, *args, **kwargs):
+        """A future for IssueDB.close_where"""
+        return self._call('close_where', args, kwargs)
+
+    def purge(self, *args, **kwargs):
+        """A future for IssueDB.purge"""
+        return self._call('purge', args, kwargs)
+
+    def migrate(self, *args, **kwargs):
+        """A future for IssueDB.migrate"""
+        return self._call('migrate', args, kwargs)
+
+    def reindex(self, *args, **kwargs):
+        """A future for IssueDB.reindex"""
+        return self._call('reindex', args, kwargs)
@@ -15,39 +15,145 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import sys
 import textwrap
+from time import strftime
+import yaml
+try:
+    import json
+except ImportError:
+    import simplejson as json
 from termcolor import colored
+from mercurial.util import Abort
 from yamltrak.argparse import ArgumentParser
-from yamltrak import IssueDB, NoRepository, NoIssueDB
+from yamltrak import IssueDB, NoRepository, NoIssueDB, AmbiguousIssueId
+from yamltrak import options
+
+class Output(object):
+    """\
+    Collects everything a command prints, and writes it to the stream in
+    large blocks rather than line by line.  In the human format, lines are
+    wrapped and, when the stream is a terminal, colored.  In the json, jsonl
+    and yaml formats, only records are written, each one as soon as it is
+    produced, without any coloring or wrapping.
+    """
+    def __init__(self, format='human', stream=None, buffersize=65536):
+        self.format = format
+        self.stream = stream or sys.stdout
+        self.buffersize = buffersize
+        self.color = format == 'human' and getattr(self.stream, 'isatty', lambda: False)()
+        self._buffer = []
+        self._size = 0
+        self._records = 0
+
+    @property
+    def human(self):
+        return self.format == 'human'
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self.buffersize:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer = []
+            self._size = 0
+        self.stream.flush()
+
+    def line(self, text='', color=None, attrs=None):
+        """Write a line of human readable output."""
+        if not self.human:
+            return
+        if self.color and (color or attrs):
+            text = colored(text, color, attrs=attrs or [])
+        self.write(text + '\n')
+
+    def fill(self, text, indent='', subsequent_indent=None, color=None, attrs=None):
+        """Write a paragraph of human readable output, wrapped to fit."""
+        if not self.human:
+            return
+        if subsequent_indent is None:
+            subsequent_indent = indent
+        self.line(textwrap.fill(text, initial_indent=indent,
+                                subsequent_indent=subsequent_indent), color, attrs)
+
+    def diff(self, diff, indent=''):
+        """Write out an issuediff in human readable form."""
+        if not diff:
+            return
+        for field, value in diff[0].iteritems():
+            self.line('%sAdded: %s - %s' % (indent, field.upper(), value))
+        for field in diff[1]:
+            self.line('%sRemoved: %s' % (indent, field.upper()))
+        for field, values in diff[2].iteritems():
+            self.line('%sChanged: %s - %s' % (indent, field.upper(), values[1]))
+
+    def record(self, record):
+        """Write a record of machine readable output."""
+        if self.format == 'json':
+            self.write((self._records and ',\n' or '[') + json.dumps(record, default=str))
+        elif self.format == 'jsonl':
+            self.write(json.dumps(record, default=str) + '\n')
+        elif self.format == 'yaml':
+            self.write(yaml.safe_dump(record, default_flow_style=False, explicit_start=True))
+        self._records += 1
+
+    def error(self, text):
+        """Report an error, on stderr when stdout is meant for a program."""
+        if self.human:
+            self.line(text)
+        else:
+            sys.stderr.write(text + '\n')
+
+    def close(self):
+        if self.format == 'json':
+            self.write(self._records and ']\n' or '[]\n')
+        self.flush()
+
+def _fail(output, text):
+    output.error(text)
+    sys.exit(1)
+
+def guess_issue_id(issuedb, output):
+    if not output.human:
+        # We can't ask anything when a program is reading our output.
+        _fail(output, 'No issue id given.')
 
-def guess_issue_id(issuedb):
     related = issuedb.related(detail=True)
 
+    if not related:
+        _fail(output, 'No linked issues found, please specify one.')
+
     if len(related) > 1:
-        print colored('Too many linked issues found, please specify one.', None, attrs=['reverse'])
+        output.line('Too many linked issues found, please specify one.', attrs=['reverse'])
         for issueid in related:
-            print colored(textwrap.fill('Issue: %s' % issueid,
-                initial_indent='    ', subsequent_indent='    '), None, attrs=[])
-            print colored(textwrap.fill(related[issueid].get('title', '').upper(),
-                initial_indent='    ', subsequent_indent='    '), None, attrs=[])
-
-        import sys
+            output.fill('Issue: %s' % issueid, indent='    ')
+            output.fill(related[issueid].get('title', '').upper(), indent='    ')
         sys.exit(1)
 
     issueid = related.keys()[0]
     # Prompt user?
-    print "Found only one issue."
-    print colored(textwrap.fill('Issue: %s' % issueid,
-        initial_indent='    ', subsequent_indent='    '), None, attrs=[])
-    print colored(textwrap.fill(related[issueid].get('title', '').upper(),
-        initial_indent='    ', subsequent_indent='    '), None, attrs=[])
+    output.line("Found only one issue.")
+    output.fill('Issue: %s' % issueid, indent='    ')
+    output.fill(related[issueid].get('title', '').upper(), indent='    ')
+    output.flush()
     verification = raw_input("Do you want to use this issue? (Y/[N]) ")
     if verification.lower() in ['y', 'yes', 'yeah', 'oui', 'uh-huh', 'sure', 'why not?', 'meh']:
         return issueid
 
-    print 'Aborting'
-    import sys
-    sys.exit(1)
+    _fail(output, 'Aborting')
+
+def _issue_id(issuedb, args):
+    """Return the full issue id requested, or guess one if none was given."""
+    if not args.id:
+        return guess_issue_id(issuedb, args.output)
+    try:
+        return issuedb.resolve(args.id)
+    except AmbiguousIssueId, error:
+        _fail(args.output, str(error))
 
 def unpack_new(issuedb, args):
     # We should be able to avoid this somehow by using an object dictionary.
@@ -59,132 +165,353 @@ def unpack_new(issuedb, args):
             issue[field] = skeleton_new[field]
 
     newid = issuedb.new(issue=issue)
-    print 'Added new issue: %s' % newid
+    args.output.line('Added new issue: %s' % newid)
+    args.output.record({'id': newid})
 
 def unpack_list(issuedb, args):
-    issues = issuedb.issues(status=args.status)
+    output = args.output
+    if args.watch:
+        _watch_list(issuedb, args)
+        return
+    try:
+        issues = issuedb.issues(status=args.status, at=args.at, sort=args.sort,
+                                limit=args.limit, offset=args.offset)
+    except Abort, error:
+        _fail(output, str(error))
+    prefixes = args.short and issuedb.shortest_prefixes() or {}
     for id, issue in issues.iteritems():
-        # Try to use color for clearer output
-        color = None
-        if 'high' in issue.get('priority',''):
-            color = 'red'
-        elif 'normal' in issue.get('priority',''):
-            pass
-        elif 'low' in issue.get('priority',''):
-            color = 'blue'
-        else:
-            color = 'red'
-
-        # We'll use status indicators on indent for estimate
-        if 'long' in issue.get('estimate', {}).get('scale').lower():
-            indent = '>>>>'
-        elif 'medium' in issue.get('estimate', {}).get('scale').lower():
-            indent = '> > '
-        elif 'short' in issue.get('estimate', {}).get('scale').lower():
-            indent = '>   '
-        else:
-            indent = '===='
+        if not output.human:
+            if args.short:
+                issue = dict(issue, short=prefixes.get(id, id))
+            output.record(dict(issue, id=id))
+            continue
+        _print_issue(output, id, issue, prefixes)
+
+def _watch_list(issuedb, args):
+    """\
+    Show the list again whenever it changes, until interrupted.  Programs get
+    one record per change, holding the whole list.
+    """
+    output = args.output
+    if args.at is not None:
+        _fail(output, 'Only the current issues can be watched')
+    try:
+        for issues in issuedb.watch(status=args.status, sort=args.sort,
+                                    limit=args.limit, offset=args.offset):
+            prefixes = args.short and issuedb.shortest_prefixes() or {}
+            if not output.human:
+                records = []
+                for id, issue in issues.iteritems():
+                    if args.short:
+                        issue = dict(issue, short=prefixes.get(id, id))
+                    records.append(dict(issue, id=id))
+                output.record({'issues': records})
+            else:
+                if output.color:
+                    # Clear the screen and start again from the top.
+                    output.write('\x1b[H\x1b[2J')
+                output.line('%d %s issues at %s' % (len(issues), args.status,
+                                                    strftime('%H:%M:%S')), attrs=['bold'])
+                for id, issue in issues.iteritems():
+                    _print_issue(output, id, issue, prefixes)
+            output.flush()
+    except KeyboardInterrupt:
+        pass
+
+def _print_issue(output, id, issue, prefixes):
+    """Write an issue in the human readable list format."""
+    # Try to use color for clearer output
+    color = None
+    if 'high' in issue.get('priority',''):
+        color = 'red'
+    elif 'normal' in issue.get('priority',''):
+        pass
+    elif 'low' in issue.get('priority',''):
+        color = 'blue'
+    else:
+        color = 'red'
+
+    # We'll use status indicators on indent for estimate
+    if 'long' in issue.get('estimate', {}).get('scale').lower():
+        indent = '>>>>'
+    elif 'medium' in issue.get('estimate', {}).get('scale').lower():
+        indent = '> > '
+    elif 'short' in issue.get('estimate', {}).get('scale').lower():
+        indent = '>   '
+    else:
+        indent = '===='
 
-        print colored('Issue: %s' % id, color, attrs=['reverse'])
-        print colored(textwrap.fill(issue.get('title', '').upper(),
-            initial_indent=indent, subsequent_indent=indent), color, attrs=[])
-        # print colored(textwrap.fill(issue.get('description',''),
-        #     initial_indent=indent, subsequent_indent=indent), color)
-        print colored(textwrap.fill(issue.get('estimate',{}).get('text',''),
-            initial_indent=indent, subsequent_indent=indent), color)
+    output.line('Issue: %s' % prefixes.get(id, id), color, attrs=['reverse'])
+    output.fill(issue.get('title', '').upper(), indent=indent, color=color)
+    # output.fill(issue.get('description',''), indent=indent, color=color)
+    output.fill(issue.get('estimate',{}).get('text',''), indent=indent, color=color)
 
 def unpack_edit(issuedb, args):
-    if not args.id:
-        args.id = guess_issue_id(issuedb)
     skeleton = issuedb.skeleton
+    if args.where:
+        changes = dict(args.set or [])
+        for field in skeleton:
+            if getattr(args, field, None):
+                changes[field] = getattr(args, field)
+        if not changes:
+            _fail(args.output, 'Nothing to change, use --set or a field option')
+        _update_where(issuedb, args, dict(args.where), changes)
+        return
+
+    args.id = _issue_id(issuedb, args)
     issue = issuedb.issue(id=args.id, detail=False)[0]['data']
+    issue.update(args.set or [])
     newissue = {}
     for field in skeleton:
         newissue[field] = getattr(args, field, None) or issue.get(field, skeleton[field])
-    issuedb.edit(id=args.id, issue=newissue)
+    saved = issuedb.edit(id=args.id, issue=newissue)
+    args.output.record({'id': args.id, 'saved': bool(saved)})
+
+def _update_where(issuedb, args, predicate, changes):
+    """Apply the changes to every issue matching the predicate, and report them."""
+    ids = issuedb.update_where(predicate, changes, dryrun=args.dry_run)
+    if ids is False:
+        _fail(args.output, 'Unable to save the changes')
+    args.output.record({'ids': ids, 'dry_run': args.dry_run})
+    for id in ids:
+        args.output.line(id)
+    args.output.line('%s %d issues' % (args.dry_run and 'Would change' or 'Changed', len(ids)))
 
 def unpack_show(issuedb, args):
-    if not args.id:
-        args.id = guess_issue_id(issuedb)
+    output = args.output
+    args.id = _issue_id(issuedb, args)
 
     issuedata = issuedb.issue(id=args.id, detail=args.detail)
     if not issuedata or not issuedata[0].get('data'):
-        print 'No such issue found'
+        _fail(output, 'No such issue found')
+    if not output.human:
+        output.record({'id': args.id, 'data': issuedata[0]['data'],
+                       'diff': issuedata[0].get('diff'), 'history': issuedata[1:]})
         return
+
     issue = issuedata[0]['data']
-    print '\nIssue: %s' % args.id
+    output.line('\nIssue: %s' % args.id)
     if 'title' in issue:
-        print textwrap.fill(issue.get('title', '').upper(), initial_indent='', subsequent_indent='')
+        output.fill(issue.get('title', '').upper())
     if 'description' in issue:
-        print textwrap.fill(issue['description'], initial_indent='', subsequent_indent='')
-    print ''
+        output.fill(issue['description'])
+    output.line()
 
     for field in sorted(issue.keys()):
         if field in ['title', 'description']:
             continue
-        print textwrap.fill('%s: %s' % (field.upper(), issue[field]), initial_indent='', subsequent_indent='  ')
-
-    if issue.get('diff'):
-        for changeset in issue['diff'][0].iteritems():
-            print 'Added: %s - %s' % (changeset[0].upper(), changeset[1])
-        for changeset in issue['diff'][1].iteritems():
-            print 'Removed: %s' % changeset[0].upper()
-        for changeset in issue['diff'][2].iteritems():
-            print 'Changed: %s - %s' % (changeset[0].upper(), changeset[1][1])
-    else:
-        # No uncommitted changes
-        pass
+        output.fill('%s: %s' % (field.upper(), issue[field]), subsequent_indent='  ')
+
+    # Any uncommitted changes
+    output.diff(issuedata[0].get('diff'))
 
     for version in issuedata[1:]:
-        print '\nChangeset: %s' % version['node']
-        print 'Committed by: %s on %s' % (version['user'], version['date'])
-        print 'Linked files:'
+        output.line('\nChangeset: %s' % version['node'])
+        output.line('Committed by: %s on %s' % (version['user'], version['date']))
+        output.line('Linked files:')
         for filename in version['files']:
-            print '    %s' % filename
-        if version.get('diff'):
-            for changeset in version['diff'][0].iteritems():
-                print 'Added: %s - %s' % (changeset[0].upper(), changeset[1])
-            for changeset in version['diff'][1].iteritems():
-                print 'Removed: %s' % changeset[0].upper()
-            for changeset in version['diff'][2].iteritems():
-                print 'Changed: %s - %s' % (changeset[0].upper(), changeset[1][1])
+            output.line('    %s' % filename)
+        output.diff(version.get('diff'))
+
 
+def unpack_log(issuedb, args):
+    output = args.output
+    try:
+        events = issuedb.timeline(since=args.since, until=args.until, limit=args.limit)
+        for event in events:
+            if not output.human:
+                output.record(event)
+                continue
+            output.line('\nChangeset: %s' % event['node'])
+            output.line('Issue: %s' % event['id'])
+            output.fill(event['data'].get('title', '').upper())
+            output.line('Committed by: %s on %s' % (event['user'], event['date']))
+            output.diff(event['diff'])
+    except Abort, error:
+        _fail(output, str(error))
 
 def unpack_related(issuedb, args):
+    output = args.output
     relatedissues = issuedb.related(filenames=args.files, detail=True)
 
     for issueid, issue in relatedissues.iteritems():
-        print colored(textwrap.fill('Issue: %s' % issueid,
-            initial_indent='    ', subsequent_indent='    '), None, attrs=[])
-        print colored(textwrap.fill(issue.get('title', '').upper(),
-            initial_indent='    ', subsequent_indent='    '), None, attrs=[])
+        output.record(dict(issue, id=issueid))
+        output.fill('Issue: %s' % issueid, indent='    ')
+        output.fill(issue.get('title', '').upper(), indent='    ')
 
 def unpack_dbinit(issuedb, args):
     try:
         issuedb = IssueDB(args.repository, dbinit=True)
     except NoRepository:
         # This means that there was no repository here.
-        print 'Unable to find a repository.'
-        import sys
-        sys.exit(1)
+        _fail(args.output, 'Unable to find a repository.')
     except NoIssueDB:
         # Whoops
-        print 'Error initializing issued database'
-        import sys
-        sys.exit(1)
-    print 'Initialized issue database'
+        _fail(args.output, 'Error initializing issued database')
+    args.output.line('Initialized issue database')
+    args.output.record({'root': issuedb.root, 'initialized': True})
 
 def unpack_close(issuedb, args):
-    if not args.id:
-        args.id = guess_issue_id(issuedb)
-    issuedb.close(args.id, args.comment)
+    if args.where:
+        changes = {'status': 'closed'}
+        if args.comment is not None:
+            changes['comment'] = args.comment
+        _update_where(issuedb, args, dict(args.where), changes)
+        return
+
+    args.id = _issue_id(issuedb, args)
+    saved = issuedb.close(args.id, args.comment)
+    args.output.record({'id': args.id, 'saved': bool(saved)})
+
+def _print_index_report(output, report):
+    output.record(report)
+    for issueid in report['missing']:
+        output.line('Missing from index: %s' % issueid)
+    for issueid in report['orphaned']:
+        output.line('No issue file for index entry: %s' % issueid)
+    for issueid in sorted(report['stale']):
+        output.line('Stale index entry: %s' % issueid)
+        output.diff(report['stale'][issueid], indent='    ')
+    for issueid in sorted(report['unreadable']):
+        output.line('Unreadable issue file: %s (%s)' % (issueid, report['unreadable'][issueid]))
+
+def _report_clean(report):
+    return not (report['missing'] or report['orphaned'] or report['stale']
+                or report['unreadable'])
+
+def unpack_reindex(issuedb, args):
+    report = issuedb.reindex(processes=args.jobs)
+    _print_index_report(args.output, report)
+    args.output.line('Rebuilt index')
+
+def unpack_fsck(issuedb, args):
+    report = issuedb.fsck(processes=args.jobs)
+    if _report_clean(report):
+        args.output.record(report)
+        args.output.line('Index is consistent with the issue files')
+        return
+    _print_index_report(args.output, report)
+    sys.exit(1)
+
+def unpack_stats(issuedb, args):
+    by = args.by or ['group']
+    rows = issuedb.stats(by=by, status=args.status)
+    if not args.output.human:
+        for row in rows:
+            args.output.record(row)
+        return
+
+    columns = [field.upper() for field in by] + ['COUNT', 'HOURS']
+    table = [columns]
+    for row in rows:
+        table.append([str(row[field]) for field in by] + [str(row['count']), str(row['hours'])])
+    table.append(['TOTAL'] + [''] * (len(by) - 1) +
+                 [str(sum(row['count'] for row in rows)),
+                  str(sum(row['minutes'] for row in rows) // 60)])
+    widths = [max(len(line[column]) for line in table) for column in range(len(columns))]
+    for number, line in enumerate(table):
+        text = '  '.join(value.ljust(width) for value, width in zip(line, widths))
+        bold = number in (0, len(table) - 1) and ['bold'] or None
+        args.output.line(text.rstrip(), attrs=bold)
+
+def unpack_migrate(issuedb, args):
+    add = dict(args.add or [])
+    transform = {}
+    for field, old, new in args.replace or []:
+        transform.setdefault(field, {})[old] = new
+    skeleton = issuedb.skeleton or {}
+    index = dict((field, add.get(field, skeleton.get(field, ''))) for field in args.index or [])
+    if not (add or args.rename or args.drop or transform or index):
+        _fail(args.output, 'Nothing to migrate')
+
+    report = issuedb.migrate(add=add, rename=dict(args.rename or []), drop=args.drop,
+                             transform=transform, index=index,
+                             processes=args.jobs, dryrun=args.dry_run)
+    args.output.record(dict(report, dry_run=args.dry_run))
+    for id in report['migrated']:
+        args.output.line(id)
+    for id in sorted(report['unreadable']):
+        args.output.line('Unreadable issue file: %s (%s)' % (id, report['unreadable'][id]))
+    args.output.line('%s %d issues' % (args.dry_run and 'Would migrate' or 'Migrated',
+                                       len(report['migrated'])))
+
+def unpack_archive(issuedb, args):
+    ids = issuedb.archive(days=args.days, dryrun=args.dry_run)
+    args.output.record({'archived': ids, 'dry_run': args.dry_run})
+    for id in ids:
+        args.output.line(id)
+    args.output.line('%s %d closed issues' % (args.dry_run and 'Would archive' or 'Archived', len(ids)))
+
+def unpack_serve(issuedb, args):
+    from yamltrak.wsgi import serve
+    args.output.line('Serving %s on http://%s:%d/' % (issuedb.root, args.host, args.port))
+    args.output.flush()
+    serve([issuedb.root], host=args.host, port=args.port, rev=args.rev)
 
 def unpack_purge(issuedb, args):
-    pass
+    if not args.ids and not args.where:
+        _fail(args.output, 'Give the issue ids to purge, or --where')
+    try:
+        ids = issuedb.purge(args.ids, where=args.where and dict(args.where), dryrun=args.dry_run)
+    except AmbiguousIssueId, error:
+        _fail(args.output, str(error))
+    if ids is False:
+        _fail(args.output, 'Unable to update the index')
+    args.output.record({'purged': ids, 'dry_run': args.dry_run})
+    for id in ids:
+        args.output.line(id)
+    args.output.line('%s %d issues' % (args.dry_run and 'Would purge' or 'Purged', len(ids)))
 
 def unpack_burndown(issuedb, args):
     pass
 
+def _run(func, issuedb, args):
+    """Run the command, making sure that all of its output is written."""
+    args.output = Output(args.format)
+    try:
+        func(issuedb, args)
+    finally:
+        args.output.close()
+
+def _add_options(parser, command, issuedb):
+    """\
+    Add the options of the given command, starting with those for the
+    skeleton fields.
+    """
+    if command in options.FIELD_COMMANDS:
+        skeleton = issuedb.skeleton
+        skeleton_new = issuedb.skeleton_new
+        for flags, field, required in options.field_options(command, skeleton, skeleton_new):
+            parser.add_argument(required=required,
+                                help=skeleton.get(field, skeleton_new.get(field)), *flags)
+    for flags, kwargs, complete in options.options(command):
+        parser.add_argument(*flags, **kwargs)
+
+# The function running each subcommand, whose options are in options.COMMANDS.
+RUNNERS = {
+    'new': unpack_new,
+    'edit': unpack_edit,
+    'list': unpack_list,
+    'show': unpack_show,
+    'related': unpack_related,
+    'log': unpack_log,
+    'stats': unpack_stats,
+    'dbinit': unpack_dbinit,
+    'close': unpack_close,
+    'purge': unpack_purge,
+    'migrate': unpack_migrate,
+    'archive': unpack_archive,
+    'reindex': unpack_reindex,
+    'fsck': unpack_fsck,
+    'serve': unpack_serve}
+
+def _command_name(argv):
+    """The subcommand is the first argument that isn't an option."""
+    for arg in argv:
+        if not arg.startswith('-'):
+            return arg
+    return None
+
 def main():
     """Parse the command line options and react to them."""
     try:
@@ -192,25 +519,24 @@ def main():
     except NoRepository:
         # This means that there was no repository here.
         print 'Unable to find a repository.'
-        import sys
         sys.exit(1)
     except NoIssueDB:
         # This means no issue database was found.  We give the option to
         # initialize one.
-        parser = ArgumentParser(prog='yt', description='YAMLTrak is a distributed version controlled issue tracker.')
-        subparsers = parser.add_subparsers(help=None, dest='command')
-        parser_dbinit = subparsers.add_parser('dbinit',
-            help="Initialize the issue database.")
-        parser_dbinit.set_defaults(func=unpack_dbinit)
-        args = parser.parse_args()
+        issuedb = None
+
+    parser = build_parser(issuedb, _command_name(sys.argv[1:]))
+    args = parser.parse_args()
+    if issuedb is None:
         # We don't have a valid database, so we call with none.
         args.repository = os.getcwd()
-        args.func(None, args)
-        return
-
-    skeleton = issuedb.skeleton
-    skeleton_new = issuedb.skeleton_new
+    _run(args.func, issuedb, args)
 
+def build_parser(issuedb, command):
+    """\
+    Return the command line parser, with the options of the given command
+    set up.  Without a database, only dbinit is available.
+    """
     parser = ArgumentParser(prog='yt', description='YAMLTrak is a distributed version controlled issue tracker.')
     # parser.add_argument('-r', '--repository',
     #     help='Use this directory as the repository instead of the current '
@@ -219,72 +545,18 @@ def main():
     #     help='Look for issues in this folder, instead of the "issues" folder.')
 
     subparsers = parser.add_subparsers(help=None, dest='command')
-
-    # Adding a new issue
-    parser_new = subparsers.add_parser('new', help="Add a new issue.")
-    parser_new.set_defaults(func=unpack_new)
-    for field, help in skeleton.iteritems():
-        if field not in skeleton_new:
-            parser_new.add_argument('-' + field[0], '--' + field, help=help)
-    for field, help in skeleton_new.iteritems():
-        parser_new.add_argument('-' + field[0], '--' + field, required=True, help=skeleton[field])
-
-    # Editing an issue
-    parser_edit = subparsers.add_parser('edit', help="Edit an issue.")
-    parser_edit.set_defaults(func=unpack_edit)
-    for field, help in skeleton.iteritems():
-        parser_edit.add_argument('-' + field[0], '--' + field, help=help)
-    parser_edit.add_argument('id', nargs='?', help='The issue id to edit.')
-
-    # List all issues
-    parser_list = subparsers.add_parser('list', help="List all issues.")
-    parser_list.set_defaults(func=unpack_list)
-    parser_list.add_argument('-s', '--status', default='open',
-        help='List all issues with this stats.  Defaults to open issues.')
-
-    # Show an issue
-    parser_show = subparsers.add_parser('show', help="Show the details for an "
-                                        "issue.")
-    parser_show.set_defaults(func=unpack_show)
-    parser_show.add_argument('-d', '--detail', default=False, action='store_true',
-        help='Show a detailed view of the issue')
-    parser_show.add_argument('id', nargs='?',
-        help='The issue id to show the details for.')
-
-    # Get issues related to a file
-    parser_related = subparsers.add_parser('related', help="List the issues "
-                                           "related to given files.")
-    parser_related.set_defaults(func=unpack_related)
-    parser_related.add_argument( 'files', metavar='file', type=str, nargs='*',
-        default=[],
-        help='List the open issues related to these files.  If no files are '
-        'supplied, and the list of currently uncommitted files (excluding '
-        'issues) will be checked.')
-
-    # Initialize DB
-    parser_dbinit = subparsers.add_parser('dbinit',
-        help="Initialize the issue database.")
-    parser_dbinit.set_defaults(func=unpack_dbinit)
-
-    # Close an issue
-    parser_close = subparsers.add_parser('close', help="Close an issue.")
-    parser_close.add_argument('-c', '--comment', default=None,
-        help='An optional closing comment to set on the ticket.')
-    parser_close.set_defaults(func=unpack_close)
-    parser_close.add_argument('id', nargs='?',
-        help='The issue id to close.')
-
-    # Purge an issue
-    # parser_purge = subparsers.add_parser('purge', help="Purge an issue.")
-    # parser_purge.set_defaults(func=unpack_purge)
-
-    # ASCII Burndown chart.
-    # parser_burn = subparsers.add_parser('burn', help="Show a burndown chart "
-    #                                     "for a group of issues.")
-    # parser_burn.set_defaults(func=unpack_burndown)
-    args = parser.parse_args()
-    args.func(issuedb, args)
-
+    for name, help, declared in options.COMMANDS:
+        if issuedb is None and name != 'dbinit':
+            # Without a valid database, initializing one is all we can do.
+            continue
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.set_defaults(func=RUNNERS[name])
+        # Only the options of the command being run are ever added, so we
+        # don't pay for building the rest, and the skeletons are only read by
+        # the commands that use them.
+        if name == command:
+            _add_options(subparser, name, issuedb)
+    return parser
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,233 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# Shell completion for yt.  Completion runs on every tab press, so this module
+# only uses the standard library, and never imports mercurial (or the yamltrak
+# package, which does).  Everything it needs from the issue database is kept
+# in a marshalled cache under .hg, rebuilt only when the index or the
+# skeletons change.  To use it from bash:
+#
+#   complete -o default -C yt yt
+#
+# When YT_COMPLETE_DESCRIPTIONS is set, issue ids are printed as id:title,
+# ready for zsh's _describe.
+from __future__ import with_statement
+import imp
+import marshal
+import os
+import re
+import shlex
+import sys
+from os import path
+if __name__ == 'yamltrak.completion':
+    from yamltrak import options
+else:
+    # The yt script loads us on its own, so options has to be loaded the same
+    # way, without the package.
+    _found = imp.find_module('options', [path.dirname(path.abspath(__file__))])
+    try:
+        options = imp.load_module('yamltrak_options', *_found)
+    finally:
+        _found[0].close()
+
+CACHE_VERSION = 2
+# Characters that need no escaping on a shell command line.
+SAFE = re.compile(r'^[\w@%+=:,./-]*$')
+
+
+def find_root(folder):
+    """Return the root of the repository containing folder, or None."""
+    while True:
+        if path.isdir(path.join(folder, '.hg')):
+            return folder
+        parent = path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+
+
+def _identity(filename):
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return None
+    return (info.st_size, info.st_mtime, info.st_ctime, info.st_ino)
+
+
+def load(root, dbfolder='issues'):
+    """\
+    Return the completion data for the issue database in the given
+    repository: the issue 'ids' with their titles, the fields of the
+    'skeleton' and of the 'skeleton_new', and the 'values' seen in the index
+    for each field in options.VALUE_FIELDS.  The data comes from the cache
+    when it is still current.
+    """
+    folder = path.join(root, dbfolder)
+    skeleton_new = path.join(folder, 'skeleton_new')
+    if not path.exists(skeleton_new):
+        skeleton_new = path.join(folder, 'newticket')
+    sources = [path.join(folder, 'issues.yaml'), path.join(folder, 'skeleton'), skeleton_new]
+    key = [CACHE_VERSION] + [_identity(filename) for filename in sources]
+    cachefile = path.join(root, '.hg', 'yamltrak-completion')
+
+    try:
+        with open(cachefile, 'rb') as cache:
+            data = marshal.load(cache)
+        if data['key'] == key:
+            return data
+    except (IOError, EOFError, ValueError, TypeError, KeyError):
+        pass
+
+    # The cache is stale, so we have no choice but to parse.
+    import yaml
+    documents = []
+    for filename in sources:
+        try:
+            with open(filename) as source:
+                documents.append(yaml.safe_load(source.read()) or {})
+        except (IOError, yaml.YAMLError):
+            documents.append({})
+    index, skeleton, skeleton_new = documents
+
+    values = dict((field, set()) for field in options.VALUE_FIELDS)
+    ids = []
+    for id, issue in index.iteritems():
+        if id == 'skeleton' or not isinstance(issue, dict):
+            continue
+        ids.append((str(id), str(issue.get('title') or '')))
+        for field in values:
+            if issue.get(field):
+                values[field].add(str(issue[field]))
+
+    data = {'key': key,
+            'ids': sorted(ids),
+            'skeleton': sorted(skeleton),
+            'skeleton_new': sorted(skeleton_new),
+            'values': dict((field, sorted(seen)) for field, seen in values.iteritems())}
+    try:
+        tmpname = '%s.%d' % (cachefile, os.getpid())
+        with open(tmpname, 'wb') as cache:
+            marshal.dump(data, cache)
+        os.rename(tmpname, cachefile)
+    except (IOError, OSError):
+        # Not being able to cache only costs us speed.
+        pass
+    return data
+
+
+def quote(word):
+    """Escape the word for the shell, which inserts completions as they are."""
+    if SAFE.match(word):
+        return word
+    return re.sub(r'([^\w@%+=:,./-])', r'\\\1', word)
+
+
+def _words(line):
+    """\
+    Split the command line into words the way the shell would, the last one
+    being the word being completed, which is empty after a space.
+    """
+    # The marker ends up on the word being completed, even when that word is
+    # still empty or inside an unfinished quote.
+    for ending in ('', '"', "'"):
+        try:
+            words = shlex.split(line + '\0' + ending)
+            break
+        except ValueError:
+            continue
+    else:
+        words = line.split() + ['\0']
+    words[-1] = words[-1][:-1]
+    return words
+
+
+def _value_options(command, data):
+    """\
+    Return a dictionary mapping each flag of the command that takes a value to
+    the list of values to offer for it, which is empty when we don't know.
+    Without the completion data, only choices are known.
+    """
+    table = {}
+    for flags, kwargs, complete in options.options(command):
+        if not flags[0].startswith('-') or kwargs.get('action') in ('store_true', 'store_false'):
+            continue
+        if kwargs.get('choices'):
+            offered = kwargs['choices']
+        elif complete == 'id' and data is not None:
+            offered = [id for id, title in data['ids']]
+        elif complete in options.VALUE_FIELDS and data is not None:
+            offered = data['values'].get(complete, [])
+        else:
+            offered = []
+        for flag in flags:
+            table[flag] = offered
+    if data is not None:
+        for flags, field, required in options.field_options(command, data['skeleton'], data['skeleton_new']):
+            for flag in flags:
+                table[flag] = data['values'].get(field, [])
+    return table
+
+
+def complete(line, root=None, descriptions=False):
+    """\
+    Return the completions for the given command line, which ends at the
+    cursor, escaped for the shell.
+    """
+    words = _words(line)
+    current = words[-1]
+    previous = len(words) > 2 and words[-2] or ''
+
+    names = [name for name, help, declared in options.COMMANDS]
+    if len(words) <= 2:
+        return [name for name in names if name.startswith(current)]
+    command = words[1]
+    if command not in names:
+        return []
+
+    data = root is not None and load(root) or None
+    table = _value_options(command, data)
+    if previous in table:
+        return [quote(value) for value in table[previous] if value.startswith(current)]
+    if root is None:
+        return []
+
+    declared = options.options(command)
+    if current.startswith('-'):
+        # Only the long flags, there's no sense offering both.
+        offered = set(flag for flag in table if flag.startswith('--'))
+        offered.update(flag for flags, kwargs, complete in declared
+                       for flag in flags if flag.startswith('--'))
+        return [flag for flag in sorted(offered) + ['--help'] if flag.startswith(current)]
+
+    if any(complete == 'id' for flags, kwargs, complete in declared):
+        matches = [(id, title) for id, title in data['ids'] if id.startswith(current)]
+        if descriptions:
+            return ['%s:%s' % (id, title.replace(':', '\\:')) for id, title in matches]
+        return [id for id, title in matches]
+
+    return []
+
+
+def main():
+    """Print the completions for the command line bash hands us."""
+    line = os.environ.get('COMP_LINE', '')
+    point = os.environ.get('COMP_POINT')
+    if point and point.isdigit():
+        line = line[:int(point)]
+    root = find_root(os.getcwd())
+    descriptions = bool(os.environ.get('YT_COMPLETE_DESCRIPTIONS'))
+    sys.stdout.write(''.join(match + '\n' for match in complete(line, root, descriptions)))
@@ -0,0 +1,198 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# The yt subcommands and their options, declared once for both the command
+# line parser in commands.py and the shell completion in completion.py.  Like
+# completion, this module only uses the standard library, so that it can be
+# loaded without mercurial.
+#
+# Each option is a tuple of its flags, the keyword arguments for argparse's
+# add_argument, and what completes its value: the name of an index field whose
+# values are offered, 'id' for issue ids, or None.  Options with choices
+# complete to those.
+
+FORMATS = ['human', 'json', 'jsonl', 'yaml']
+# Index fields with few enough distinct values to offer them for completion.
+VALUE_FIELDS = ['status', 'group', 'priority']
+# Commands taking an option for each skeleton field.
+FIELD_COMMANDS = ['new', 'edit']
+
+
+def option(*flags, **kwargs):
+    """Declare an option, taking what completes it as the complete keyword."""
+    complete = kwargs.pop('complete', None)
+    return flags, kwargs, complete
+
+
+def _assignment(text):
+    """Split a FIELD=VALUE option into its field and value."""
+    if '=' not in text:
+        raise ValueError(text)
+    return tuple(text.split('=', 1))
+
+
+def _where(*dryrun_flags):
+    return [
+        option('--where', action='append', type=_assignment, default=None,
+            metavar='FIELD=VALUE',
+            help='Act on every issue in the index with this field value, rather '
+            'than on a single issue.  Can be given more than once, and all of '
+            'them must match.'),
+        option(default=False, action='store_true', dest='dry_run',
+            help='With --where, only list the issues that would change.', *dryrun_flags)]
+
+
+JOBS = option('-j', '--jobs', type=int, default=None,
+    help='The number of processes used to parse issues.  Defaults to the '
+    'number of CPUs.')
+
+# The subcommands, in the order they're listed in the help, with their help
+# and options.  The --format option is added to all of them.
+COMMANDS = [
+    ('new', "Add a new issue.", []),
+    ('edit', "Edit an issue.", [
+        option('--set', action='append', type=_assignment, default=None,
+            metavar='FIELD=VALUE',
+            help='Set this field to the value.  Can be given more than once.'),
+        # The field options take the short letters.
+        ] + _where('--dry-run') + [
+        option('id', nargs='?', help='The issue id to edit.', complete='id')]),
+    ('list', "List all issues.", [
+        option('-s', '--status', default='open',
+            help='List all issues with this stats.  Defaults to open issues.',
+            complete='status'),
+        option('-a', '--at', default=None,
+            help='List the issues as they were at this revision or date.'),
+        option('--short', default=False, action='store_true',
+            help='Show the shortest unique prefix of each issue id.'),
+        option('--sort', default=None, type=lambda keys: keys.split(','),
+            help='Sort by these comma separated fields, each prefixed with - for '
+            'descending order.  Priority sorts by rank and estimate by length, '
+            'so priority,estimate lists the most urgent, quickest issues first.'),
+        option('-l', '--limit', type=int, default=None,
+            help='Show at most this many issues.'),
+        option('--offset', type=int, default=0,
+            help='Skip this many issues before showing any.'),
+        option('-w', '--watch', default=False, action='store_true',
+            help='Keep showing the list, updated whenever it changes.')]),
+    ('show', "Show the details for an issue.", [
+        option('-d', '--detail', default=False, action='store_true',
+            help='Show a detailed view of the issue'),
+        option('id', nargs='?', help='The issue id to show the details for.',
+            complete='id')]),
+    ('related', "List the issues related to given files.", [
+        option('files', metavar='file', type=str, nargs='*', default=[],
+            help='List the open issues related to these files.  If no files are '
+            'supplied, and the list of currently uncommitted files (excluding '
+            'issues) will be checked.')]),
+    ('log', "Show the history of all issues, newest first.", [
+        option('-l', '--limit', type=int, default=20,
+            help='Show at most this many changes.  Defaults to 20.'),
+        option('--since', default=None,
+            help='Only show changes committed on or after this date.'),
+        option('--until', default=None,
+            help='Only show changes committed on or before this date.')]),
+    ('stats', "Count issues and sum their estimates by field.", [
+        option('-b', '--by', action='append', default=None,
+            help='Group the totals by this index field.  Can be given more than '
+            'once.  Defaults to the group.'),
+        option('-s', '--status', default='open',
+            help='Only count issues with this status.  Defaults to open issues.',
+            complete='status')]),
+    ('dbinit', "Initialize the issue database.", []),
+    ('close', "Close an issue.", [
+        option('-c', '--comment', default=None,
+            help='An optional closing comment to set on the ticket.'),
+        ] + _where('-n', '--dry-run') + [
+        option('id', nargs='?', help='The issue id to close.', complete='id')]),
+    ('purge', "Remove issues from the database for good.",
+        _where('-n', '--dry-run') + [
+        option('ids', metavar='id', nargs='*', default=[],
+            help='The issue ids to purge.', complete='id')]),
+    ('migrate', "Apply a change of the skeleton to every issue.", [
+        option('-a', '--add', action='append', type=_assignment, default=None,
+            metavar='FIELD=DEFAULT',
+            help='Add this field to the skeleton and to every issue without it.'),
+        option('-r', '--rename', action='append', type=_assignment, default=None,
+            metavar='OLD=NEW', help='Rename this field in the skeletons and every issue.'),
+        option('-d', '--drop', action='append', default=None, metavar='FIELD',
+            help='Drop this field from the skeletons and every issue.'),
+        option('--replace', action='append', nargs=3, default=None, metavar='VALUE',
+            help='Given a field, an old value and a new value, replace the old '
+            'value of the field with the new one in every issue.'),
+        option('-i', '--index', action='append', default=None, metavar='FIELD',
+            help='Add this field to the index.'),
+        option('-n', '--dry-run', default=False, action='store_true',
+            help='Only list the issues that would change.'),
+        JOBS]),
+    ('archive', "Move old closed issues out of the index into the archive.", [
+        option('-d', '--days', type=float, default=None,
+            help='Archive closed issues unchanged for this many days.  Defaults '
+            'to the yamltrak.archivedays setting, or 90.'),
+        option('-n', '--dry-run', default=False, action='store_true',
+            help='Only list the issues that would be archived.')]),
+    ('reindex', "Rebuild the index from the issue files.", [JOBS]),
+    ('fsck', "Report differences between the index and the issue files.", [JOBS]),
+    ('serve', "Serve a read only JSON API for the issue database.", [
+        option('-a', '--host', default='localhost',
+            help='The address to listen on.  Defaults to localhost.'),
+        option('-p', '--port', type=int, default=8080,
+            help='The port to listen on.  Defaults to 8080.'),
+        option('-r', '--rev', default=None,
+            help='Serve the issues as committed at this revision (tip follows new '
+            'commits) instead of the working copy.')]),
+    # ('burn', "Show a burndown chart for a group of issues.", []),
+]
+
+FORMAT = option('--format', choices=FORMATS, default='human',
+    help='Write the output in this format.  Defaults to human readable '
+    'text, while json, jsonl and yaml are meant for other programs.')
+
+
+def options(command):
+    """Return the options of the named command, or None if there's no such command."""
+    for name, help, declared in COMMANDS:
+        if name == command:
+            return declared + [FORMAT]
+    return None
+
+
+def field_options(command, skeleton, skeleton_new):
+    """\
+    Return the flags of the option for each skeleton field taken by the
+    command, as (flags, field, required) tuples.  Fields get a short option
+    from their first letter, unless an earlier field already took it.  Fields
+    are taken in sorted order (those of the new issue skeleton first for the
+    new command), so that the letters don't depend on how the skeletons are
+    stored.
+    """
+    if command == 'new':
+        fields = [(field, True) for field in sorted(skeleton_new)]
+        fields += [(field, False) for field in sorted(skeleton) if field not in skeleton_new]
+    elif command in FIELD_COMMANDS:
+        fields = [(field, False) for field in sorted(skeleton)]
+    else:
+        return []
+    taken = set()
+    flags = []
+    for field, required in fields:
+        fieldflags = ['--' + field]
+        if field[0] not in taken:
+            taken.add(field[0])
+            fieldflags.insert(0, '-' + field[0])
+        flags.append((fieldflags, field, required))
+    return flags
@@ -0,0 +1,149 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# Waiting for files to change.  On Linux we ask the kernel to tell us, through
+# inotify, so that a watcher sleeping in select costs nothing while nothing
+# happens.  Everywhere else, or when inotify can't be set up (out of watches,
+# say), we fall back to comparing stat results every so often.
+import errno
+import os
+import select
+import sys
+from time import time, sleep
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+
+class InotifyWatcher(object):
+    """\
+    Waits for changes to the given folders, and the files directly in them,
+    using Linux inotify.  Raises OSError if inotify isn't available.
+    """
+    def __init__(self, folders):
+        if ctypes is None or not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for folder in folders:
+            if libc.inotify_add_watch(self.fd, folder, WATCH_MASK) < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, 'Unable to watch %s' % folder)
+
+    def wait(self, timeout=None):
+        """\
+        Block until something changes, or timeout seconds pass, and return
+        whether anything changed.
+        """
+        try:
+            readable = select.select([self.fd], [], [], timeout)[0]
+        except select.error, error:
+            if error.args[0] != errno.EINTR:
+                raise
+            return False
+        if not readable:
+            return False
+        # We don't care which files changed, only that something did.
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except OSError, error:
+            if error.errno != errno.EAGAIN:
+                raise
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """\
+    Waits for changes to the given folders, or the given files in them, by
+    comparing their stat results every interval seconds.  Files replaced by
+    renaming, as all of ours are, change the modification time of their
+    folder, so the folders cover them.  Once mercurial is loaded, though,
+    modification times only have whole seconds, so files that must be seen
+    changing within a second have to be given too.  A file replaced by
+    renaming gets a new inode, however quickly it happens.  Files that don't
+    exist yet can be given.
+    """
+    def __init__(self, folders, files=(), interval=1.0):
+        self.paths = list(folders) + list(files)
+        self.interval = interval
+        self._signature = self._stat()
+
+    def _stat(self):
+        signature = []
+        for filename in self.paths:
+            try:
+                info = os.stat(filename)
+                signature.append((info.st_size, info.st_mtime, info.st_ino))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def wait(self, timeout=None):
+        """\
+        Block until something changes, or timeout seconds pass, and return
+        whether anything changed.
+        """
+        deadline = timeout is not None and time() + timeout or None
+        while True:
+            signature = self._stat()
+            if signature != self._signature:
+                self._signature = signature
+                return True
+            if deadline is not None and time() >= deadline:
+                return False
+            pause = self.interval
+            if deadline is not None:
+                pause = max(0, min(pause, deadline - time()))
+            sleep(pause)
+
+    def close(self):
+        pass
+
+
+def watcher(folders, files=(), interval=1.0):
+    """\
+    Return a watcher for the given folders, and the files in them that are
+    written in place, using inotify when possible and polling otherwise.
+    """
+    try:
+        return InotifyWatcher(folders)
+    except OSError:
+        return PollingWatcher(folders, files, interval)
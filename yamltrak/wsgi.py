@@ -0,0 +1,295 @@
+# Copyright 2009 Douglas Mayle
+
+# This file is part of YAMLTrak.
+
+# YAMLTrak is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+
+# YAMLTrak is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with YAMLTrak.  If not, see <http://www.gnu.org/licenses/>.
+
+# A read only JSON API over one or more issue databases.  Each repository is
+# served under its own name, which is the basename of the repository root:
+#
+#   /                                   The list of repositories
+#   /<repository>/issues                Issues, ?status=open&offset=0&limit=100
+#                                       and optionally &at=<revision or date>,
+#                                       &sort=priority,-estimate and
+#                                       &after=<cursor> (see the next link)
+#   /<repository>/issues/<id>           The current data for an issue
+#   /<repository>/issues/<id>/history   The issue along with its history
+#   /<repository>/related               Issues related to ?file=...&file=...
+#   /<repository>/burndown/<group>      Burndown checkpoints for a group
+#   /<repository>/stats                 Issue counts and summed estimates,
+#                                       ?by=group&by=priority&status=open
+#
+# Responses carry a strong ETag derived from the tip node and the index file,
+# so that a client sending If-None-Match gets a 304 without anything being
+# parsed or serialized.
+#
+# Given a revision, the issues are served as committed at that revision
+# straight from the repository store, which works for bare repositories.
+from __future__ import with_statement
+from cStringIO import StringIO
+from gzip import GzipFile
+from hashlib import sha1
+from os import path, stat
+from urllib import quote
+from urlparse import parse_qs
+from collections import OrderedDict
+import threading
+from mercurial.util import Abort
+try:
+    import json
+except ImportError:
+    import simplejson as json
+from yamltrak import IssueDB, NoRepository, NoIssueDB, AmbiguousIssueId, ISSUEID, sort_cursor, _identity
+
+STATUS = {
+    200: '200 OK',
+    304: '304 Not Modified',
+    400: '400 Bad Request',
+    404: '404 Not Found',
+    405: '405 Method Not Allowed'}
+
+
+def _gzip_coding(accept):
+    """\
+    Return the name of the gzip coding ('gzip', or the older 'x-gzip') that
+    the given Accept-Encoding header accepts, or None if it doesn't.  Codings
+    listed with a quality of 0 are refused, and a wildcard covers gzip unless
+    it is listed itself.
+    """
+    qualities = {}
+    for coding in accept.split(','):
+        params = coding.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            key, sep, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    listed = [name for name in ('gzip', 'x-gzip') if name in qualities]
+    if listed:
+        accepted = [name for name in listed if qualities[name] > 0]
+        return accepted and accepted[0] or None
+    if qualities.get('*', 0) > 0:
+        return 'gzip'
+    return None
+
+
+class HTTPError(Exception):
+    """Exception raised to answer a request with an error status."""
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+    def __str__(self):
+        return self.reason
+
+
+class YAMLTrakApp(object):
+    """\
+    A WSGI application serving the issue databases found in the given
+    repositories.  Folders without a repository or an issue database are
+    skipped.  Lists are paginated, returning at most 'pagesize' issues unless
+    the client asks for fewer, and the 'cachesize' most recently used
+    serialized responses are kept around for reuse.  If rev is given, the issues are read from the
+    repository store as of that revision, rather than from the working copy.
+    """
+    def __init__(self, repositories, dbfolder='issues', pagesize=100, cachesize=128, minimum_gzip=512, rev=None):
+        self.issuedbs = {}
+        for repository in repositories:
+            try:
+                issuedb = IssueDB(repository, dbfolder=dbfolder, threadsafe=True, rev=rev)
+            except (NoRepository, NoIssueDB):
+                continue
+            self.issuedbs[path.basename(issuedb.root)] = issuedb
+        self.pagesize = pagesize
+        self.cachesize = cachesize
+        self.minimum_gzip = minimum_gzip
+        self._cache = OrderedDict()
+        self._cachelock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        try:
+            if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+                raise HTTPError(405, 'Only GET and HEAD are supported')
+            status, headers, body = self._respond(environ)
+        except HTTPError, error:
+            status, headers, body = error.status, [], json.dumps({'error': error.reason})
+            headers.append(('Content-Type', 'application/json'))
+            headers.append(('Content-Length', str(len(body))))
+
+        if status == 405:
+            headers.append(('Allow', 'GET, HEAD'))
+        start_response(STATUS[status], headers)
+        if environ['REQUEST_METHOD'] == 'HEAD' or status == 304:
+            return []
+        return [body]
+
+    def _respond(self, environ):
+        """Route the request, and answer it from the cache when possible."""
+        parts = [part for part in environ.get('PATH_INFO', '').split('/') if part]
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        encoding = _gzip_coding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+
+        if not parts:
+            issuedb, state = None, sorted(self.issuedbs)
+        else:
+            issuedb = self.issuedbs.get(parts[0])
+            if issuedb is None:
+                raise HTTPError(404, 'No such repository: %s' % parts[0])
+            state = issuedb.state()
+            if len(parts) > 2 and parts[1] == 'issues':
+                try:
+                    parts[2] = issuedb.resolve(parts[2])
+                except AmbiguousIssueId, error:
+                    raise HTTPError(400, str(error))
+                if not ISSUEID.match(parts[2]):
+                    raise HTTPError(404, 'No such issue: %s' % parts[2])
+                # Issue files can be edited by hand, without the index changing,
+                # while committed ones can't change without tip changing.
+                if issuedb.rev is None:
+                    try:
+                        info = stat(path.join(issuedb.root, issuedb.dbfolder, parts[2]))
+                        state = state, _identity(info)
+                    except OSError:
+                        raise HTTPError(404, 'No such issue: %s' % parts[2])
+
+        etag = '"%s%s"' % (sha1(repr((state, parts, sorted(query.items())))).hexdigest(),
+                           encoding and '-' + encoding or '')
+        headers = [('ETag', etag), ('Vary', 'Accept-Encoding')]
+        if etag in [tag.strip() for tag in environ.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            return 304, headers, ''
+
+        with self._cachelock:
+            cached = self._cache.pop(etag, None)
+            if cached is not None:
+                # Move it to the end, as the most recently used.
+                self._cache[etag] = cached
+                body, encoding = cached
+            else:
+                body = None
+        if body is None:
+            body = json.dumps(self._route(issuedb, parts, query, environ), default=str)
+            if encoding and len(body) >= self.minimum_gzip:
+                buffer = StringIO()
+                gzipfile = GzipFile(mode='wb', fileobj=buffer)
+                gzipfile.write(body)
+                gzipfile.close()
+                body = buffer.getvalue()
+            else:
+                encoding = None
+            with self._cachelock:
+                self._cache.pop(etag, None)
+                while self._cache and len(self._cache) >= self.cachesize:
+                    self._cache.popitem(last=False)
+                self._cache[etag] = body, encoding
+
+        headers.append(('Content-Type', 'application/json'))
+        headers.append(('Content-Length', str(len(body))))
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        return 200, headers, body
+
+    def _route(self, issuedb, parts, query, environ):
+        """Return the data for the given path, ready for serialization."""
+        if issuedb is None:
+            return {'repositories': sorted(self.issuedbs)}
+
+        if parts[1:] == ['issues']:
+            return self._list(issuedb, query, environ)
+        if len(parts) == 3 and parts[1] == 'issues':
+            issue = issuedb.issue(parts[2], detail=False)
+            if not issue:
+                raise HTTPError(404, 'No such issue: %s' % parts[2])
+            return {'id': parts[2], 'issue': issue[0]['data']}
+        if len(parts) == 4 and parts[1] == 'issues' and parts[3] == 'history':
+            issue = issuedb.issue(parts[2], detail=True)
+            if not issue:
+                raise HTTPError(404, 'No such issue: %s' % parts[2])
+            return {'id': parts[2], 'history': issue}
+        if parts[1:] == ['related']:
+            filenames = query.get('file')
+            if not filenames:
+                raise HTTPError(400, 'At least one file parameter is required')
+            status = query.get('status', ['open'])[0]
+            return {'related': issuedb.related(filenames, detail=True, status=status)}
+        if len(parts) == 3 and parts[1] == 'burndown':
+            return {'group': parts[2], 'burndown': issuedb.burndown(parts[2])}
+        if parts[1:] == ['stats']:
+            by = query.get('by', ['group'])
+            status = query.get('status', ['open'])[0]
+            return {'by': by, 'status': status, 'stats': issuedb.stats(by=by, status=status)}
+
+        raise HTTPError(404, 'Not found: /%s' % '/'.join(parts))
+
+    def _list(self, issuedb, query, environ):
+        """\
+        A page of the issues with the requested status, in id order unless
+        another sort is requested.  The next link carries a cursor rather than
+        an offset, so that paging neither skips nor repeats issues when others
+        are added or removed in between.
+        """
+        status = query.get('status', ['open'])[0]
+        sort = [key for key in query.get('sort', [''])[0].split(',') if key] or ['id']
+        after = query.get('after', [None])[0]
+        at = query.get('at', [None])[0]
+        try:
+            offset = max(0, int(query.get('offset', [0])[0]))
+            limit = min(self.pagesize, max(1, int(query.get('limit', [self.pagesize])[0])))
+        except ValueError:
+            raise HTTPError(400, 'offset and limit must be integers')
+
+        try:
+            # One extra issue tells us whether there is another page.
+            issues = issuedb.issues(status=status, at=at, sort=sort,
+                                    limit=limit + 1, offset=offset, after=after)
+        except (Abort, ValueError), error:
+            raise HTTPError(400, str(error))
+        ids = issues.keys()
+        page = [dict(issues[id], id=id) for id in ids[:limit]]
+
+        if at is None:
+            total = sum(row['count'] for row in issuedb.stats(by=[], status=status))
+        else:
+            total = len(issuedb.issues(status=status, at=at))
+
+        following = None
+        if len(ids) > limit:
+            last = page[-1]
+            following = '%s/%s/issues?status=%s&limit=%d&sort=%s&after=%s' % (
+                environ.get('SCRIPT_NAME', ''), quote(path.basename(issuedb.root)),
+                quote(status), limit, quote(','.join(sort)),
+                quote(sort_cursor(last['id'], last, sort)))
+            if at is not None:
+                following += '&at=%s' % quote(at)
+        return {'issues': page, 'total': total, 'offset': offset,
+                'limit': limit, 'next': following}
+
+
+def serve(repositories, host='localhost', port=8080, **kwargs):
+    """Serve the given repositories with the wsgiref development server."""
+    from wsgiref.simple_server import make_server, WSGIServer
+    from SocketServer import ThreadingMixIn
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    server = make_server(host, port, YAMLTrakApp(repositories, **kwargs),
+                         server_class=ThreadingWSGIServer)
+    server.serve_forever()